@@ -0,0 +1,351 @@
+import argparse
+import copy
+import json
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from utils.installer import InstallerManager
+from utils.logger import log_context, new_install_id, setup_logging
+from utils.verification import TIERS
+
+# Exit codes
+EXIT_OK = 0
+EXIT_DEVICE_FAILED = 1
+EXIT_USAGE = 2
+EXIT_IMAGE_FAILED = 3
+EXIT_INTERRUPTED = 130
+
+MODES = ('standard', 'streaming', 'incremental', 'station')
+
+class ManifestError(Exception):
+    """The manifest is missing or malformed"""
+
+def _merge(base: Dict, override: Dict) -> Dict:
+    """Recursively merge ``override`` into a copy of ``base``"""
+    merged = copy.deepcopy(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+def load_manifest(path: Path) -> Dict:
+    """Load and validate a YAML or JSON provisioning manifest
+
+    Example::
+
+        image:
+          url: https://example.com/system.img.xz   # or path: ./system.img
+          checksum: <sha256>                       # required with path
+          merkle_root: <root>                      # optional, verify chunks against system.merkle
+        mode: standard                             # streaming, incremental, station
+        options:
+          jobs: 2                 # devices provisioned in parallel
+          readback_verify: true
+          prepare: true           # format the card before writing
+          verify: true            # check the installed card
+          verify_tier: standard   # quick, standard or full (whole-device hash)
+          offline_config: true    # build the configuration into the image
+          probe: false            # check for fake capacity and slow writes first
+          mirrors: [http://station-2:8765]  # stations serving their cached images
+          serve_mirror: false     # or a port: serve this station's cached images meanwhile
+        defaults:
+          network: {ssid: Workshop, password: secret}
+          printer: {model: Prusa i3 MK3S+, connection: USB}
+        devices:
+          - target: E:
+          - target: /dev/sdc
+            mount: /media/card    # where the card's filesystem is mounted
+            config:
+              printer: {model: Creality Ender 3}
+    """
+    try:
+        with open(path, 'r') as f:
+            if Path(path).suffix.lower() == '.json':
+                manifest = json.load(f)
+            else:
+                import yaml
+                manifest = yaml.safe_load(f)
+    except Exception as e:
+        raise ManifestError(f"Cannot read manifest {path}: {e}")
+
+    if not isinstance(manifest, dict):
+        raise ManifestError("Manifest must be a mapping")
+    image = manifest.setdefault('image', {})
+    if not isinstance(image, dict):
+        raise ManifestError("'image' must be a mapping")
+    if image.get('path') and image.get('url'):
+        raise ManifestError("Give either image.path or image.url, not both")
+    options = manifest.setdefault('options', {})
+    if image.get('path') and not image.get('checksum') and options.get('verify_image', True):
+        raise ManifestError("image.checksum is required for a local image")
+    if options.get('verify_tier', 'standard') not in TIERS:
+        raise ManifestError(f"Unknown verify_tier '{options['verify_tier']}', expected one of {', '.join(TIERS)}")
+    if not isinstance(options.get('mirrors', []), list):
+        raise ManifestError("'options.mirrors' must be a list of URLs")
+    mode = manifest.setdefault('mode', 'standard')
+    if mode not in MODES:
+        raise ManifestError(f"Unknown mode '{mode}', expected one of {', '.join(MODES)}")
+    if mode in ('streaming', 'station') and image.get('path'):
+        raise ManifestError(f"{mode.capitalize()} mode needs image.url")
+
+    devices = manifest.get('devices')
+    if not isinstance(devices, list) or not devices:
+        raise ManifestError("'devices' must be a non-empty list")
+    defaults = manifest.get('defaults') or {}
+    base_config = _merge({'system': {}, 'network': {'ssid': '', 'password': ''},
+                          'printer': {'model': '', 'connection': ''}}, defaults)
+    targets = set()
+    for index, device in enumerate(devices):
+        if isinstance(device, str):
+            device = devices[index] = {'target': device}
+        if not isinstance(device, dict) or not device.get('target'):
+            raise ManifestError(f"Device {index} needs a 'target'")
+        if device['target'] in targets:
+            raise ManifestError(f"Device {device['target']} is listed twice")
+        targets.add(device['target'])
+        device.setdefault('mount', device['target'])
+        device['config'] = _merge(base_config, device.get('config') or {})
+    return manifest
+
+class Provisioner:
+    """Run the install pipeline for every device of a manifest
+
+    Progress is written to ``output`` as one JSON object per line, each
+    with an ``event`` key: ``start``, ``progress`` (throttled byte
+    progress of a stage), ``stage`` (a finished stage), ``device`` (the
+    result of one device), ``verify`` (the failed checks of a device's
+    verification) and ``summary``.
+    """
+
+    # Minimum seconds between progress lines of the same stage
+    PROGRESS_INTERVAL = 0.5
+
+    def __init__(self, manifest: Dict, installer: Optional[InstallerManager] = None,
+                 output=sys.stdout):
+        self.logger = logging.getLogger(__name__)
+        self.manifest = manifest
+        self.installer = installer or InstallerManager()
+        self.output = output
+        self.options = manifest['options']
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._last_progress: Dict = {}
+        # Ties the log records and trace spans of this run together
+        self.install_id = new_install_id()
+
+    def emit(self, event: str, **fields):
+        line = json.dumps({'event': event, 'time': time.time(), **fields})
+        with self._lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def _on_progress(self, event: Dict):
+        device = getattr(self._local, 'device', None)
+        if event['done']:
+            self.emit('stage', device=device, stage=event['stage'],
+                      bytes=event['bytes_done'], elapsed=round(event['elapsed'], 3),
+                      avg_rate=round(event['avg_rate']))
+            return
+        key = (device, event['stage'])
+        now = time.monotonic()
+        if now - self._last_progress.get(key, 0.0) < self.PROGRESS_INTERVAL:
+            return
+        self._last_progress[key] = now
+        self.emit('progress', device=device, stage=event['stage'],
+                  bytes_done=event['bytes_done'], bytes_total=event['bytes_total'],
+                  rate=round(event['rate']),
+                  eta=round(event['eta'], 1) if event['eta'] is not None else None)
+
+    def _configure(self):
+        image = self.manifest['image']
+        installer = self.installer
+        if image.get('path'):
+            installer.system_files_url = None
+        elif image.get('url'):
+            installer.system_files_url = image['url']
+        if image.get('checksum'):
+            installer.expected_checksum = image['checksum'].lower()
+        if image.get('merkle_root'):
+            installer.expected_merkle_root = image['merkle_root'].lower()
+        installer.readback_verify = self.options.get('readback_verify', True)
+        installer.offline_config = self.options.get('offline_config', True)
+        if 'verify_tier' in self.options:
+            installer.verify_tier = self.options['verify_tier']
+        if 'download_segments' in self.options:
+            installer.download_segments = self.options['download_segments']
+        if 'mirrors' in self.options:
+            installer.mirrors = list(self.options['mirrors'])
+        serve = self.options.get('serve_mirror', False)
+        if serve:
+            installer.start_mirror(port=None if serve is True else int(serve))
+
+    def _image(self) -> Optional[Path]:
+        """Download (or locate) and verify the image shared by all devices"""
+        image = self.manifest['image']
+        if image.get('path'):
+            image_path = Path(image['path'])
+            if not image_path.exists():
+                self.logger.error(f"Image {image_path} does not exist")
+                return None
+        else:
+            image_path = self.installer.download_system_image()
+            if not image_path:
+                return None
+        if self.options.get('verify_image', True):
+            if not self.installer.verify_image_checksum(image_path):
+                return None
+        return image_path
+
+    def _provision(self, device: Dict, image_path: Optional[Path]) -> bool:
+        installer = self.installer
+        target = device['target']
+        mount = device['mount']
+        mode = self.manifest['mode']
+        self._local.device = target
+        self.emit('start', device=target, install_id=self.install_id)
+        with log_context(install_id=self.install_id, device=target):
+            try:
+                if self.options.get('probe', False):
+                    # Counterfeit or failing cards are not worth writing
+                    report = installer.probe_card(target, restore=False)
+                    self.emit('probe', device=target, verdict=report['verdict'],
+                              reasons=report['reasons'])
+                    if report['verdict'] == 'fail':
+                        return False
+                # The same install as the GUI's, journal included
+                ok = installer.install_system(
+                    target, copy.deepcopy(device['config']),
+                    streaming=mode == 'streaming', incremental=mode == 'incremental',
+                    image_path=image_path, mount=mount,
+                    prepare=self.options.get('prepare', True), verify=self.options.get('verify', True)
+                )
+                return self._verified(device, ok)
+            except Exception as e:
+                self.logger.error(f"Provisioning {target} failed: {e}")
+                return False
+            finally:
+                self._local.device = None
+
+    def _verified(self, device: Dict, ok: bool) -> bool:
+        """Report the failed checks of a device's verification"""
+        # Cards configured through the image are verified raw, the others where mounted
+        reports = self.installer.verification_reports
+        report = reports.get(device['target']) or reports.get(device['mount'])
+        if report:
+            self.emit('verify', device=self._local.device, tier=report['tier'], ok=report['ok'],
+                      counts=report['counts'], duration=report['duration'],
+                      failed=[item for item in report['items'] if item['status'] == 'failed'])
+        return ok
+
+    def _run_station(self, devices: List[Dict]) -> Dict[str, bool]:
+        targets = [device['target'] for device in devices]
+        configs = {device['target']: device['config'] for device in devices}
+        mounts = {device['target']: device['mount'] for device in devices}
+        results = self.installer.install_station(
+            targets, devices[0]['config'], configs, mounts,
+            prepare=self.options.get('prepare', True), verify=self.options.get('verify', True)
+        )
+        for device in devices:
+            self._local.device = device['target']
+            self._verified(device, results[device['target']])
+        self._local.device = None
+        return results
+
+    def run(self) -> int:
+        """Provision all devices; returns the process exit code"""
+        self._configure()
+        devices = self.manifest['devices']
+        telemetry = self.installer.telemetry
+        telemetry.reset()
+        telemetry.add_listener(self._on_progress)
+        started = time.monotonic()
+        with log_context(install_id=self.install_id):
+            try:
+                if self.manifest['mode'] == 'station':
+                    results = self._run_station(devices)
+                else:
+                    image_path = None
+                    if self.manifest['mode'] != 'streaming':
+                        image_path = self._image()
+                        if not image_path:
+                            self.emit('summary', ok=False, error="image", devices={},
+                                      elapsed=round(time.monotonic() - started, 3))
+                            return EXIT_IMAGE_FAILED
+                    jobs = max(1, int(self.options.get('jobs', 1)))
+                    with ThreadPoolExecutor(max_workers=jobs) as pool:
+                        outcomes = pool.map(lambda device: self._provision(device, image_path), devices)
+                        results = {device['target']: ok for device, ok in zip(devices, outcomes)}
+            finally:
+                telemetry.remove_listener(self._on_progress)
+                telemetry.log_summary()
+
+        for target, ok in results.items():
+            self.emit('device', device=target, ok=ok)
+        ok = all(results.values())
+        self.emit('summary', ok=ok, devices=results, elapsed=round(time.monotonic() - started, 3),
+                  install_id=self.install_id, stages=telemetry.summary())
+        return EXIT_OK if ok else EXIT_DEVICE_FAILED
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Unattended InnovateOS provisioning")
+    commands = parser.add_subparsers(dest='command', required=True)
+    provision_parser = commands.add_parser('provision', help="install the devices of a manifest")
+    provision_parser.add_argument('manifest', type=Path, help="YAML or JSON manifest")
+    provision_parser.add_argument('--dry-run', action='store_true',
+                                  help="validate the manifest and print the resolved plan")
+    provision_parser.add_argument('--trace', type=Path,
+                                  help="write the stage timings of the run as a Chrome trace")
+    commands.add_parser('devices', help="list removable drives as JSON")
+    mirror_parser = commands.add_parser('mirror', help="serve the cached images to other stations")
+    mirror_parser.add_argument('--host', default="0.0.0.0")
+    mirror_parser.add_argument('--port', type=int, default=None)
+    parser.add_argument('--log-file', type=Path,
+                        help="also write the log to this file as JSON lines, rotated by size")
+    parser.add_argument('--verbose', '-v', action='store_true')
+    args = parser.parse_args(argv)
+
+    # stdout carries machine-readable output only; logs go to stderr
+    setup_logging(args.log_file, level=logging.DEBUG if args.verbose else logging.INFO,
+                  console=sys.stderr)
+
+    if args.command == 'devices':
+        installer = InstallerManager()
+        print(json.dumps(installer.get_available_drives()))
+        return EXIT_OK
+    if args.command == 'mirror':
+        installer = InstallerManager()
+        if not installer.start_mirror(args.host, args.port):
+            return EXIT_USAGE
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            installer.stop_mirror()
+        return EXIT_OK
+
+    try:
+        manifest = load_manifest(args.manifest)
+    except ManifestError as e:
+        logging.getLogger(__name__).error(str(e))
+        return EXIT_USAGE
+    if args.dry_run:
+        print(json.dumps(manifest, indent=2))
+        return EXIT_OK
+    provisioner = Provisioner(manifest)
+    try:
+        return provisioner.run()
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+    finally:
+        if args.trace:
+            from utils.trace import write_chrome_trace
+            write_chrome_trace(provisioner.installer.telemetry.spans(), args.trace)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,26 @@
+import os
 import sys
+import time
 import logging
-from pathlib import Path
 from PyQt6.QtWidgets import QApplication
+from PyQt6.QtCore import QEvent, QObject, QTimer
 from ui.main_window import InstallerWindow
+from utils.logger import setup_logging
 
-def setup_logging():
-    """Set up logging configuration"""
-    log_dir = Path("logs")
-    log_dir.mkdir(exist_ok=True)
+# Set by the startup benchmark: report the first paint of the window and quit
+STARTUP_PROBE = "INNOVATEOS_STARTUP_PROBE"
+# Serve the cached images to other stations, on this port if it is a number
+SERVE_MIRROR = "INNOVATEOS_SERVE_MIRROR"
+
+class FirstPaintProbe(QObject):
+    """Print the wall-clock time of the window's first paint, then quit"""
     
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_dir / "installer.log"),
-            logging.StreamHandler()
-        ]
-    )
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.Paint:
+            obj.removeEventFilter(self)
+            print(f"first-paint {time.time():.6f}", flush=True)
+            QTimer.singleShot(0, QApplication.quit)
+        return False
 
 def main():
     """Main entry point for the installer"""
@@ -32,8 +36,16 @@ def main():
         
         # Create and show main window
         window = InstallerWindow()
+        if os.environ.get(STARTUP_PROBE):
+            probe = FirstPaintProbe(window)
+            window.installEventFilter(probe)
         window.show()
         
+        serve_mirror = os.environ.get(SERVE_MIRROR)
+        if serve_mirror:
+            from utils.installer import get_installer
+            get_installer().start_mirror(port=int(serve_mirror) if serve_mirror.isdigit() else None)
+        
         # Start event loop
         sys.exit(app.exec())
         
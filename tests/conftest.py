@@ -0,0 +1,121 @@
+import hashlib
+import os
+import shutil
+import struct
+import subprocess
+import threading
+import uuid
+from functools import partial
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+MiB = 1024 * 1024
+
+def sparse_image(path: Path, size_mib: int = 16, every: int = 4) -> bytes:
+    """Write an image with random data in every ``every``-th MiB and zeros elsewhere"""
+    data = b''.join(os.urandom(MiB) if index % every == 0 else bytes(MiB) for index in range(size_mib))
+    path.write_bytes(data)
+    return data
+
+def fat_image(path: Path, fat_mib: int = 16, tail_mib: int = 4, fat32: bool = False,
+              gpt: bool = False) -> bytes:
+    """Write an image with an empty FAT partition at 1 MiB and random data after it
+
+    The filesystem is FAT16 unless ``fat32`` and the partition table MBR
+    unless ``gpt``.
+    """
+    sectors = fat_mib * MiB // 512
+    boot = bytearray(512)
+    boot[510:512] = b"\x55\xaa"
+    if fat32:
+        fat_sectors = -(-(sectors + 2) * 4 // 512)
+        boot[0:11] = b"\xeb\x58\x90MSWIN4.1"
+        boot[11:36] = struct.pack("<HBHBHHBHHHII", 512, 1, 32, 2, 0, 0, 0xf8, 0, 32, 64, 2048, sectors)
+        boot[36:90] = struct.pack("<IHHIHH12sBBBI11s8s", fat_sectors, 0, 0, 2, 1, 6, bytes(12),
+                                  0x80, 0, 0x29, 0x1234abcd, b"INNOVATEOS ", b"FAT32   ")
+        # FSInfo: every cluster but the root directory's is free
+        fsinfo = bytearray(512)
+        struct.pack_into("<I", fsinfo, 0, 0x41615252)
+        struct.pack_into("<III", fsinfo, 484, 0x61417272, sectors - 32 - 2 * fat_sectors - 1, 3)
+        struct.pack_into("<I", fsinfo, 508, 0xaa550000)
+        reserved = bytes(boot) + bytes(fsinfo) + bytes(30 * 512)
+        fat = struct.pack("<III", 0x0ffffff8, 0x0fffffff, 0x0fffffff) + bytes(fat_sectors * 512 - 12)
+    else:
+        fat_sectors = -(-(sectors // 2 + 2) * 2 // 512)
+        boot[0:11] = b"\xeb\x3c\x90MSWIN4.1"
+        boot[11:36] = struct.pack("<HBHBHHBHHHII", 512, 2, 1, 2, 512, sectors, 0xf8, fat_sectors,
+                                  32, 64, 2048, 0)
+        boot[36:62] = struct.pack("<BBBI11s8s", 0x80, 0, 0x29, 0x1234abcd, b"INNOVATEOS ", b"FAT16   ")
+        reserved = bytes(boot)
+        fat = b"\xf8\xff\xff\xff" + bytes(fat_sectors * 512 - 4)
+    partition = reserved + fat + fat
+
+    mbr = bytearray(512)
+    mbr[510:512] = b"\x55\xaa"
+    if gpt:
+        total = 2048 + sectors + tail_mib * MiB // 512
+        mbr[446:462] = struct.pack("<B3sB3sII", 0, bytes(3), 0xee, bytes(3), 1, total - 1)
+        header = bytearray(512)
+        header[:8] = b"EFI PART"
+        struct.pack_into("<QII", header, 72, 2, 128, 128)
+        entry = (uuid.UUID("ebd0a0a2-b9e5-4433-87c0-68b6b72699c7").bytes_le + uuid.uuid4().bytes_le
+                 + struct.pack("<QQQ", 2048, 2048 + sectors - 1, 0) + "boot".encode('utf-16-le').ljust(72, b"\0"))
+        head = bytes(mbr) + bytes(header) + entry.ljust(128 * 128, b"\0")
+    else:
+        mbr[446:462] = struct.pack("<B3sB3sII", 0, bytes(3), 0x0c if fat32 else 0x06, bytes(3), 2048, sectors)
+        head = bytes(mbr)
+    data = (head.ljust(MiB, b"\0") + partition + bytes(fat_mib * MiB - len(partition))
+            + os.urandom(tail_mib * MiB))
+    path.write_bytes(data)
+    return data
+
+@pytest.fixture
+def release(tmp_path):
+    """Serve a directory of release files over HTTP; yields (directory, base URL)"""
+    from utils.range_server import RangeRequestHandler
+    directory = tmp_path / "release"
+    directory.mkdir()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(RangeRequestHandler, directory=str(directory)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield directory, f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def publish(directory: Path, data: bytes, name: str = "system.img") -> str:
+    """Put an image and its checksum file into a release directory; returns the checksum"""
+    (directory / name).write_bytes(data)
+    checksum = hashlib.sha256(data).hexdigest()
+    (directory / f"{name}.sha256").write_text(f"{checksum}  {name}\n")
+    return checksum
+
+@pytest.fixture
+def installer(tmp_path, monkeypatch):
+    """An InstallerManager whose cache and temp files stay in the test's directory"""
+    from utils.image_cache import ImageCache
+    from utils.installer import InstallerManager
+    installer = InstallerManager()
+    installer.image_cache = ImageCache(tmp_path / "cache")
+    monkeypatch.chdir(tmp_path)
+    return installer
+
+@pytest.fixture
+def loop_device(tmp_path):
+    """A loop device backed by a 32 MiB file; skipped without root and losetup"""
+    if os.geteuid() != 0 or not shutil.which('losetup'):
+        pytest.skip("loop devices need root and losetup")
+    backing = tmp_path / "loop.img"
+    backing.write_bytes(os.urandom(32 * MiB))
+    result = subprocess.run(['losetup', '--find', '--show', str(backing)],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        pytest.skip(f"no loop device available: {result.stderr.strip()}")
+    device = result.stdout.strip()
+    try:
+        yield device
+    finally:
+        subprocess.run(['losetup', '--detach', device])
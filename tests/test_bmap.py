@@ -0,0 +1,89 @@
+import gzip
+
+from tests.conftest import MiB, sparse_image
+from utils.bmap import BlockMap, check_block_map, generate_bmap, write_mapped_ranges
+from utils.installer import InstallerManager
+from utils.merkle import ChunkManifest
+from utils.raw_writer import RawWriter
+
+def _without_range(block_map: BlockMap, index: int) -> BlockMap:
+    ranges = [entry for number, entry in enumerate(block_map.ranges) if number != index]
+    return BlockMap(block_map.image_size, block_map.block_size, ranges)
+
+def test_generated_map_matches_its_image(tmp_path):
+    image = tmp_path / "system.img"
+    sparse_image(image)
+    block_map = generate_bmap(image)
+
+    assert block_map.mapped_bytes == 4 * MiB
+    assert check_block_map(block_map, image).ok
+
+def test_map_leaving_out_data_is_rejected(tmp_path):
+    image = tmp_path / "system.img"
+    sparse_image(image)
+    block_map = _without_range(generate_bmap(image), 1)
+
+    verifier = check_block_map(block_map, image)
+    assert not verifier.ok
+    assert verifier.unmapped_data == [4 * MiB]
+
+def test_map_of_another_size_is_rejected(tmp_path):
+    image = tmp_path / "system.img"
+    sparse_image(image)
+    block_map = generate_bmap(image)
+    block_map.image_size -= MiB
+
+    verifier = check_block_map(block_map, image)
+    assert not verifier.ok
+    assert "bytes" in verifier.problem()
+
+def test_map_is_checked_against_a_compressed_image(tmp_path):
+    raw = tmp_path / "raw.img"
+    data = sparse_image(raw)
+    image = tmp_path / "system.img"
+    image.write_bytes(gzip.compress(data, 1))
+    block_map = generate_bmap(raw)
+
+    assert check_block_map(block_map, image).ok
+    assert not check_block_map(_without_range(block_map, 2), image).ok
+
+def test_manifest_vouches_for_unmapped_chunks(tmp_path):
+    image = tmp_path / "system.img"
+    sparse_image(image)
+    manifest = ChunkManifest.build(image, chunk_size=MiB)
+    block_map = generate_bmap(image)
+
+    assert check_block_map(block_map, image, manifest).ok
+    verifier = check_block_map(_without_range(block_map, 3), image, manifest)
+    assert verifier.unmapped_data == [12 * MiB]
+
+def test_installer_drops_a_map_that_does_not_match(tmp_path):
+    image = tmp_path / "system.img"
+    sparse_image(image)
+    bmap_path = image.with_suffix(".bmap")
+    installer = InstallerManager()
+    installer.system_files_url = None
+
+    generate_bmap(image).save(bmap_path)
+    assert installer._fetch_block_map(image) is not None
+
+    _without_range(generate_bmap(image), 0).save(bmap_path)
+    assert installer._fetch_block_map(image) is None
+    assert not bmap_path.exists()
+
+def test_resumed_write_of_a_compressed_image_skips_what_is_on_the_card(tmp_path):
+    raw = tmp_path / "raw.img"
+    data = sparse_image(raw)
+    image = tmp_path / "system.img.gz"
+    image.write_bytes(gzip.compress(data, 1))
+    block_map = generate_bmap(raw)
+    # An interrupted write left the first half of the image on the card
+    target = tmp_path / "card.img"
+    target.write_bytes(data[:8 * MiB])
+
+    writer = RawWriter(str(target))
+    with writer:
+        write_mapped_ranges(writer, image, block_map, start=8 * MiB)
+
+    assert writer.bytes_written == 2 * MiB
+    assert target.read_bytes() == data
@@ -0,0 +1,41 @@
+import os
+import threading
+
+from tests.conftest import MiB
+from utils.card_probe import CANCELLED, PASS, CardProbe
+from utils.fake_device import FakeDevice
+
+def _device(tmp_path) -> FakeDevice:
+    device = FakeDevice(tmp_path / "card.img", 64 * MiB).create()
+    with open(device.path, 'r+b') as f:
+        f.write(os.urandom(64 * MiB))
+    return device
+
+def _probe(device: FakeDevice, **kwargs) -> CardProbe:
+    return CardProbe(str(device.path), device.size, samples=16, sequential_bytes=4 * MiB,
+                     random_writes=16, make_writer=device.writer, read=device.read, **kwargs)
+
+def test_probe_reports_progress_up_to_its_total(tmp_path):
+    device = _device(tmp_path)
+    updates = []
+
+    report = _probe(device, progress=lambda done, total: updates.append((done, total))).run()
+
+    assert report['verdict'] == PASS
+    assert [done for done, _ in updates] == sorted(done for done, _ in updates)
+    assert updates[-1][0] == updates[-1][1]
+
+def test_cancelled_probe_restores_the_card(tmp_path):
+    device = _device(tmp_path)
+    before = device.path.read_bytes()
+    cancel = threading.Event()
+
+    def progress(done, total):
+        if done > total // 4:
+            cancel.set()
+
+    report = _probe(device, restore=True, progress=progress, cancel=cancel).run()
+
+    assert report['verdict'] == CANCELLED
+    assert 'sequential_write' not in report
+    assert device.path.read_bytes() == before
@@ -0,0 +1,59 @@
+import hashlib
+import io
+import json
+
+from cli import Provisioner, load_manifest
+from tests.conftest import MiB, fat_image, publish
+from utils.fat import read_files
+
+def _read_at(path):
+    data = path.read_bytes()
+    return lambda offset, length: data[offset:offset + length]
+
+def test_devices_are_provisioned_through_the_journaled_install(installer, release, tmp_path, monkeypatch):
+    directory, url = release
+    publish(directory, fat_image(tmp_path / "system.img"))
+    targets = [str(tmp_path / "card-a.img"), str(tmp_path / "card-b.img")]
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text(json.dumps({
+        'image': {'url': f"{url}/system.img"},
+        'options': {'jobs': 2},
+        'defaults': {'printer': {'model': 'Prusa i3 MK3S+', 'connection': 'USB'}},
+        'devices': [{'target': targets[0]},
+                    {'target': targets[1], 'config': {'printer': {'model': 'Creality Ender 3'}}}]
+    }))
+    journals = []
+    open_journal = installer.open_journal
+    monkeypatch.setattr(installer, 'open_journal',
+                        lambda *args, **kwargs: journals.append(args[0]) or open_journal(*args, **kwargs))
+    output = io.StringIO()
+
+    assert Provisioner(load_manifest(manifest_path), installer, output).run() == 0
+
+    assert sorted(journals) == sorted(targets)
+    events = [json.loads(line) for line in output.getvalue().splitlines()]
+    verified = {event['device']: event['ok'] for event in events if event['event'] == 'verify'}
+    assert verified == {target: True for target in targets}
+    for target, model in zip(targets, [b'Prusa i3 MK3S+', b'Creality Ender 3']):
+        files = read_files(_read_at(tmp_path / target), ['innovateos/config/printer.yaml'])
+        assert model in files['innovateos/config/printer.yaml']
+    # Finished installs leave no journal to resume
+    assert not list((tmp_path / "cache" / "journal").glob("*"))
+
+def test_manifest_checksum_stands_in_for_a_missing_sha256(installer, release, tmp_path):
+    directory, url = release
+    data = fat_image(tmp_path / "system.img")
+    (directory / "system.img").write_bytes(data)
+    target = str(tmp_path / "card.img")
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text(json.dumps({
+        'image': {'url': f"{url}/system.img", 'checksum': hashlib.sha256(data).hexdigest().upper()},
+        'defaults': {'printer': {'model': 'Prusa i3 MK3S+', 'connection': 'USB'}},
+        'devices': [{'target': target}]
+    }))
+    output = io.StringIO()
+
+    assert Provisioner(load_manifest(manifest_path), installer, output).run() == 0
+
+    assert not (directory / "system.img.sha256").exists()
+    assert (tmp_path / target).read_bytes()[17 * MiB:] == data[17 * MiB:]
@@ -0,0 +1,18 @@
+from pathlib import PurePosixPath, PureWindowsPath
+
+from utils.config_bundle import MANIFEST_PATH, build_bundle, drive_root, verify_bundle, write_bundle
+
+def test_bare_drive_letter_is_anchored_at_its_root():
+    assert drive_root("E:", PureWindowsPath) == PureWindowsPath("E:\\")
+    assert drive_root("E:", PureWindowsPath) / MANIFEST_PATH == \
+        PureWindowsPath("E:\\innovateos\\config\\manifest.json")
+    assert drive_root("E:boot", PureWindowsPath) == PureWindowsPath("E:\\boot")
+    assert drive_root("E:\\", PureWindowsPath) == PureWindowsPath("E:\\")
+    assert drive_root("/media/card", PurePosixPath) == PurePosixPath("/media/card")
+
+def test_written_bundle_verifies_until_a_file_changes(tmp_path):
+    write_bundle(str(tmp_path), build_bundle({'innovateos/config/printer.yaml': b"model: MK3S\n"}))
+
+    assert verify_bundle(str(tmp_path)) == []
+    (tmp_path / "innovateos" / "config" / "printer.yaml").write_bytes(b"model: Ender\n")
+    assert verify_bundle(str(tmp_path)) == ['innovateos/config/printer.yaml']
@@ -0,0 +1,71 @@
+import gzip
+import lzma
+import os
+
+import pytest
+
+from tests.conftest import MiB
+from utils.decompress import OUTPUT_CHUNK, decompressed_chunks
+
+zstandard = pytest.importorskip("zstandard")
+
+def chunked(data: bytes, size: int = MiB):
+    return (data[offset:offset + size] for offset in range(0, len(data), size))
+
+def decompress(data: bytes, compression: str):
+    """The decompressed stream and the size of its largest piece"""
+    pieces = list(decompressed_chunks(chunked(data), compression))
+    return b''.join(pieces), max(len(piece) for piece in pieces)
+
+@pytest.fixture(scope="module")
+def image() -> bytes:
+    # Sparse like a release image: data, a long run of zeros, more data
+    return os.urandom(3 * MiB) + bytes(48 * MiB) + os.urandom(2 * MiB + 17)
+
+@pytest.mark.parametrize('compress', [
+    lambda data: zstandard.ZstdCompressor().compress(data),
+    lambda data: zstandard.ZstdCompressor(write_content_size=False).compress(data),
+    lambda data: gzip.compress(data, compresslevel=1),
+    lambda data: lzma.compress(data, preset=0),
+], ids=['zst', 'zst-unknown-size', 'gz', 'xz'])
+def test_single_frame_output_is_bounded(image, compress):
+    compressed = compress(image)
+    compression = {b'\x28': 'zst', b'\x1f': 'gz', b'\xfd': 'xz'}[compressed[:1]]
+
+    data, largest = decompress(compressed, compression)
+
+    assert data == image
+    assert largest <= OUTPUT_CHUNK
+
+def test_zstd_frames_are_decoded_in_order(image):
+    compressor = zstandard.ZstdCompressor(write_checksum=True)
+    frames = b''.join(compressor.compress(image[offset:offset + 2 * MiB])
+                      for offset in range(0, len(image), 2 * MiB))
+    skippable = (0x184D2A5E).to_bytes(4, 'little') + (4).to_bytes(4, 'little') + b'seek'
+    # A large frame between small ones is streamed without losing the order
+    large = zstandard.ZstdCompressor().compress(image)
+
+    data, largest = decompress(frames + skippable + large + frames, 'zst')
+
+    assert data == image * 3
+    assert largest <= OUTPUT_CHUNK
+
+@pytest.mark.parametrize('multi_frame', [False, True])
+def test_truncated_zstd_stream_is_an_error(image, multi_frame):
+    compressor = zstandard.ZstdCompressor()
+    if multi_frame:
+        compressed = b''.join(compressor.compress(image[offset:offset + 4 * MiB])
+                              for offset in range(0, len(image), 4 * MiB))
+    else:
+        compressed = compressor.compress(image)
+
+    with pytest.raises(ValueError, match="Truncated"):
+        decompress(compressed[:-5], 'zst')
+
+def test_corrupt_zstd_frame_is_an_error():
+    data = os.urandom(4 * MiB)
+    compressed = bytearray(zstandard.ZstdCompressor(write_checksum=True).compress(data))
+    compressed[len(compressed) // 2] ^= 0xff
+
+    with pytest.raises(zstandard.ZstdError):
+        decompress(bytes(compressed), 'zst')
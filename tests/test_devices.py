@@ -0,0 +1,146 @@
+import logging
+import queue
+from types import SimpleNamespace
+
+from tests.conftest import sparse_image
+from utils import devices, write_tuning
+from utils.devices import DeviceTable, FakeBackend, LinuxBackend, WmiBackend, device_identity
+from utils.write_tuning import TuningStore
+
+class FakeWmi:
+    """The parts of a WMI connection identity lookups use"""
+
+    def __init__(self):
+        self.drive = SimpleNamespace(DeviceID="\\\\.\\PHYSICALDRIVE2", Model="SanDisk Ultra USB Device ",
+                                     SerialNumber=" 4C530001 ")
+        partition = SimpleNamespace(associators=lambda name: [self.drive]
+                                    if name == "Win32_DiskDriveToDiskPartition" else [])
+        self.disk = SimpleNamespace(DeviceID="E:", associators=lambda name: [partition]
+                                    if name == "Win32_LogicalDiskToPartition" else [])
+
+    def Win32_LogicalDisk(self, DeviceID):
+        return [self.disk] if DeviceID == self.disk.DeviceID else []
+
+    def Win32_DiskDrive(self, DeviceID):
+        return [self.drive] if DeviceID == self.drive.DeviceID else []
+
+def _backend() -> WmiBackend:
+    backend = WmiBackend()
+    backend._local.connection = FakeWmi()
+    return backend
+
+def _sysfs(root, name: str, **attributes):
+    """Add a disk with the given attribute files to a fake /sys/block"""
+    for attribute, value in attributes.items():
+        path = root / name / attribute.replace('__', '/')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f"{value}\n")
+
+def _uevent(action: str, name: str, devtype: str = 'disk', subsystem: str = 'block') -> bytes:
+    fields = [f"{action}@/devices/platform/{name}", f"ACTION={action}", f"SUBSYSTEM={subsystem}",
+              f"DEVTYPE={devtype}", f"DEVNAME={name}"]
+    return "\0".join(fields).encode() + b"\0"
+
+def test_table_follows_hotplug_events():
+    card = {'letter': "E:", 'label': 'NO NAME', 'size': 8 << 30, 'free_space': 0}
+    backend = FakeBackend([card])
+    table = DeviceTable(backend)
+    events = queue.Queue()
+    listener = lambda action, drive: events.put((action, drive))
+    table.add_listener(listener)
+    table.start()
+    try:
+        assert events.get(timeout=2) == ('refresh', None)
+        assert table.devices() == [card]
+
+        backend.insert("F:", 16 << 30, label='PRINTER')
+        assert events.get(timeout=2) == ('add', {'letter': "F:", 'label': 'PRINTER',
+                                                 'size': 16 << 30, 'free_space': 0})
+        backend.eject("E:")
+        assert events.get(timeout=2) == ('remove', card)
+        assert [drive['letter'] for drive in table.devices()] == ["F:"]
+
+        # Listeners that were removed hear nothing more
+        table.remove_listener(listener)
+        backend.eject("F:")
+        assert table.devices() == []
+        assert events.empty()
+    finally:
+        table.stop()
+
+def test_uevents_of_removable_disks_become_drive_events(tmp_path):
+    sys_block = tmp_path / "sys" / "block"
+    _sysfs(sys_block, "mmcblk0", size=62333952)
+    _sysfs(sys_block, "mmcblk0boot0", size=8192)
+    _sysfs(sys_block, "sda", size=976773168, removable=0)
+    _sysfs(sys_block, "loop3", size=65536, loop__backing_file="/tmp/card.img")
+    backend = LinuxBackend(str(sys_block), str(tmp_path / "dev"))
+    events = []
+
+    def handle(message: bytes):
+        backend._handle_uevent(message, lambda action, drive: events.append((action, drive)))
+
+    handle(_uevent('add', "mmcblk0"))
+    handle(_uevent('change', "loop3"))
+    assert events == [
+        ('add', {'letter': str(tmp_path / "dev" / "mmcblk0"), 'label': 'NO NAME',
+                 'size': 62333952 * 512, 'free_space': 0}),
+        ('change', {'letter': str(tmp_path / "dev" / "loop3"), 'label': 'NO NAME',
+                    'size': 65536 * 512, 'free_space': 0}),
+    ]
+
+    events.clear()
+    handle(_uevent('add', "mmcblk0p1", devtype='partition'))
+    handle(_uevent('add', "mmcblk0", subsystem='mmc'))
+    handle(b"libudev\0" + _uevent('add', "mmcblk0"))
+    assert events == []
+
+    # A card pulled from its reader leaves a disk of size 0
+    (sys_block / "mmcblk0" / "size").write_text("0\n")
+    handle(_uevent('change', "mmcblk0"))
+    handle(_uevent('remove', "loop3"))
+    handle(_uevent('add', "sda"))
+    handle(_uevent('add', "mmcblk0boot0"))
+    assert events == [('remove', {'letter': str(tmp_path / "dev" / name)})
+                      for name in ("mmcblk0", "loop3", "sda", "mmcblk0boot0")]
+
+def test_wmi_identifies_the_disk_behind_a_volume():
+    expected = {'model': "SanDisk Ultra USB Device", 'serial': "4C530001"}
+    assert _backend().identity("\\\\.\\E:") == expected
+    assert _backend().identity("E:\\") == expected
+    assert _backend().identity("\\\\.\\PhysicalDrive2") == expected
+    assert _backend().identity("\\\\.\\F:") == {}
+
+def test_windows_targets_are_identified_through_wmi(monkeypatch):
+    monkeypatch.setattr(devices.sys, 'platform', 'win32')
+    monkeypatch.setattr(devices, '_shared_wmi', _backend())
+
+    identity = device_identity("\\\\.\\E:")
+
+    assert identity['model'] == "SanDisk Ultra USB Device"
+    assert identity['serial'] == "4C530001"
+
+def test_tuning_of_an_unidentified_card_is_logged(tmp_path, caplog):
+    store = TuningStore(tmp_path / "write_tuning.json")
+    identity = {'target': "\\\\.\\E:", 'size': None, 'model': None, 'serial': None}
+
+    with caplog.at_level(logging.WARNING, logger="utils.write_tuning"):
+        store.put(identity, {'block_size': 4096, 'queue_depth': 1, 'rate': 1.0})
+
+    assert "No serial or model known" in caplog.text
+    assert not store.path.exists()
+
+def test_file_targets_are_written_with_the_defaults(installer, tmp_path, monkeypatch):
+    image = tmp_path / "system.img"
+    sparse_image(image)
+    trials = []
+    monkeypatch.setattr(write_tuning.WriteTuner, 'calibrate', lambda self: trials.append(self))
+    installer.telemetry.reset()
+
+    # Cards imaged to a file that the write has not created yet
+    settings = installer.tune_write(str(tmp_path / "card.img"), image)
+
+    assert settings['source'] == 'default'
+    assert not trials
+    stage = installer.stage_timings()[0]
+    assert stage['stage'] == 'tune_write' and 'trials' not in stage
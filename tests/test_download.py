@@ -0,0 +1,74 @@
+import json
+import logging
+import os
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from tests.conftest import MiB, publish
+from utils.download import RangedDownloader
+
+def _interrupt(url: str, destination, after: int) -> int:
+    """Start a download, drop one segment after ``after`` bytes; returns the bytes kept"""
+    dropped = threading.Event()
+
+    def progress(done):
+        if done >= after and not dropped.is_set():
+            dropped.set()
+            raise ConnectionError("connection reset")
+
+    downloader = RangedDownloader(url, destination, segments=2, chunk_size=64 * 1024,
+                                  retries=0, progress=progress)
+    assert not downloader.download()
+    state = json.loads(downloader.state_path.read_text())
+    return sum(done for _, _, done in state['segments'])
+
+def test_interrupted_download_resumes_from_its_state(release, tmp_path):
+    directory, url = release
+    data = os.urandom(8 * MiB)
+    publish(directory, data)
+    destination = tmp_path / "system.img"
+    kept = _interrupt(f"{url}/system.img", destination, MiB)
+    assert MiB <= kept < len(data)
+    progress = []
+
+    downloader = RangedDownloader(f"{url}/system.img", destination, segments=2,
+                                  chunk_size=64 * 1024, progress=progress.append)
+    assert downloader.download()
+
+    # Progress counts on from what the sidecar recorded
+    assert progress[0] > kept and progress[-1] == len(data)
+    assert destination.read_bytes() == data
+    assert not downloader.state_path.exists()
+
+def test_server_ignoring_ranges_gets_a_single_stream(tmp_path):
+    data = os.urandom(2 * MiB)
+    (tmp_path / "system.img").write_bytes(data)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(SimpleHTTPRequestHandler, directory=str(tmp_path)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    destination = tmp_path / "download.img"
+    try:
+        downloader = RangedDownloader(f"http://127.0.0.1:{server.server_port}/system.img", destination)
+        assert downloader.download()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert destination.read_bytes() == data
+    assert not downloader.state_path.exists()
+
+def test_resumed_image_matches_its_published_checksum(installer, release, caplog):
+    directory, url = release
+    data = os.urandom(8 * MiB)
+    sha256 = publish(directory, data)
+    installer.system_files_url = f"{url}/system.img"
+    installer.download_segments = 2
+    _interrupt(installer.system_files_url, installer.image_cache.path_for(sha256), 2 * MiB)
+
+    with caplog.at_level(logging.INFO, logger="utils.download"):
+        image_path = installer.download_system_image()
+
+    assert "Resuming download" in caplog.text
+    assert image_path == installer.image_cache.path_for(sha256)
+    assert installer.verify_image_checksum(image_path)
+    assert installer.image_cache.get(sha256)['verified']
@@ -0,0 +1,121 @@
+import uuid
+
+import pytest
+
+from tests.conftest import MiB, fat_image
+from utils.fat import FatVolume, inject_files, read_files
+from utils.overlay import PatchSet
+from utils.partitions import find_fat_partition, read_partitions
+
+def _read_at(data):
+    return lambda offset, length: data[offset:offset + length]
+
+def _volume(data) -> FatVolume:
+    return FatVolume(_read_at(data), find_fat_partition(_read_at(data))['offset'])
+
+def _free_clusters(volume: FatVolume) -> int:
+    return sum(1 for cluster in range(2, volume.cluster_count + 2) if volume.fat_entry(cluster) == 0)
+
+def test_mbr_partition_is_found(tmp_path):
+    data = fat_image(tmp_path / "system.img")
+
+    partitions = read_partitions(_read_at(data))
+
+    assert partitions == [{'scheme': 'mbr', 'type': 0x06, 'offset': MiB, 'size': 16 * MiB, 'index': 1}]
+    assert find_fat_partition(_read_at(data)) == partitions[0]
+
+def test_gpt_partition_is_found(tmp_path):
+    data = fat_image(tmp_path / "system.img", fat32=True, gpt=True)
+
+    partition, = read_partitions(_read_at(data))
+
+    assert partition['scheme'] == 'gpt'
+    assert partition['type'] == uuid.UUID("ebd0a0a2-b9e5-4433-87c0-68b6b72699c7")
+    assert partition['name'] == 'boot'
+    assert (partition['offset'], partition['size']) == (MiB, 16 * MiB)
+    assert find_fat_partition(_read_at(data)) == partition
+
+@pytest.mark.parametrize('fat32', [False, True], ids=['fat16', 'fat32'])
+def test_injected_files_are_read_back(tmp_path, fat32):
+    data = fat_image(tmp_path / "system.img", fat32=fat32)
+    files = {
+        'innovateos/config/printer.yaml': b"model: Prusa i3 MK3S+\n",
+        'innovateos/config/network-settings.yaml': b"ssid: Workshop\n" * 500,
+        'README.TXT': b"",
+    }
+
+    patches = inject_files(_read_at(data), files)
+
+    assert patches.end <= 17 * MiB
+    patched = patches.apply(0, data)
+    assert read_files(_read_at(patched), list(files)) == files
+    volume = _volume(patched)
+    assert volume.fat_type == (32 if fat32 else 16)
+    config = volume._resolve('innovateos/config', False, None)
+    entries = {entry.name: entry for entry in volume.list_directory(config)}
+    assert set(entries) == {'printer.yaml', 'network-settings.yaml'}
+    # Long names get LFN entries in front of a unique 8.3 alias
+    assert entries['network-settings.yaml'].short_name == b"NETWOR~1YAM"
+    assert len(entries['network-settings.yaml'].lfn_offsets) == 2
+    assert len(volume.chain(entries['network-settings.yaml'].cluster)) > 1
+
+def test_fat32_free_count_follows_allocations(tmp_path):
+    data = fat_image(tmp_path / "system.img", fat32=True)
+    volume = _volume(data)
+    before = _free_clusters(volume)
+
+    volume.write_file('innovateos/config/printer.yaml', bytes(3 * volume.cluster_size))
+
+    fsinfo = volume.read(volume.fsinfo_sector * volume.sector_size + 488, 4)
+    assert int.from_bytes(fsinfo, 'little') == before - 5 == _free_clusters(volume)
+
+@pytest.mark.parametrize('fat32', [False, True], ids=['fat16', 'fat32'])
+def test_replacing_a_file_frees_its_old_clusters(tmp_path, fat32):
+    data = fat_image(tmp_path / "system.img", fat32=fat32)
+    volume = _volume(data)
+    volume.write_file('config/printer-settings.yaml', bytes(4 * volume.cluster_size))
+    free = _free_clusters(volume)
+
+    volume.write_file('config/PRINTER-SETTINGS.YAML', b"model: Creality Ender 3\n")
+
+    assert _free_clusters(volume) == free + 3
+    directory = volume._resolve('config', False, None)
+    assert [entry.name for entry in volume.list_directory(directory)] == ['PRINTER-SETTINGS.YAML']
+    assert volume.read_file('config/printer-settings.yaml') == b"model: Creality Ender 3\n"
+
+@pytest.mark.parametrize('fat32', [False, True], ids=['fat16', 'fat32'])
+def test_full_directory_grows_its_cluster_chain(tmp_path, fat32):
+    data = fat_image(tmp_path / "system.img", fat32=fat32)
+    volume = _volume(data)
+    volume.makedirs('innovateos/profiles')
+    directory = volume._resolve('innovateos/profiles', False, None)
+    slots = volume.cluster_size // 32
+    names = [f"profile-{index:03}.gcode" for index in range(slots)]
+
+    for name in names:
+        volume.write_file(f'innovateos/profiles/{name}', name.encode())
+
+    # Each name takes two LFN entries and an 8.3 entry, after '.' and '..'
+    assert len(volume.chain(directory)) == -(-(2 + 3 * len(names)) // slots)
+    patched = volume.patches().apply(0, data)
+    reread = _volume(patched)
+    assert [entry.name for entry in reread.list_directory(directory)] == names
+    assert all(reread.read_file(f'innovateos/profiles/{name}') == name.encode() for name in names)
+
+def test_patches_merge_where_they_overlap_or_touch():
+    patches = PatchSet([(10, b"aaaa"), (20, b"bbbb")])
+    patches.add(14, b"cc")
+    patches.add(18, b"dddd")
+
+    assert list(patches) == [(10, b"aaaacc"), (18, b"ddddbb")]
+    assert (len(patches), patches.size, patches.end) == (2, 12, 24)
+    assert patches.apply(8, bytes(8)) == b"\0\0aaaacc"
+    assert list(patches.patch_chunks([bytes(12), bytes(12)])) == \
+        [b"\0" * 10 + b"aa", b"aacc\0\0ddddbb"]
+
+def test_patches_outside_ranges_are_cut_to_what_is_left():
+    patches = PatchSet([(0, b"0123456789"), (20, b"abcdef")])
+
+    assert patches.outside([(2, 3), (8, 14)]) == [(0, b"01"), (5, b"567"), (22, b"cdef")]
+    assert patches.outside([(0, 30)]) == []
+    assert patches.outside([]) == list(patches)
@@ -0,0 +1,34 @@
+import os
+
+from tests.conftest import MiB
+from utils.image_cache import ImageCache
+
+def _add(cache: ImageCache, sha256: str, size: int = MiB) -> list:
+    """Cache an image with every sidecar it can have; returns their paths"""
+    image = cache.path_for(sha256)
+    image.write_bytes(os.urandom(size))
+    sidecars = [image.with_name(image.name + ".state"), image.with_suffix(".bmap"),
+                image.with_suffix(".merkle")]
+    for path in sidecars:
+        path.write_text("{}")
+    cache.add(sha256, f"http://example.invalid/{sha256[:8]}.img")
+    return [image] + sidecars
+
+def test_removed_image_takes_its_sidecars_along(tmp_path):
+    cache = ImageCache(tmp_path / "cache")
+    files = _add(cache, "a" * 64)
+
+    cache.remove("A" * 64)
+
+    assert cache.get("a" * 64) is None
+    assert not [path for path in files if path.exists()]
+
+def test_evicted_image_takes_its_sidecars_along(tmp_path):
+    cache = ImageCache(tmp_path / "cache", max_bytes=3 * MiB)
+    old = _add(cache, "a" * 64, 2 * MiB)
+    new = _add(cache, "b" * 64, 2 * MiB)
+
+    assert cache.get("a" * 64) is None
+    assert not [path for path in old if path.exists()]
+    assert all(path.exists() for path in new)
+    assert [entry['sha256'] for entry in cache.entries()] == ["b" * 64]
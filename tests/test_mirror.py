@@ -0,0 +1,119 @@
+import hashlib
+import os
+import socket
+
+import pytest
+import requests
+
+from tests.conftest import MiB, publish
+from utils import mirror
+from utils.image_cache import ImageCache
+from utils.mirror import image_url, rank_sources, serve_mirror
+from utils.range_server import RangeRequestHandler
+
+def _cached(cache: ImageCache, data: bytes, verified: bool = True, sha256: str = None) -> str:
+    """Put an image into a cache; ``sha256`` files it under another checksum"""
+    sha256 = sha256 or hashlib.sha256(data).hexdigest()
+    cache.path_for(sha256).write_bytes(data)
+    cache.add(sha256, "http://upstream.invalid/system.img", verified=verified)
+    return sha256
+
+@pytest.fixture
+def mirrors(tmp_path):
+    """Start mirror servers on caches of their own; yields a factory returning (base URL, cache)"""
+    servers = []
+
+    def start(name: str, rate_limit: int = None):
+        cache = ImageCache(tmp_path / name)
+        server = serve_mirror(cache, "127.0.0.1", 0, rate_limit=rate_limit)
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}", cache
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def _dead_url() -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+def test_only_verified_images_are_served(mirrors):
+    url, cache = mirrors("mirror")
+    verified = _cached(cache, os.urandom(MiB))
+    unverified = _cached(cache, os.urandom(MiB), verified=False)
+
+    index = requests.get(f"{url}/index.json", timeout=5).json()
+    assert [image['sha256'] for image in index['images']] == [verified]
+    response = requests.get(image_url(url, verified), headers={"Range": "bytes=16-31"}, timeout=5)
+    assert response.status_code == 206
+    assert response.content == cache.path_for(verified).read_bytes()[16:32]
+    assert requests.get(image_url(url, unverified), timeout=5).status_code == 404
+    assert requests.get(f"{url}/index.json.tmp", timeout=5).status_code == 404
+
+def test_sources_are_ranked_fastest_first(mirrors):
+    data = os.urandom(MiB)
+    fast, fast_cache = mirrors("fast")
+    slow, slow_cache = mirrors("slow", rate_limit=MiB)
+    empty, _ = mirrors("empty")
+    sha256 = _cached(fast_cache, data)
+    _cached(slow_cache, data)
+
+    sources = rank_sources(requests.Session(), f"{fast}/missing.img", [slow, _dead_url(), empty, fast],
+                           sha256, probe_bytes=512 * 1024)
+
+    # Mirrors without the image drop out; upstream stays, last as it did not answer
+    assert [source['mirror'] for source in sources] == [fast, slow, None]
+    assert sources[0]['rate'] > sources[1]['rate']
+    assert sources[-1]['rate'] is None
+
+def test_upstream_is_used_when_every_mirror_fails(installer, release, mirrors, monkeypatch, caplog):
+    directory, url = release
+    data = os.urandom(2 * MiB)
+    sha256 = publish(directory, data)
+    # Upstream is slowest, so the mirror is tried first
+    monkeypatch.setattr(RangeRequestHandler, 'rate_limit', 4 * MiB)
+    mirror_url, mirror_cache = mirrors("mirror")
+    _cached(mirror_cache, data)
+    rank = mirror.rank_sources
+
+    def ranked_then_lost(*args, **kwargs):
+        sources = rank(*args, **kwargs)
+        mirror_cache.remove(sha256)
+        return sources
+
+    monkeypatch.setattr(mirror, 'rank_sources', ranked_then_lost)
+    installer.system_files_url = f"{url}/system.img"
+    installer.mirrors = [mirror_url, _dead_url()]
+
+    image_path = installer.download_system_image()
+
+    assert image_path.read_bytes() == data
+    assert installer.image_source is None
+    assert f"Mirror {mirror_url} failed" in caplog.text
+    assert [source['url'] for source in installer.stage_timings()[0]['sources']] == \
+        [image_url(mirror_url, sha256), installer.system_files_url]
+
+def test_mirror_serving_a_corrupt_image_is_dropped(installer, release, mirrors, monkeypatch):
+    directory, url = release
+    data = os.urandom(2 * MiB)
+    sha256 = publish(directory, data)
+    monkeypatch.setattr(RangeRequestHandler, 'rate_limit', 4 * MiB)
+    mirror_url, mirror_cache = mirrors("mirror")
+    _cached(mirror_cache, os.urandom(len(data)), sha256=sha256)
+    installer.system_files_url = f"{url}/system.img"
+    installer.mirrors = [mirror_url]
+
+    image_path = installer.download_system_image()
+    assert installer.image_source == mirror_url
+    assert not installer.verify_image_checksum(image_path)
+
+    assert installer.bad_mirrors == {mirror_url}
+    assert installer.image_cache.get(sha256) is None
+    installer.telemetry.reset()
+    image_path = installer.download_system_image()
+    assert installer.image_source is None
+    assert 'sources' not in installer.stage_timings()[0]
+    assert installer.verify_image_checksum(image_path)
+    assert image_path.read_bytes() == data
@@ -0,0 +1,38 @@
+import gzip
+import hashlib
+import os
+
+from tests.conftest import MiB
+from utils.pipeline import StreamingPipeline
+
+def chunked(data: bytes, size: int = MiB):
+    return (data[offset:offset + size] for offset in range(0, len(data), size))
+
+def test_streams_an_image_onto_the_target(tmp_path):
+    data = os.urandom(8 * MiB)
+    target = tmp_path / "card.img"
+
+    pipeline = StreamingPipeline(chunked(data), str(target), hashlib.sha256(data).hexdigest())
+    assert pipeline.run()
+
+    assert target.read_bytes() == data
+
+def test_compressed_stream_matches_either_checksum(tmp_path):
+    data = os.urandom(2 * MiB) + bytes(6 * MiB)
+    compressed = gzip.compress(data)
+    for checksum in (hashlib.sha256(compressed).hexdigest(), hashlib.sha256(data).hexdigest()):
+        target = tmp_path / f"card-{checksum[:8]}.img"
+        pipeline = StreamingPipeline(chunked(compressed), str(target), checksum)
+        assert pipeline.run()
+        assert target.read_bytes() == data
+        assert pipeline.compression == 'gz'
+
+def test_wrong_checksum_leaves_the_header_unwritten(tmp_path):
+    data = os.urandom(4 * MiB)
+    target = tmp_path / "card.img"
+
+    pipeline = StreamingPipeline(chunked(data), str(target), "0" * 64, header_size=MiB)
+    assert not pipeline.run()
+
+    written = target.read_bytes()
+    assert written[:MiB] != data[:MiB]
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from tests.conftest import MiB, sparse_image
+from utils.raw_writer import RawWriter
+
+def test_zero_blocks_are_skipped_on_a_new_file(tmp_path):
+    image = tmp_path / "system.img"
+    data = sparse_image(image)
+    target = tmp_path / "card.img"
+
+    writer = RawWriter(str(target))
+    assert writer.write_file(image)
+
+    assert target.read_bytes() == data
+    assert writer.stats['image_size'] == len(data)
+    assert writer.bytes_written == 4 * MiB
+    assert writer.bytes_skipped == 12 * MiB
+    assert writer.bytes_zeroed == 0
+
+def test_zero_blocks_punch_holes_into_an_existing_file(tmp_path):
+    image = tmp_path / "system.img"
+    data = sparse_image(image)
+    target = tmp_path / "card.img"
+    target.write_bytes(os.urandom(len(data)))
+    allocated = os.stat(target).st_blocks
+
+    writer = RawWriter(str(target))
+    assert writer.write_file(image)
+
+    if not writer.bytes_zeroed:
+        pytest.skip("filesystem cannot punch holes")
+    # Old data must not show through where the image is empty
+    assert target.read_bytes() == data
+    assert writer.bytes_written == 4 * MiB
+    assert writer.bytes_zeroed == 12 * MiB
+    assert os.stat(target).st_blocks < allocated
+
+def test_write_mode_writes_every_byte(tmp_path):
+    image = tmp_path / "system.img"
+    data = sparse_image(image)
+    target = tmp_path / "card.img"
+
+    writer = RawWriter(str(target), zero_mode='write', kernel_copy=False)
+    assert writer.write_file(image)
+
+    assert target.read_bytes() == data
+    assert writer.bytes_written == len(data)
+
+@pytest.mark.parametrize('queue_depth', [1, 4])
+def test_readback_verifies_the_written_image(tmp_path, queue_depth):
+    image = tmp_path / "system.img"
+    data = sparse_image(image)
+    target = tmp_path / "card.img"
+    target.write_bytes(os.urandom(len(data) // 2))
+
+    writer = RawWriter(str(target), readback=True, queue_depth=queue_depth)
+    assert writer.write_file(image)
+
+    assert target.read_bytes() == data
+    assert writer.readback_report['ok']
+
+def test_resumed_write_only_writes_the_rest(tmp_path):
+    image = tmp_path / "system.img"
+    data = sparse_image(image, every=1)
+    target = tmp_path / "card.img"
+    target.write_bytes(data[:8 * MiB])
+
+    writer = RawWriter(str(target))
+    assert writer.write_file(image, start=8 * MiB)
+
+    assert target.read_bytes() == data
+    assert writer.bytes_written == 8 * MiB
+
+def test_loop_device(tmp_path, loop_device):
+    image = tmp_path / "system.img"
+    data = sparse_image(image)
+
+    writer = RawWriter(loop_device, readback=True)
+    assert writer.write_file(image)
+
+    with open(loop_device, 'rb') as f:
+        assert f.read(len(data)) == data
+    assert writer.bytes_written == 4 * MiB
+    assert writer.bytes_written + writer.bytes_zeroed == len(data)
@@ -0,0 +1,54 @@
+import copy
+
+from tests.conftest import MiB, fat_image, publish
+from utils.fat import read_files
+
+CONFIG = {
+    'system': {},
+    'network': {'ssid': 'Workshop', 'password': 'secret'},
+    'printer': {'model': 'Prusa i3 MK3S+', 'connection': 'USB'}
+}
+
+def _read_at(path):
+    data = path.read_bytes()
+    return lambda offset, length: data[offset:offset + length]
+
+def _station(installer, release, tmp_path):
+    directory, url = release
+    publish(directory, fat_image(tmp_path / "system.img"))
+    installer.system_files_url = f"{url}/system.img"
+    return [str(tmp_path / "card-a.img"), str(tmp_path / "card-b.img")]
+
+def test_configuration_is_built_into_each_card(installer, release, tmp_path):
+    targets = _station(installer, release, tmp_path)
+    other = copy.deepcopy(CONFIG)
+    other['printer']['model'] = 'Creality Ender 3'
+    configs = {targets[0]: CONFIG, targets[1]: other}
+
+    results = installer.install_station(targets, CONFIG, configs, prepare=False)
+
+    assert results == {target: True for target in targets}
+    for target in targets:
+        assert installer.verification_reports[target]['ok']
+        printer = read_files(_read_at(tmp_path / target), ['innovateos/config/printer.yaml'])
+        assert configs[target]['printer']['model'].encode() in printer['innovateos/config/printer.yaml']
+    # Outside the FAT partition both cards hold the image as published
+    image = (tmp_path / "system.img").read_bytes()
+    for target in targets:
+        assert (tmp_path / target).read_bytes()[17 * MiB:] == image[17 * MiB:]
+
+def test_file_targets_are_not_formatted(installer, release, tmp_path):
+    targets = _station(installer, release, tmp_path)
+    installer.offline_config = False
+    mounts = {target: str(tmp_path / f"mount-{index}") for index, target in enumerate(targets)}
+    for mount in mounts.values():
+        (tmp_path / mount).mkdir()
+
+    results = installer.install_station(targets, CONFIG, mounts=mounts, prepare=True, verify=False)
+
+    assert results == {target: True for target in targets}
+    image = (tmp_path / "system.img").read_bytes()
+    for target in targets:
+        assert (tmp_path / target).read_bytes() == image
+        assert (tmp_path / mounts[target] / "innovateos" / "config" / "printer.yaml").exists()
+    assert 'prepare_drive' in [stage['stage'] for stage in installer.stage_timings()]
@@ -2,13 +2,13 @@ import logging
 from PyQt6.QtWidgets import QWizard
 from PyQt6.QtCore import Qt
 from .pages import WelcomePage, DrivePage, ConfigPage, InstallPage, FinishPage
-from utils.installer import InstallerManager
+from utils.installer import get_installer
 
 class InstallerWindow(QWizard):
     def __init__(self):
         super().__init__()
         self.logger = logging.getLogger(__name__)
-        self.installer = InstallerManager()
+        self.installer = get_installer()
         self.setWindowTitle("InnovateOS Installer")
         
         # Set window properties
@@ -42,7 +42,5 @@ class InstallerWindow(QWizard):
     def closeEvent(self, event):
         """Handle window close event"""
         # Clean up any temporary files
-        if hasattr(self, 'install_page'):
-            if hasattr(self.install_page, 'installer'):
-                self.install_page.installer.cleanup()
+        self.installer.cleanup()
         event.accept()
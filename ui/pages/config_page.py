@@ -1,6 +1,7 @@
 from PyQt6.QtWidgets import (QWizardPage, QVBoxLayout, QLabel, 
                             QLineEdit, QComboBox, QGroupBox, QFormLayout)
 from PyQt6.QtCore import Qt
+from utils.installer import get_installer
 
 class ConfigPage(QWizardPage):
     def __init__(self):
@@ -31,12 +32,14 @@ class ConfigPage(QWizardPage):
         printer_group = QGroupBox("Printer Configuration")
         printer_layout = QFormLayout()
         
+        self.printer_search = QLineEdit()
+        self.printer_search.setPlaceholderText("Search printer models")
+        self.printer_search.textChanged.connect(self.filter_models)
+        printer_layout.addRow("Search:", self.printer_search)
+        
+        # Filled from the printer profile catalog when the page is shown
         self.printer_model = QComboBox()
-        self.printer_model.addItems([
-            "Prusa i3 MK3S+",
-            "Creality Ender 3",
-            "Other"
-        ])
+        self.printer_model.addItems(["Other"])
         printer_layout.addRow("Printer Model:", self.printer_model)
         
         self.printer_connection = QComboBox()
@@ -56,6 +59,27 @@ class ConfigPage(QWizardPage):
         self.registerField("printer_model*", self.printer_model, "currentText")
         self.registerField("printer_connection*", self.printer_connection, "currentText")
         
+    def initializePage(self):
+        """Load the printer profiles"""
+        self.filter_models(self.printer_search.text())
+        
+    def filter_models(self, query: str):
+        """Show the printer models matching the search, keeping the selection"""
+        try:
+            models = get_installer().printer_catalog.search(query)
+        except Exception:
+            models = []
+        current = self.printer_model.currentText()
+        self.printer_model.blockSignals(True)
+        self.printer_model.clear()
+        self.printer_model.addItems(models + ["Other"])
+        # Never switch models behind the user's back: a selection the search
+        # no longer matches is cleared and has to be made again
+        self.printer_model.setCurrentIndex(self.printer_model.findText(current) if current else -1)
+        self.printer_model.blockSignals(False)
+        # The mandatory model field may have been cleared with signals blocked
+        self.completeChanged.emit()
+        
     def validatePage(self) -> bool:
         """Validate the configuration"""
         ssid = self.field("wifi_ssid")
@@ -1,16 +1,71 @@
-from PyQt6.QtWidgets import (QWizardPage, QVBoxLayout, QLabel, 
-                            QPushButton, QComboBox, QMessageBox)
-from PyQt6.QtCore import Qt
+import threading
+import time
+from PyQt6.QtWidgets import (QWizardPage, QVBoxLayout, QHBoxLayout, QLabel,
+                            QPushButton, QComboBox, QMessageBox, QCheckBox,
+                            QProgressBar)
+from PyQt6.QtCore import Qt, QThread, pyqtSignal
 import humanize
-from utils.installer import InstallerManager
+from utils.installer import InstallerManager, get_installer
+from utils.telemetry import format_progress
+from utils.verdicts import CANCELLED, FAIL, WARN
+
+class ProbeWorker(QThread):
+    """Probe a card off the GUI thread"""
+    progress = pyqtSignal(int, str)
+    finished = pyqtSignal(dict)
+    
+    # Minimum seconds between progress updates sent to the UI
+    UPDATE_INTERVAL = 0.1
+    
+    def __init__(self, installer: InstallerManager, drive: dict):
+        super().__init__()
+        self.installer = installer
+        self.drive = drive
+        self.cancelled = threading.Event()
+        self.identity = {}
+        self._last_update = 0.0
+        
+    def cancel(self):
+        """Stop the probe after the block at hand"""
+        self.cancelled.set()
+        
+    def on_progress(self, event: dict):
+        if event['stage'] != "probe_card" or event['done']:
+            return
+        now = time.monotonic()
+        if now - self._last_update < self.UPDATE_INTERVAL:
+            return
+        self._last_update = now
+        fraction = 0.0
+        if event['bytes_total']:
+            fraction = min(event['bytes_done'] / event['bytes_total'], 1.0)
+        self.progress.emit(int(100 * fraction), f"Checking the card... {format_progress(event)}")
+        
+    def run(self):
+        telemetry = self.installer.telemetry
+        telemetry.add_listener(self.on_progress)
+        try:
+            # Recognises the card later should another take its letter
+            self.identity = self.installer.card_identity(self.drive['letter'])
+            # The card is erased anyway, so the probed blocks need no restoring
+            report = self.installer.probe_card(self.drive['letter'], self.drive['size'],
+                                               restore=False, cancel=self.cancelled)
+        except Exception as e:
+            report = {'verdict': WARN, 'reasons': [f"The card could not be checked: {e}"]}
+        finally:
+            telemetry.remove_listener(self.on_progress)
+        self.finished.emit(report)
 
 class DrivePage(QWizardPage):
+    # Emitted from the device monitor thread; delivered on the GUI thread
+    devices_changed = pyqtSignal()
+    
     def __init__(self):
         super().__init__()
         self.setTitle("Select Installation Drive")
         self.setSubTitle("Please select the SD card where InnovateOS will be installed.")
         
-        self.installer = InstallerManager()
+        self.installer = get_installer()
         
         self.layout = QVBoxLayout()
         self.setLayout(self.layout)
@@ -26,6 +81,7 @@ class DrivePage(QWizardPage):
         
         # Drive selection
         self.drive_combo = QComboBox()
+        self.drive_combo.currentIndexChanged.connect(self.update_drive_info)
         self.layout.addWidget(self.drive_combo)
         
         # Drive info
@@ -38,35 +94,90 @@ class DrivePage(QWizardPage):
         refresh_btn.clicked.connect(self.refresh_drives)
         self.layout.addWidget(refresh_btn)
         
+        # Optional check for counterfeit and slow cards before installing
+        self.probe_check = QCheckBox("Check the card for fake capacity and speed (a few seconds)")
+        self.layout.addWidget(self.probe_check)
+        
+        # Progress of the card check, shown while it runs
+        probe_row = QHBoxLayout()
+        self.probe_progress = QProgressBar()
+        self.probe_progress.setRange(0, 100)
+        probe_row.addWidget(self.probe_progress)
+        self.probe_cancel = QPushButton("Cancel")
+        self.probe_cancel.clicked.connect(self.cancel_probe)
+        probe_row.addWidget(self.probe_cancel)
+        self.layout.addLayout(probe_row)
+        self.probe_status = QLabel()
+        self.probe_status.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.layout.addWidget(self.probe_status)
+        self.probe_progress.hide()
+        self.probe_cancel.hide()
+        self.probe_worker = None
+        # Card that was confirmed and passed its check: letter, size and serial
+        self.probed = None
+        
         # Register fields
         self.registerField("selected_drive*", self.drive_combo, "currentText")
         
+        # Follow card insertion/removal without blocking the GUI thread;
+        # the device table is only set up once the page is first shown
+        self.refresh_requested = False
+        self.devices_listener = None
+        self.devices_changed.connect(self.update_drives)
+        
     def initializePage(self):
-        self.refresh_drives()
+        if self.devices_listener is None:
+            self.devices_listener = lambda action, drive: self.devices_changed.emit()
+            self.installer.devices.add_listener(self.devices_listener)
+        self.installer.devices.start()
+        self.update_drives()
         
     def refresh_drives(self):
         """Refresh the list of available drives"""
-        self.drive_combo.clear()
-        drives = self.installer.get_available_drives()
+        self.refresh_requested = True
+        self.installer.devices.rescan()
         
-        if not drives:
-            QMessageBox.warning(
-                self,
-                "No Drives Found",
-                "No removable drives were found.\n"
-                "Please insert an SD card and click Refresh."
-            )
-            return
+    def update_drives(self):
+        """Show the cached drive table, keeping the current selection"""
+        current = self.drive_combo.currentData()
+        drives = self.installer.devices.devices()
+        # A card swapped under the same letter has to be checked again
+        if self.probed and not self.probed_card_present(drives):
+            self.probed = None
         
+        self.drive_combo.blockSignals(True)
+        self.drive_combo.clear()
         for drive in drives:
             size = humanize.naturalsize(drive['size'])
-            free = humanize.naturalsize(drive['free_space'])
             label = f"{drive['letter']} - {drive['label']} ({size})"
             self.drive_combo.addItem(label, drive)
-            
-        self.drive_combo.currentIndexChanged.connect(self.update_drive_info)
+            if current and drive['letter'] == current['letter']:
+                self.drive_combo.setCurrentIndex(self.drive_combo.count() - 1)
+        self.drive_combo.blockSignals(False)
         self.update_drive_info()
         
+        if not drives:
+            self.drive_info.setText("Please insert an SD card.")
+            if self.refresh_requested:
+                QMessageBox.warning(
+                    self,
+                    "No Drives Found",
+                    "No removable drives were found.\n"
+                    "Please insert an SD card and click Refresh."
+                )
+        self.refresh_requested = False
+        
+    def probed_card_present(self, drives: list) -> bool:
+        """Whether the checked card is still in its drive"""
+        for drive in drives:
+            if drive['letter'] != self.probed['letter']:
+                continue
+            if drive['size'] != self.probed['size']:
+                return False
+            serial = self.installer.card_identity(drive['letter']).get('serial')
+            return serial == self.probed['serial']
+        return False
+        
     def update_drive_info(self):
         """Update the drive information display"""
         if self.drive_combo.currentData():
@@ -103,6 +214,11 @@ class DrivePage(QWizardPage):
             )
             return False
             
+        if self.probe_check.isChecked() and self.probed and self.probed['letter'] == drive['letter']:
+            # Confirmed before its check, which it passed
+            self.setField("selected_drive", drive['letter'])
+            return True
+            
         # Confirm drive selection
         msg = QMessageBox()
         msg.setIcon(QMessageBox.Icon.Warning)
@@ -118,8 +234,80 @@ class DrivePage(QWizardPage):
         msg.setDefaultButton(QMessageBox.StandardButton.No)
         
         if msg.exec() == QMessageBox.StandardButton.Yes:
+            if self.probe_check.isChecked():
+                # Next is enabled again once the check has passed
+                self.start_probe(drive)
+                return False
             # Store the drive letter for the installation page
             self.setField("selected_drive", drive['letter'])
             return True
             
         return False
+        
+    def isComplete(self) -> bool:
+        return super().isComplete() and self.probe_worker is None
+        
+    def start_probe(self, drive: dict):
+        """Check the confirmed card in the background"""
+        self.probed = None
+        self.probe_worker = ProbeWorker(self.installer, drive)
+        self.probe_worker.progress.connect(self.update_probe_progress)
+        self.probe_worker.finished.connect(self.probe_finished)
+        self.probe_progress.setValue(0)
+        self.probe_progress.show()
+        self.probe_cancel.show()
+        self.probe_cancel.setEnabled(True)
+        self.probe_status.setText("Checking the card...")
+        self.completeChanged.emit()
+        self.probe_worker.start()
+        
+    def cancel_probe(self):
+        if self.probe_worker:
+            self.probe_cancel.setEnabled(False)
+            self.probe_status.setText("Cancelling the card check...")
+            self.probe_worker.cancel()
+            
+    def update_probe_progress(self, value: int, message: str):
+        self.probe_progress.setValue(value)
+        self.probe_status.setText(message)
+        
+    def probe_finished(self, report: dict):
+        """Judge the probed card; Next continues with it if it may be used"""
+        drive = self.probe_worker.drive
+        identity = self.probe_worker.identity
+        self.probe_worker.wait()
+        self.probe_worker = None
+        self.probe_progress.hide()
+        self.probe_cancel.hide()
+        
+        reasons = "\n".join(report['reasons'])
+        accepted = True
+        if report['verdict'] == CANCELLED:
+            accepted = False
+            self.probe_status.setText("Card check cancelled.")
+        elif report['verdict'] == FAIL:
+            accepted = False
+            self.probe_status.setText("Card check failed, please use another card.")
+            QMessageBox.critical(
+                self,
+                "Card Check Failed",
+                f"This card should not be used for InnovateOS:\n{reasons}"
+            )
+        elif report['verdict'] == WARN:
+            answer = QMessageBox.question(
+                self,
+                "Card Check Warning",
+                f"{reasons}\n\nInstalling will be slow and the printer may be sluggish.\n"
+                f"Continue with this card?",
+                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                QMessageBox.StandardButton.No
+            )
+            accepted = answer == QMessageBox.StandardButton.Yes
+            if not accepted:
+                self.probe_status.setText("Please use another card.")
+            
+        if accepted:
+            self.probed = {'letter': drive['letter'], 'size': drive['size'],
+                           'serial': identity.get('serial')}
+            self.probe_status.setText("Card checked. Click Next to install on it.")
+        self.completeChanged.emit()
@@ -1,67 +1,121 @@
+import copy
+import time
 from PyQt6.QtWidgets import QWizardPage, QVBoxLayout, QProgressBar, QLabel
 from PyQt6.QtCore import Qt, QThread, pyqtSignal
-from utils.installer import InstallerManager
+from utils.installer import InstallerManager, get_installer
+from utils.logger import log_context, new_install_id
+from utils.telemetry import format_progress
 
 class InstallationWorker(QThread):
     progress = pyqtSignal(int, str)
     finished = pyqtSignal(bool, str)
     
-    def __init__(self, installer: InstallerManager, drive: str, config: dict):
+    # Progress bar range and status text of each installer stage
+    STAGES = {
+        "download": (0, 20, "Downloading system image..."),
+        "verify_image": (20, 30, "Verifying system image..."),
+        "inject_config": (30, 35, "Building configuration into image..."),
+        "prepare_drive": (35, 50, "Preparing drive..."),
+        "write_image": (50, 70, "Writing system image..."),
+        "configure": (70, 90, "Configuring system..."),
+        "verify_installation": (90, 100, "Verifying installation...")
+    }
+    INCREMENTAL_STAGES = {**STAGES, "write_image": (35, 70, "Updating system image...")}
+    STREAMING_STAGES = {
+        **STAGES,
+        "prepare_drive": (0, 10, "Preparing drive..."),
+        "stream_image": (10, 70, "Downloading and writing system image...")
+    }
+    # Failure message of each stage that ends the install when it fails
+    FAILURES = {
+        "download": "Failed to download system image",
+        "verify_image": "System image verification failed",
+        "prepare_drive": "Drive preparation failed",
+        "write_image": "Failed to write system image",
+        "stream_image": "Failed to stream system image",
+        "configure": "System configuration failed"
+    }
+    INCREMENTAL_FAILURES = {**FAILURES, "write_image": "Failed to update system image"}
+    # Minimum seconds between byte progress updates sent to the UI
+    UPDATE_INTERVAL = 0.1
+    
+    def __init__(self, installer: InstallerManager, drive: str, config: dict,
+                 streaming: bool = False, incremental: bool = False):
         super().__init__()
         self.installer = installer
         self.drive = drive
         self.config = config
+        self.streaming = streaming
+        self.incremental = incremental
+        self._last_update = 0.0
+        self.failures = self.INCREMENTAL_FAILURES if incremental else self.FAILURES
+        if streaming:
+            self.stages = self.STREAMING_STAGES
+        elif incremental:
+            self.stages = self.INCREMENTAL_STAGES
+        else:
+            self.stages = self.STAGES
+            
+    def on_progress(self, event: dict):
+        """Map byte progress of the running stage onto the progress bar"""
+        if event['done'] or event['stage'] not in self.stages:
+            return
+        start, end, message = self.stages[event['stage']]
+        if not event['elapsed']:
+            # A stage starting is always shown
+            self.progress.emit(start, message)
+            return
+        now = time.monotonic()
+        if now - self._last_update < self.UPDATE_INTERVAL:
+            return
+        self._last_update = now
+        fraction = 0.0
+        if event['bytes_total']:
+            fraction = min(event['bytes_done'] / event['bytes_total'], 1.0)
+        self.progress.emit(start + int((end - start) * fraction),
+                           f"{message} {format_progress(event)}")
         
+    def _verification_failure(self) -> str:
+        """Failure message naming the checks that failed"""
+        report = self.installer.verification_reports.get(self.drive)
+        failed = [item['item'] for item in report['items'] if item['status'] == 'failed'] if report else []
+        if not failed:
+            return "Installation verification failed"
+        more = f" (+{len(failed) - 3} more)" if len(failed) > 3 else ""
+        return f"Installation verification failed: {', '.join(failed[:3])}{more}"
+        
+    def _failure(self) -> str:
+        """Failure message of the stage that ended the install"""
+        for stage in reversed(self.installer.telemetry.summary()):
+            if stage['ok']:
+                continue
+            if stage['stage'] == "verify_installation":
+                return self._verification_failure()
+            if stage['stage'] in self.failures:
+                return self.failures[stage['stage']]
+        return "Installation failed"
+
     def run(self):
+        telemetry = self.installer.telemetry
+        telemetry.reset()
+        telemetry.add_listener(self.on_progress)
         try:
-            # Download system image (20%)
-            self.progress.emit(0, "Downloading system image...")
-            image_path = self.installer.download_system_image()
-            if not image_path:
-                self.finished.emit(False, "Failed to download system image")
-                return
-            self.progress.emit(20, "System image downloaded")
-            
-            # Verify checksum (30%)
-            self.progress.emit(20, "Verifying system image...")
-            if not self.installer.verify_image_checksum(image_path):
-                self.finished.emit(False, "System image verification failed")
-                return
-            self.progress.emit(30, "System image verified")
-            
-            # Prepare drive (50%)
-            self.progress.emit(30, "Preparing drive...")
-            if not self.installer.prepare_drive(self.drive):
-                self.finished.emit(False, "Drive preparation failed")
-                return
-            self.progress.emit(50, "Drive prepared")
-            
-            # Write image (70%)
-            self.progress.emit(50, "Writing system image...")
-            if not self.installer.write_image_to_drive(image_path, self.drive):
-                self.finished.emit(False, "Failed to write system image")
-                return
-            self.progress.emit(70, "System image written")
-            
-            # Configure system (90%)
-            self.progress.emit(70, "Configuring system...")
-            if not self.installer.configure_system(self.drive, self.config):
-                self.finished.emit(False, "System configuration failed")
-                return
-            self.progress.emit(90, "System configured")
-            
-            # Verify installation (100%)
-            self.progress.emit(90, "Verifying installation...")
-            if not self.installer.verify_installation(self.drive):
-                self.finished.emit(False, "Installation verification failed")
+            # Tag this install's log records and trace spans
+            with log_context(install_id=new_install_id(), device=self.drive):
+                # A retry after a failure skips what the failed attempt completed
+                ok = self.installer.install_system(self.drive, copy.deepcopy(self.config),
+                                                   self.streaming, self.incremental)
+            if not ok:
+                self.finished.emit(False, self._failure())
                 return
             self.progress.emit(100, "Installation complete")
-            
             self.installer.cleanup()
             self.finished.emit(True, "Installation completed successfully")
-            
         except Exception as e:
             self.finished.emit(False, f"Installation failed: {str(e)}")
+        finally:
+            telemetry.remove_listener(self.on_progress)
+            telemetry.log_summary()
 
 class InstallPage(QWizardPage):
     def __init__(self):
@@ -81,8 +135,12 @@ class InstallPage(QWizardPage):
         self.status_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.layout.addWidget(self.status_label)
         
-        self.installer = InstallerManager()
+        self.installer = get_installer()
         self.worker = None
+        # Single-pass download/verify/write without a temp image
+        self.streaming = False
+        # Re-provision cards by rewriting only the blocks that differ
+        self.incremental = False
         
     def initializePage(self):
         drive = self.field("selected_drive")
@@ -98,7 +156,9 @@ class InstallPage(QWizardPage):
             }
         }
         
-        self.worker = InstallationWorker(self.installer, drive, config)
+        self.worker = InstallationWorker(
+            self.installer, drive, config, self.streaming, self.incremental
+        )
         self.worker.progress.connect(self.update_progress)
         self.worker.finished.connect(self.installation_finished)
         self.worker.start()
@@ -0,0 +1,528 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import yaml
+
+from utils.config_bundle import build_bundle, dump_yaml, verify_bundle, write_bundle
+from utils.download import RangedDownloader
+from utils.fake_device import PROFILES, FakeDevice
+from utils.range_server import serve_directory
+from utils.telemetry import StageTracker, Telemetry
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STAGES = ['download', 'checksum', 'write', 'configure', 'verify']
+
+# Environment variable that makes main.py print its first-paint time and quit
+STARTUP_PROBE = "INNOVATEOS_STARTUP_PROBE"
+
+class RssSampler:
+    """Track the peak resident set size of this process during a stage"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._page_size = resource.getpagesize() if resource else 4096
+
+    def _rss(self) -> int:
+        try:
+            with open('/proc/self/statm', 'r') as f:
+                return int(f.read().split()[1]) * self._page_size
+        except OSError:
+            if resource is None:
+                return 0
+            # No procfs: the lifetime peak is the best available figure
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._rss())
+
+    def __enter__(self) -> 'RssSampler':
+        self.peak = self._rss()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+def make_image(path: Path, size: int, seed: int = 0, zero_fraction: float = 0.5):
+    """Write a reproducible test image with a mix of data and empty blocks"""
+    rng = random.Random(seed)
+    block = 1024 * 1024
+    with open(path, 'wb') as f:
+        for offset in range(0, size, block):
+            length = min(block, size - offset)
+            if rng.random() < zero_fraction:
+                f.write(bytes(length))
+            else:
+                f.write(rng.randbytes(length))
+
+class BenchmarkRun:
+    """One pass over the install stages against a fake device
+
+    The stages do the same work as the corresponding InstallerManager
+    steps (ranged download, SHA-256 check, raw write, YAML configuration
+    and read-back verification), but against a local HTTP server and a
+    file-backed FakeDevice so they run on any Linux box.
+    """
+
+    def __init__(self, workdir: Path, size: int, profile: str = 'class10',
+                 segments: int = 4, block_size: int = 4 * 1024 * 1024,
+                 rate_limit: Optional[int] = None, seed: int = 0, queue_depth: int = 4):
+        self.logger = logging.getLogger(__name__)
+        self.workdir = Path(workdir)
+        self.size = size
+        self.profile = profile
+        self.segments = segments
+        self.block_size = block_size
+        self.rate_limit = rate_limit
+        self.seed = seed
+        self.queue_depth = queue_depth
+        self.telemetry = Telemetry()
+        self.source = self.workdir / "server" / "system.img"
+        self.image = self.workdir / "system.img"
+        self.mount = self.workdir / "mount"
+        self.device = FakeDevice.from_profile(self.workdir / "card.img", size, profile)
+        self.checksum: Optional[str] = None
+
+    def prepare(self):
+        self.source.parent.mkdir(parents=True, exist_ok=True)
+        make_image(self.source, self.size, self.seed)
+        self.device.create()
+
+    def _download(self, stage: StageTracker) -> bool:
+        server = serve_directory(str(self.source.parent), rate_limit=self.rate_limit)
+        try:
+            url = f"http://127.0.0.1:{server.server_port}/{self.source.name}"
+            stage.set_total(self.size)
+            downloader = RangedDownloader(url, self.image, segments=self.segments,
+                                          progress=stage.update)
+            return downloader.download()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def _checksum(self, stage: StageTracker) -> bool:
+        stage.set_total(self.size)
+        sha256_hash = hashlib.sha256()
+        offset = 0
+        with open(self.image, 'rb') as f:
+            for byte_block in iter(lambda: f.read(1024 * 1024), b""):
+                sha256_hash.update(byte_block)
+                offset += len(byte_block)
+                stage.update(offset)
+        self.checksum = sha256_hash.hexdigest()
+        return True
+
+    def _write(self, stage: StageTracker) -> bool:
+        stage.set_total(self.size)
+        writer = self.device.writer(block_size=self.block_size, queue_depth=self.queue_depth)
+        ok = writer.write_file(self.image, stage.update)
+        stage.details.update(writer.stats)
+        return ok
+
+    def _configure(self, stage: StageTracker) -> bool:
+        config = {
+            'system': {'version': "1.0.0", 'install_date': datetime.now().isoformat()},
+            'network': {'ssid': "benchmark", 'password': "benchmark"},
+            'printer': {'model': "Prusa i3 MK3S+", 'connection': "USB"}
+        }
+        bundle = build_bundle({
+            'innovateos/config/system.yaml': dump_yaml(config),
+            'innovateos/config/network.yaml': dump_yaml({'wifi': config['network']}),
+            'innovateos/config/printer.yaml': dump_yaml({**config['printer'], 'settings': {}})
+        })
+        write_bundle(str(self.mount), bundle)
+        stage.update(sum(len(data) for data in bundle.values()))
+        return not verify_bundle(str(self.mount))
+
+    def _verify(self, stage: StageTracker) -> bool:
+        stage.set_total(self.size)
+        sha256_hash = hashlib.sha256()
+        for offset in range(0, self.size, self.block_size):
+            sha256_hash.update(self.device.read(offset, min(self.block_size, self.size - offset)))
+            stage.update(min(offset + self.block_size, self.size))
+        return sha256_hash.hexdigest() == self.checksum
+
+    def run(self, stages: List[str]) -> List[Dict]:
+        """Run the given stages in order; returns one summary per stage"""
+        steps: Dict[str, Callable[[StageTracker], bool]] = {
+            'download': self._download,
+            'checksum': self._checksum,
+            'write': self._write,
+            'configure': self._configure,
+            'verify': self._verify
+        }
+        if 'download' not in stages:
+            shutil.copyfile(self.source, self.image)
+        if 'verify' in stages and 'checksum' not in stages:
+            self._checksum(self.telemetry.current())
+
+        for name in stages:
+            with RssSampler() as sampler, self.telemetry.stage(name) as stage:
+                stage.ok = steps[name](stage)
+            stage.details['peak_rss'] = sampler.peak
+            if not stage.ok:
+                self.logger.error(f"Benchmark stage {name} failed")
+        return self.telemetry.summary()
+
+def _median_run(runs: List[List[Dict]]) -> List[Dict]:
+    """Per stage, the repetition with the median duration"""
+    results = []
+    for samples in zip(*runs):
+        ordered = sorted(samples, key=lambda sample: sample['duration'])
+        result = dict(ordered[len(ordered) // 2])
+        result['durations'] = [sample['duration'] for sample in samples]
+        results.append(result)
+    return results
+
+def run_benchmarks(size: int, profile: str = 'class10', stages: Optional[List[str]] = None,
+                   repeat: int = 1, segments: int = 4, block_size: int = 4 * 1024 * 1024,
+                   rate_limit: Optional[int] = None, seed: int = 0, queue_depth: int = 4,
+                   workdir: Optional[Path] = None) -> Dict:
+    """Run the benchmark suite and return JSON-serialisable results"""
+    stages = stages or STAGES
+    runs = []
+    for index in range(repeat):
+        tmpdir = Path(tempfile.mkdtemp(dir=workdir))
+        try:
+            run = BenchmarkRun(tmpdir, size, profile, segments, block_size, rate_limit, seed,
+                               queue_depth)
+            run.prepare()
+            runs.append(run.run(stages))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    results = []
+    for stage in _median_run(runs):
+        stage['mb_per_s'] = stage['avg_rate'] / 1e6
+        results.append(stage)
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'size': size,
+            'profile': profile,
+            'repeat': repeat,
+            'segments': segments,
+            'block_size': block_size,
+            'queue_depth': queue_depth,
+            'rate_limit': rate_limit,
+            'seed': seed
+        },
+        'stages': results
+    }
+
+def _children_usage() -> tuple:
+    if resource is None:
+        return 0.0, 0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss * 1024
+
+def measure_startup(command: Optional[List[str]] = None, runs: int = 5,
+                    timeout: float = 60.0) -> Dict:
+    """Time from process start to the first paint of the installer window
+
+    ``command`` defaults to running main.py with this interpreter; pass
+    the path of a frozen build to measure the PyInstaller executable.
+    """
+    root = Path(__file__).resolve().parent.parent
+    command = command or [sys.executable, str(root / "main.py")]
+    env = {**os.environ, STARTUP_PROBE: "1"}
+    durations = []
+    cpu_time = 0.0
+    ok = True
+    for index in range(runs):
+        cpu_before, _ = _children_usage()
+        started = time.time()
+        try:
+            result = subprocess.run(command, cwd=root, env=env, capture_output=True,
+                                    text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logging.getLogger(__name__).error(f"Startup run {index} timed out")
+            ok = False
+            continue
+        painted = [line for line in result.stdout.splitlines() if line.startswith("first-paint ")]
+        if not painted:
+            logging.getLogger(__name__).error(
+                f"Startup run {index} never painted (exit {result.returncode}): {result.stderr[-500:]}"
+            )
+            ok = False
+            continue
+        durations.append(float(painted[0].split()[1]) - started)
+        cpu_time += _children_usage()[0] - cpu_before
+
+    duration = statistics.median(durations) if durations else 0.0
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'command': command,
+            'repeat': runs
+        },
+        'stages': [{
+            'stage': 'startup',
+            'ok': ok and bool(durations),
+            'duration': duration,
+            'durations': durations,
+            'cpu_time': cpu_time / len(durations) if durations else 0.0,
+            'bytes': 0,
+            'avg_rate': 0.0,
+            'mb_per_s': 0.0,
+            'peak_rss': _children_usage()[1]
+        }]
+    }
+
+def make_catalog(directory: Path, count: int, variants: int = 9, seed: int = 0):
+    """Write ``count`` printer profiles: base models with inheriting variants"""
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    models = max(1, count // (variants + 1))
+    written = 0
+    for model in range(models):
+        base = f"Vendor {model % 17} Model {model}"
+        profiles = [{
+            'name': base,
+            'vendor': f"Vendor {model % 17}",
+            'settings': {
+                'bed_size': {'x': rng.randrange(120, 400), 'y': rng.randrange(120, 400),
+                             'z': rng.randrange(120, 400)},
+                'nozzle_diameter': 0.4,
+                'max_temp': {'bed': rng.choice([100, 110, 120]), 'nozzle': rng.choice([260, 280, 300])}
+            }
+        }]
+        written += 1
+        for variant in range(min(variants, count - written)):
+            profiles.append({
+                'name': f"{base} ({0.2 + 0.1 * variant:.1f} mm nozzle)",
+                'inherits': base,
+                'settings': {'nozzle_diameter': round(0.2 + 0.1 * variant, 1)}
+            })
+            written += 1
+        with open(directory / f"model_{model:04d}.yaml", 'w') as f:
+            yaml.safe_dump(profiles, f)
+
+def measure_catalog(count: int = 1000, runs: int = 5, lookups: int = 100000,
+                    workdir: Optional[Path] = None) -> Dict:
+    """Time cold and indexed loads, lookups and searches of a printer catalog"""
+    from utils.printer_catalog import PrinterCatalog
+    tmpdir = Path(tempfile.mkdtemp(dir=workdir))
+    try:
+        profiles_dir = tmpdir / "printers"
+        make_catalog(profiles_dir, count)
+        all_runs = []
+        for index in range(runs):
+            index_path = tmpdir / f"index_{index}.idx"
+            telemetry = Telemetry()
+            samples = {}
+            stages = [
+                ('catalog_cold', lambda: PrinterCatalog.load(profiles_dir, index_path)),
+                ('catalog_index', lambda: PrinterCatalog.load(profiles_dir, index_path))
+            ]
+            for name, load in stages:
+                with RssSampler() as sampler, telemetry.stage(name) as stage:
+                    samples[name] = load()
+                    stage.ok = len(samples[name]) == count
+                stage.details['peak_rss'] = sampler.peak
+            catalog = samples['catalog_index']
+            names = catalog.names
+            with RssSampler() as sampler, telemetry.stage('lookup') as stage:
+                stage.ok = all(catalog.get(names[i % len(names)]) for i in range(lookups))
+            stage.details['peak_rss'] = sampler.peak
+            queries = [name[:length].lower() for name in names[::max(1, len(names) // 100)]
+                       for length in (3, 8)]
+            with RssSampler() as sampler, telemetry.stage('search') as stage:
+                stage.ok = all(catalog.search(query, limit=20) for query in queries)
+            stage.details['peak_rss'] = sampler.peak
+            all_runs.append(telemetry.summary())
+    finally:
+        shutil.rmtree(tmpdir)
+
+    results = []
+    for stage in _median_run(all_runs):
+        stage['mb_per_s'] = 0.0
+        results.append(stage)
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'profiles': count,
+            'lookups': lookups,
+            'searches': len(queries),
+            'repeat': runs
+        },
+        'stages': results
+    }
+
+def compare_results(baseline: Dict, current: Dict, threshold: float = 0.10) -> List[Dict]:
+    """Compare two result sets stage by stage
+
+    A stage regresses when its wall time grows, or its throughput drops,
+    by more than ``threshold`` (a fraction) relative to the baseline.
+    """
+    before = {stage['stage']: stage for stage in baseline['stages']}
+    comparison = []
+    for stage in current['stages']:
+        old = before.get(stage['stage'])
+        if old is None:
+            continue
+        time_change = (stage['duration'] - old['duration']) / old['duration'] if old['duration'] else 0.0
+        rate_change = (stage['mb_per_s'] - old['mb_per_s']) / old['mb_per_s'] if old['mb_per_s'] else 0.0
+        comparison.append({
+            'stage': stage['stage'],
+            'duration': (old['duration'], stage['duration']),
+            'mb_per_s': (old['mb_per_s'], stage['mb_per_s']),
+            'time_change': time_change,
+            'rate_change': rate_change,
+            'regression': time_change > threshold or rate_change < -threshold
+        })
+    return comparison
+
+def print_results(results: Dict):
+    meta = results['meta']
+    if 'command' in meta:
+        print(f"Startup of {' '.join(meta['command'])}, {meta['repeat']} run(s)")
+    elif 'profiles' in meta:
+        print(f"Printer catalog of {meta['profiles']} profiles, {meta['lookups']} lookups, "
+              f"{meta['searches']} searches, {meta['repeat']} run(s)")
+    else:
+        print(f"{meta['size'] // (1024 * 1024)} MiB image, profile {meta['profile']}, "
+              f"{meta['repeat']} run(s)")
+    print(f"{'stage':<12} {'MB/s':>9} {'wall s':>9} {'cpu s':>9} {'peak RSS MiB':>13}")
+    for stage in results['stages']:
+        status = "" if stage['ok'] else "  FAILED"
+        print(f"{stage['stage']:<12} {stage['mb_per_s']:9.1f} {stage['duration']:9.2f} "
+              f"{stage['cpu_time']:9.2f} {stage['peak_rss'] / (1024 * 1024):13.1f}{status}")
+
+def print_comparison(comparison: List[Dict]):
+    print(f"{'stage':<12} {'wall s':>17} {'change':>8} {'MB/s':>17} {'change':>8}")
+    for row in comparison:
+        flag = "  REGRESSION" if row['regression'] else ""
+        print(f"{row['stage']:<12} {row['duration'][0]:8.2f} {row['duration'][1]:8.2f} "
+              f"{row['time_change']:+8.1%} {row['mb_per_s'][0]:8.1f} {row['mb_per_s'][1]:8.1f} "
+              f"{row['rate_change']:+8.1%}{flag}")
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the install pipeline against simulated devices")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="run the benchmark suite")
+    run_parser.add_argument('--size', type=int, default=64, help="image size in MiB")
+    run_parser.add_argument('--profile', choices=sorted(PROFILES), default='class10')
+    run_parser.add_argument('--stages', default=",".join(STAGES),
+                            help="comma-separated stages to run")
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('--segments', type=int, default=4)
+    run_parser.add_argument('--block-size', type=int, default=4096, help="write block size in KiB")
+    run_parser.add_argument('--queue-depth', type=int, default=4, help="outstanding writes")
+    run_parser.add_argument('--rate-limit', type=float, help="per-connection download limit in MB/s")
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--output', type=Path, help="save results as JSON")
+    run_parser.add_argument('--baseline', type=Path, help="compare against a saved result")
+    run_parser.add_argument('--threshold', type=float, default=0.10)
+
+    startup_parser = commands.add_parser(
+        'startup', help="time process start to first window paint "
+                        "(set QT_QPA_PLATFORM=offscreen on headless machines)"
+    )
+    startup_parser.add_argument('--command', dest='executable', nargs='+', help="executable to measure, e.g. dist/main.exe")
+    startup_parser.add_argument('--runs', type=int, default=5)
+    startup_parser.add_argument('--budget', type=float, help="fail if startup takes longer (seconds)")
+    startup_parser.add_argument('--output', type=Path, help="save results as JSON")
+    startup_parser.add_argument('--baseline', type=Path, help="compare against a saved result")
+    startup_parser.add_argument('--threshold', type=float, default=0.10)
+
+    catalog_parser = commands.add_parser('catalog', help="time loading and searching the printer catalog")
+    catalog_parser.add_argument('--profiles', type=int, default=1000)
+    catalog_parser.add_argument('--runs', type=int, default=5)
+    catalog_parser.add_argument('--output', type=Path, help="save results as JSON")
+    catalog_parser.add_argument('--baseline', type=Path, help="compare against a saved result")
+    catalog_parser.add_argument('--threshold', type=float, default=0.10)
+
+    compare_parser = commands.add_parser('compare', help="compare two saved results")
+    compare_parser.add_argument('baseline', type=Path)
+    compare_parser.add_argument('current', type=Path)
+    compare_parser.add_argument('--threshold', type=float, default=0.10)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.command == 'compare':
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        with open(args.current, 'r') as f:
+            current = json.load(f)
+        comparison = compare_results(baseline, current, args.threshold)
+        print_comparison(comparison)
+        return 1 if any(row['regression'] for row in comparison) else 0
+
+    if args.command == 'startup':
+        results = measure_startup(args.executable, args.runs)
+    elif args.command == 'catalog':
+        results = measure_catalog(args.profiles, args.runs)
+    else:
+        stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+        results = run_benchmarks(
+            args.size * 1024 * 1024,
+            profile=args.profile,
+            stages=stages,
+            repeat=args.repeat,
+            segments=args.segments,
+            block_size=args.block_size * 1024,
+            rate_limit=int(args.rate_limit * 1e6) if args.rate_limit else None,
+            seed=args.seed,
+            queue_depth=args.queue_depth
+        )
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    failed = not all(stage['ok'] for stage in results['stages'])
+    budget = getattr(args, 'budget', None)
+    if budget is not None and results['stages'][0]['duration'] > budget:
+        print(f"Startup took {results['stages'][0]['duration']:.2f}s, budget is {budget:.2f}s")
+        failed = True
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        comparison = compare_results(baseline, results, args.threshold)
+        print_comparison(comparison)
+        failed = failed or any(row['regression'] for row in comparison)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
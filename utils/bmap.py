@@ -0,0 +1,361 @@
+import hashlib
+import logging
+import os
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from utils.decompress import decompressed_chunks, detect_compression, file_chunks
+
+BMAP_VERSION = "2.0"
+
+class BlockMap:
+    """Block map of an image: the mapped block ranges and their checksums
+
+    Stored in the bmaptool XML format (version 2.0) so maps produced by
+    ``bmaptool create`` can be used as-is. Unmapped blocks hold no data and
+    are neither written nor verified.
+    """
+
+    def __init__(self, image_size: int, block_size: int = 4096,
+                 ranges: Optional[List[Tuple[int, int, str]]] = None):
+        self.image_size = image_size
+        self.block_size = block_size
+        # (first block, last block, sha256 of the range)
+        self.ranges: List[Tuple[int, int, str]] = ranges or []
+
+    @property
+    def blocks_count(self) -> int:
+        return -(-self.image_size // self.block_size)
+
+    @property
+    def mapped_blocks(self) -> int:
+        return sum(last - first + 1 for first, last, _ in self.ranges)
+
+    @property
+    def mapped_bytes(self) -> int:
+        return sum(length for _, length, _ in self.byte_ranges())
+
+    def byte_ranges(self) -> List[Tuple[int, int, str]]:
+        """Get the mapped ranges as (offset, length, sha256)"""
+        result = []
+        for first, last, checksum in self.ranges:
+            offset = first * self.block_size
+            end = min((last + 1) * self.block_size, self.image_size)
+            result.append((offset, end - offset, checksum))
+        return result
+
+    def to_xml(self) -> str:
+        """Serialise to bmaptool XML, including the file checksum"""
+        def render(file_checksum: str) -> str:
+            lines = [
+                '<?xml version="1.0" ?>',
+                f'<bmap version="{BMAP_VERSION}">',
+                f'    <ImageSize> {self.image_size} </ImageSize>',
+                f'    <BlockSize> {self.block_size} </BlockSize>',
+                f'    <BlocksCount> {self.blocks_count} </BlocksCount>',
+                f'    <MappedBlocksCount> {self.mapped_blocks} </MappedBlocksCount>',
+                '    <ChecksumType> sha256 </ChecksumType>',
+                f'    <BmapFileChecksum> {file_checksum} </BmapFileChecksum>',
+                '    <BlockMap>',
+            ]
+            for first, last, checksum in self.ranges:
+                blocks = f"{first}" if first == last else f"{first}-{last}"
+                lines.append(f'        <Range chksum="{checksum}"> {blocks} </Range>')
+            lines += ['    </BlockMap>', '</bmap>', '']
+            return "\n".join(lines)
+
+        # The file checksum is taken with its own field set to all zeros
+        file_checksum = hashlib.sha256(render("0" * 64).encode()).hexdigest()
+        return render(file_checksum)
+
+    @classmethod
+    def from_xml(cls, text: str) -> 'BlockMap':
+        """Parse bmaptool XML, checking the embedded file checksum"""
+        root = ET.fromstring(text)
+        if root.tag != "bmap" or not root.get("version", "").startswith("2."):
+            raise ValueError(f"Unsupported bmap version: {root.get('version')}")
+        if root.findtext("ChecksumType", "").strip() != "sha256":
+            raise ValueError("Only sha256 block maps are supported")
+
+        file_checksum = root.findtext("BmapFileChecksum", "").strip()
+        if file_checksum:
+            zeroed = text.replace(file_checksum, "0" * 64, 1)
+            if hashlib.sha256(zeroed.encode()).hexdigest() != file_checksum:
+                raise ValueError("Block map file checksum mismatch")
+
+        ranges = []
+        for element in root.find("BlockMap"):
+            blocks = element.text.strip()
+            first, _, last = blocks.partition("-")
+            ranges.append((int(first), int(last or first), element.get("chksum")))
+        return cls(int(root.findtext("ImageSize")), int(root.findtext("BlockSize")), ranges)
+
+    @classmethod
+    def load(cls, path: Path) -> 'BlockMap':
+        with open(path, 'r') as f:
+            return cls.from_xml(f.read())
+
+    def save(self, path: Path):
+        tmp_path = Path(path).with_name(Path(path).name + ".tmp")
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_xml())
+        os.replace(tmp_path, path)
+
+class RangeVerifier:
+    """Check a sequentially read image against a block map
+
+    Besides the checksum of every mapped range, the bytes outside the
+    ranges must be zero and the image must have the map's size: a map
+    that leaves out data would otherwise have it neither written nor
+    verified.
+    """
+
+    def __init__(self, block_map: BlockMap):
+        self.image_size = block_map.image_size
+        self.ranges = block_map.byte_ranges()
+        self.mismatches: List[Tuple[int, int]] = []
+        # Offsets of data found outside the mapped ranges
+        self.unmapped_data: List[int] = []
+        self.size = 0
+        self._index = 0
+        self._hash = hashlib.sha256()
+
+    def update(self, offset: int, data) -> None:
+        """Feed the image bytes at ``offset`` (calls must be in order)"""
+        view = memoryview(data)
+        end = offset + len(view)
+        position = offset
+        while position < end:
+            if self._index >= len(self.ranges):
+                self._check_unmapped(position, view[position - offset:])
+                break
+            start, length, checksum = self.ranges[self._index]
+            if position < start:
+                gap_end = min(start, end)
+                self._check_unmapped(position, view[position - offset:gap_end - offset])
+                position = gap_end
+                continue
+            hi = min(start + length, end)
+            self._hash.update(view[position - offset:hi - offset])
+            position = hi
+            if hi == start + length:
+                if self._hash.hexdigest() != checksum:
+                    self.mismatches.append((start, length))
+                self._hash = hashlib.sha256()
+                self._index += 1
+        self.size = max(self.size, end)
+
+    def skip(self, offset: int, length: int) -> None:
+        """Account for image bytes known to be zero without reading them"""
+        self.size = max(self.size, offset + length)
+
+    def _check_unmapped(self, offset: int, view) -> None:
+        if view.tobytes().strip(b"\0"):
+            self.unmapped_data.append(offset)
+
+    @property
+    def complete(self) -> bool:
+        return self._index >= len(self.ranges)
+
+    @property
+    def ok(self) -> bool:
+        return (self.complete and not self.mismatches and not self.unmapped_data
+                and self.size == self.image_size)
+
+    def problem(self) -> Optional[str]:
+        """Why the map does not describe the image, or None"""
+        if self.size != self.image_size:
+            return f"image has {self.size} bytes, the block map {self.image_size}"
+        if self.mismatches or not self.complete:
+            return f"{len(self.mismatches) + len(self.ranges) - self._index} bad ranges"
+        if self.unmapped_data:
+            return f"data outside the mapped ranges at offsets {self.unmapped_data[:10]}"
+        return None
+
+def check_block_map(block_map: BlockMap, image_path: Path, manifest=None) -> RangeVerifier:
+    """Check a block map against the image it is to restrict writes to
+
+    Compressed images are decompressed. Given the (authenticated) chunk
+    manifest of a raw image, chunks without mapped data are compared with
+    the hash of zeros instead of being read.
+    """
+    verifier = RangeVerifier(block_map)
+    with open(image_path, 'rb') as f:
+        compression = detect_compression(f.read(8))
+    if compression is not None or manifest is None:
+        offset = 0
+        for chunk in decompressed_chunks(file_chunks(image_path, 4 * 1024 * 1024), compression):
+            verifier.update(offset, chunk)
+            offset += len(chunk)
+        return verifier
+
+    mapped = set()
+    for offset, length, _ in verifier.ranges:
+        mapped.update(manifest.chunks_for(offset, length))
+    zero_hashes = {}
+    with open(image_path, 'rb') as f:
+        for index in range(len(manifest)):
+            offset, length = manifest.chunk_range(index)
+            if index in mapped:
+                f.seek(offset)
+                verifier.update(offset, f.read(length))
+                continue
+            if length not in zero_hashes:
+                zero_hashes[length] = hashlib.sha256(bytes(length)).hexdigest()
+            if manifest.chunks[index] != zero_hashes[length]:
+                verifier.unmapped_data.append(offset)
+            verifier.skip(offset, length)
+    return verifier
+
+def _data_extents(f, size: int) -> List[Tuple[int, int]]:
+    """Allocated extents of a file, from SEEK_DATA/SEEK_HOLE where available"""
+    if not hasattr(os, 'SEEK_DATA'):
+        return [(0, size)]
+    fd = f.fileno()
+    extents = []
+    offset = 0
+    try:
+        while offset < size:
+            try:
+                start = os.lseek(fd, offset, os.SEEK_DATA)
+            except OSError:
+                break  # ENXIO: no data past offset
+            end = os.lseek(fd, start, os.SEEK_HOLE)
+            extents.append((start, min(end, size)))
+            offset = end
+    except OSError:
+        return [(0, size)]
+    return extents
+
+def generate_bmap(image_path: Path, block_size: int = 4096) -> BlockMap:
+    """Generate a block map by scanning a raw image
+
+    Only extents the image file actually has allocated (SEEK_DATA) are
+    read, and blocks in them that are entirely zero are left unmapped.
+    """
+    size = os.path.getsize(image_path)
+    zero_block = bytes(block_size)
+    mapped: List[Tuple[int, int]] = []
+
+    with open(image_path, 'rb') as f:
+        for start, end in _data_extents(f, size):
+            block = start // block_size
+            last_block = (end - 1) // block_size
+            f.seek(block * block_size)
+            while block <= last_block:
+                data = f.read(min(256, last_block - block + 1) * block_size)
+                if not data:
+                    break
+                for i in range(0, len(data), block_size):
+                    piece = data[i:i + block_size]
+                    if piece != zero_block[:len(piece)]:
+                        if mapped and mapped[-1][1] >= block - 1:
+                            mapped[-1] = (mapped[-1][0], max(mapped[-1][1], block))
+                        else:
+                            mapped.append((block, block))
+                    block += 1
+
+        ranges = []
+        for first, last in mapped:
+            f.seek(first * block_size)
+            remaining = min((last + 1) * block_size, size) - first * block_size
+            sha256_hash = hashlib.sha256()
+            while remaining:
+                data = f.read(min(4 * 1024 * 1024, remaining))
+                sha256_hash.update(data)
+                remaining -= len(data)
+            ranges.append((first, last, sha256_hash.hexdigest()))
+
+    return BlockMap(size, block_size, ranges)
+
+def write_mapped_ranges(writer, image_path: Path, block_map: BlockMap,
+                        progress: Optional[Callable[[int], None]] = None,
+                        patches=None, start: int = 0) -> int:
+    """Write only the mapped ranges of an image through an open RawWriter
+
+    Each range is hashed as it is read and the write fails on the first
+    mismatch. Uncompressed images are read with seeks, compressed ones are
+    decompressed as a stream and filtered. ``patches`` (a PatchSet) are
+    laid over the data, and patched bytes outside the mapped ranges are
+    written as well. Data before ``start`` is already on the target; it
+    is still hashed but not written again. Returns the bytes written.
+    """
+    with open(image_path, 'rb') as f:
+        compression = detect_compression(f.read(8))
+
+    def write_at(position: int, data):
+        skip = max(0, start - position)
+        if skip < len(data):
+            data = data[skip:] if skip else data
+            writer.write_at(position + skip, patches.apply(position + skip, data) if patches else data)
+
+    written = 0
+    if compression is None:
+        with open(image_path, 'rb') as f:
+            for offset, length, checksum in block_map.byte_ranges():
+                f.seek(offset)
+                sha256_hash = hashlib.sha256()
+                position = offset
+                remaining = length
+                while remaining:
+                    data = f.read(min(writer.block_size, remaining))
+                    if not data:
+                        raise ValueError(f"Image ends inside mapped range at {offset}")
+                    sha256_hash.update(data)
+                    write_at(position, data)
+                    position += len(data)
+                    remaining -= len(data)
+                    written += len(data)
+                    if progress:
+                        progress(written)
+                if sha256_hash.hexdigest() != checksum:
+                    raise ValueError(f"Checksum mismatch in mapped range at offset {offset}")
+    else:
+        verifier = RangeVerifier(block_map)
+        ranges = block_map.byte_ranges()
+        index = 0
+        offset = 0
+        for chunk in decompressed_chunks(file_chunks(image_path, writer.block_size), compression):
+            verifier.update(offset, chunk)
+            if verifier.mismatches:
+                mismatch_start, _ = verifier.mismatches[0]
+                raise ValueError(f"Checksum mismatch in mapped range at offset {mismatch_start}")
+            end = offset + len(chunk)
+            view = memoryview(chunk)
+            while index < len(ranges) and ranges[index][0] < end:
+                range_start, length, _ = ranges[index]
+                lo = max(range_start, offset)
+                hi = min(range_start + length, end)
+                if lo < hi:
+                    data = view[lo - offset:hi - offset]
+                    write_at(lo, data)
+                    written += hi - lo
+                if range_start + length > end:
+                    break
+                index += 1
+            offset = end
+            if progress:
+                progress(written)
+        if not verifier.complete:
+            raise ValueError("Image ends before the last mapped range")
+
+    if patches:
+        ranges = [(offset, length) for offset, length, _ in block_map.byte_ranges()]
+        for offset, data in patches.outside(ranges):
+            writer.write_at(offset, data)
+            written += len(data)
+    writer.finish(block_map.image_size)
+    return written
+
+if __name__ == "__main__":
+    # python -m utils.bmap system.img [system.img.bmap]
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    image = Path(sys.argv[1])
+    output = Path(sys.argv[2]) if len(sys.argv) > 2 else image.with_name(image.name + ".bmap")
+    block_map = generate_bmap(image)
+    block_map.save(output)
+    print(f"{output}: {block_map.mapped_bytes} of {block_map.image_size} bytes mapped "
+          f"in {len(block_map.ranges)} ranges")
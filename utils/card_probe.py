@@ -0,0 +1,260 @@
+import logging
+import math
+import os
+import random
+import struct
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from utils.raw_writer import RawWriter
+from utils.readback import ReadbackVerifier
+from utils.verdicts import CANCELLED, FAIL, PASS, WARN
+
+# Every probe block starts with this tag: magic, the offset it was written
+# to and the probe's seed, so a block read back elsewhere is recognised
+TAG = struct.Struct('<8sQQ')
+MAGIC = b'INNOPRB1'
+
+# Sequential write speed (bytes/s): Class 10 promises 10 MB/s, Class 4 4 MB/s
+WARN_SEQUENTIAL = 10 * 1000 * 1000
+FAIL_SEQUENTIAL = 4 * 1000 * 1000
+# Random 4 KiB writes per second; A1 cards promise 500, poor cards manage a handful
+WARN_RANDOM_IOPS = 50
+
+class ProbeCancelled(Exception):
+    """The probe was cancelled"""
+
+def probe_block(offset: int, seed: int, size: int) -> bytes:
+    """The pseudo-random, position-tagged content of the probe block at ``offset``"""
+    body = random.Random(seed * 0x9e3779b97f4a7c15 + offset).randbytes(size - TAG.size)
+    return TAG.pack(MAGIC, offset, seed) + body
+
+class CardProbe:
+    """Check a card for fake capacity and its write speed in a few seconds
+
+    Counterfeit cards report more capacity than they hold: writes past the
+    real end are dropped or wrap around onto earlier addresses. The probe
+    writes tagged blocks at ``samples`` offsets spread over the reported
+    size, plus every power of two (where wrapping cards alias onto
+    address 0), flushes them and reads them back past the page cache. A
+    block that reads back with another offset's tag or without a tag marks
+    the card as fake; the real capacity is estimated from where that
+    happens.
+
+    Sequential speed is timed writing ``sequential_bytes`` in the middle
+    of the card, random speed writing ``random_writes`` 4 KiB blocks at
+    random offsets, both up to the fsync. With ``restore`` everything the
+    probe overwrites is read first and written back afterwards; a card
+    about to be flashed does not need that.
+
+    ``progress`` is called with the bytes written and read back so far and
+    their total. Setting ``cancel`` stops the probe after the block at hand,
+    still restoring what it overwrote, with the verdict CANCELLED.
+    """
+
+    def __init__(self, target: str, size: int, samples: int = 64, block_size: int = 64 * 1024,
+                 sequential_bytes: int = 16 * 1024 * 1024, random_writes: int = 64,
+                 restore: bool = True, seed: Optional[int] = None,
+                 make_writer: Optional[Callable[..., RawWriter]] = None,
+                 read: Optional[Callable[[int, int], bytes]] = None,
+                 progress: Optional[Callable[[int, int], None]] = None,
+                 cancel: Optional[threading.Event] = None):
+        self.logger = logging.getLogger(__name__)
+        self.target = target
+        self.size = size
+        self.samples = samples
+        self.block_size = block_size
+        self.sequential_bytes = sequential_bytes
+        self.random_writes = random_writes
+        self.restore = restore
+        self.seed = random.getrandbits(32) if seed is None else seed
+        # Writers and reads of the target; FakeDevice.writer and .read for tests
+        self.make_writer = make_writer or (lambda **kwargs: RawWriter(target, **kwargs))
+        self.read = read
+        self.progress = progress
+        self.cancel = cancel
+        self.bytes_done = 0
+        self.bytes_total = 0
+        self._rng = random.Random(self.seed)
+
+    def _advance(self, count: int):
+        """Count probed bytes; raises ProbeCancelled once the probe is cancelled"""
+        self.bytes_done += count
+        if self.progress:
+            self.progress(self.bytes_done, self.bytes_total)
+        if self.cancel is not None and self.cancel.is_set():
+            raise ProbeCancelled()
+
+    def _writer(self, block_size: int) -> RawWriter:
+        return self.make_writer(block_size=block_size, zero_mode='write', kernel_copy=False)
+
+    def sample_offsets(self) -> List[int]:
+        """Block-aligned offsets across the reported size, in ascending order"""
+        last = (self.size - self.block_size) // self.block_size * self.block_size
+        offsets = {0, last}
+        power = self.block_size
+        while power <= last:
+            offsets.add(power)
+            power *= 2
+        for index in range(self.samples):
+            # One random block in each of ``samples`` equal stretches
+            low = self.size * index // self.samples
+            high = min(self.size * (index + 1) // self.samples, last + self.block_size)
+            if high - low >= self.block_size:
+                offsets.add(self._rng.randrange(low, high - self.block_size + 1) // self.block_size * self.block_size)
+        return sorted(offsets)
+
+    def _check_capacity(self, read: Callable[[int, int], bytes], offsets: List[int]) -> Dict:
+        with self._writer(self.block_size) as writer:
+            for offset in offsets:
+                writer.write_at(offset, probe_block(offset, self.seed, self.block_size))
+                self._advance(self.block_size)
+            writer.finish(0)
+
+        lost, aliases = [], []
+        for offset in offsets:
+            data = read(offset, self.block_size)
+            self._advance(self.block_size)
+            if data == probe_block(offset, self.seed, self.block_size):
+                continue
+            magic, tagged, seed = TAG.unpack_from(data.ljust(TAG.size, b'\0'))
+            if magic == MAGIC and seed == self.seed and tagged != offset:
+                # Both addresses reach the same flash: the card wraps around
+                aliases.append((offset, tagged))
+            else:
+                lost.append(offset)
+
+        # A wrapping card's capacity divides the distance of every alias pair;
+        # a dropping card's ends before the first lost block
+        estimate = self.size
+        if aliases:
+            estimate = min(estimate, math.gcd(*(abs(tagged - offset) for offset, tagged in aliases)))
+        if lost:
+            estimate = min(estimate, lost[0])
+        return {
+            'reported': self.size,
+            'estimate': estimate,
+            'samples': len(offsets),
+            'lost': lost[:20],
+            'aliases': aliases[:20],
+            'ok': not lost and not aliases
+        }
+
+    def _timed_write(self, block_size: int, writes: List[tuple]) -> float:
+        """Seconds to write and flush the given (offset, data) pairs"""
+        started = time.monotonic()
+        with self._writer(block_size) as writer:
+            for offset, data in writes:
+                writer.write_at(offset, data)
+                self._advance(len(data))
+            writer.finish(0)
+        return max(time.monotonic() - started, 1e-9)
+
+    def _speed_writes(self):
+        chunk = 4 * 1024 * 1024
+        length = min(self.sequential_bytes, self.size // 4) // chunk * chunk
+        start = self.size // 2 // chunk * chunk
+        sequential = [(offset, self._rng.randbytes(chunk)) for offset in range(start, start + length, chunk)]
+        last = self.size // 4096 - 1
+        scattered = [(self._rng.randint(0, last) * 4096, self._rng.randbytes(4096))
+                     for _ in range(self.random_writes)]
+        return sequential, scattered
+
+    def run(self) -> Dict:
+        """Probe the card; returns the verdict with the measurements behind it"""
+        started = time.monotonic()
+        reasons = []
+        report = {'target': self.target, 'verdict': PASS, 'reasons': reasons, 'seed': self.seed}
+        offsets = self.sample_offsets()
+        sequential, scattered = self._speed_writes()
+        # (offset, length) of everything the probe writes; restored afterwards
+        touched = [(offset, self.block_size) for offset in offsets]
+        touched += [(offset, len(data)) for offset, data in sequential + scattered]
+        # Probe blocks are written and read back, the speed samples only written
+        self.bytes_done = 0
+        self.bytes_total = sum(length for _, length in touched) + len(offsets) * self.block_size
+        # Reads must come from the card, not from the page cache
+        reader = ReadbackVerifier(self.target)
+        read = self.read or reader.read
+        saved = []
+        try:
+            if self.restore:
+                saved = [(offset, read(offset, length)) for offset, length in touched]
+
+            report['capacity'] = self._check_capacity(read, offsets)
+            if not report['capacity']['ok']:
+                reasons.append(f"Card holds about {report['capacity']['estimate']} of the "
+                               f"{self.size} bytes it reports")
+            else:
+                # Speeds of a card that loses data mean nothing
+                if sequential:
+                    rate = sum(len(data) for _, data in sequential) / self._timed_write(4 * 1024 * 1024, sequential)
+                    report['sequential_write'] = rate
+                    if rate < FAIL_SEQUENTIAL:
+                        reasons.append(f"Sequential writes at {rate / 1e6:.1f} MB/s")
+                    elif rate < WARN_SEQUENTIAL:
+                        reasons.append(f"Sequential writes at {rate / 1e6:.1f} MB/s (below Class 10)")
+                if scattered:
+                    iops = len(scattered) / self._timed_write(4096, scattered)
+                    report['random_write_iops'] = iops
+                    if iops < WARN_RANDOM_IOPS:
+                        reasons.append(f"Random 4 KiB writes at {iops:.0f}/s")
+
+            if not report['capacity']['ok'] or report.get('sequential_write', FAIL_SEQUENTIAL) < FAIL_SEQUENTIAL:
+                report['verdict'] = FAIL
+            elif reasons:
+                report['verdict'] = WARN
+        except ProbeCancelled:
+            report['verdict'] = CANCELLED
+            reasons.append("The card check was cancelled")
+        except OSError as e:
+            # Cards past their real end often fail I/O instead of dropping it
+            report['verdict'] = FAIL
+            reasons.append(f"I/O error while probing: {e}")
+        finally:
+            reader.finish()
+            try:
+                if saved:
+                    with self._writer(self.block_size) as writer:
+                        for offset, data in saved:
+                            writer.write_at(offset, data)
+                        writer.finish(0)
+            except OSError as e:
+                self.logger.warning(f"Could not restore the probed blocks of {self.target}: {e}")
+
+        report['duration'] = round(time.monotonic() - started, 3)
+        self.logger.info(f"Card probe of {self.target}: {report['verdict']}"
+                         + (f" ({'; '.join(reasons)})" if reasons else ""))
+        return report
+
+if __name__ == "__main__":
+    # python -m utils.card_probe: probe throttled fake cards, one of them counterfeit
+    import json
+    import shutil
+    import sys
+    import tempfile
+    from pathlib import Path
+    from utils.fake_device import FakeDevice
+
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) > 1:
+        fd = os.open(sys.argv[1], os.O_RDONLY)
+        size = os.lseek(fd, 0, os.SEEK_END)
+        os.close(fd)
+        print(json.dumps(CardProbe(sys.argv[1], size).run(), indent=2, default=str))
+        sys.exit(0)
+    workdir = Path(tempfile.mkdtemp())
+    try:
+        devices = {profile: FakeDevice.from_profile(workdir / f"{profile}.img", 256 * 1024 * 1024, profile)
+                   for profile in ('class4', 'class10', 'uhs1')}
+        # Reports 256 MiB, holds 32 MiB
+        devices['counterfeit'] = FakeDevice(workdir / "counterfeit.img", 256 * 1024 * 1024,
+                                            capacity=32 * 1024 * 1024)
+        for name, device in devices.items():
+            device.create()
+            report = CardProbe(str(device.path), device.size, make_writer=device.writer,
+                               read=device.read).run()
+            print(f"{name:<12} {report['verdict']:<5} {report['reasons']}")
+    finally:
+        shutil.rmtree(workdir)
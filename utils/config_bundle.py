@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+from pathlib import Path, PurePath
+from typing import Any, Dict, List, Type
+
+import yaml
+
+# libyaml's C emitter and parser are several times faster where installed
+SafeDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Written last: a bundle whose manifest matches its files is complete
+MANIFEST_PATH = 'innovateos/config/manifest.json'
+MANIFEST_VERSION = 1
+
+def dump_yaml(data: Any) -> bytes:
+    """Render a configuration as YAML"""
+    return yaml.dump(data, Dumper=SafeDumper, allow_unicode=True).encode('utf-8')
+
+def load_yaml(data) -> Any:
+    """Parse YAML from bytes, text or an open file"""
+    return yaml.load(data, Loader=SafeLoader)
+
+def drive_root(root: str, flavour: Type[PurePath] = Path) -> PurePath:
+    """The directory a mount point names
+
+    A bare Windows drive letter ("E:") names the current directory on
+    that drive, not its root; anchor it so files land at the top of the
+    card.
+    """
+    path = flavour(root)
+    if path.drive and not path.root:
+        path = flavour(path.drive + '\\', *path.parts[1:])
+    return path
+
+def build_bundle(files: Dict[str, bytes]) -> Dict[str, bytes]:
+    """Add a manifest with the size and SHA-256 of every file to a bundle"""
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'files': {
+            path: {'size': len(data), 'sha256': hashlib.sha256(data).hexdigest()}
+            for path, data in files.items()
+        }
+    }
+    return {**files, MANIFEST_PATH: json.dumps(manifest, indent=2, sort_keys=True).encode()}
+
+def write_bundle(root: str, bundle: Dict[str, bytes]):
+    """Write all files of a bundle, replacing none of them until all are on disk
+
+    Every file goes to a temporary name first; after a single flush and
+    sync pass the temporaries are renamed over the real files in bundle
+    order, the manifest last. A failure before the renames leaves the
+    previous configuration untouched; one during them leaves a manifest
+    that does not match, which verification reports.
+    """
+    root = drive_root(root)
+    pending = []
+    try:
+        for path, data in bundle.items():
+            target = root / path
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = target.with_name(target.name + ".tmp")
+            f = open(tmp_path, 'wb')
+            pending.append((f, tmp_path, target))
+            f.write(data)
+        for f, _, _ in pending:
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        for _, tmp_path, target in pending:
+            os.replace(tmp_path, target)
+        pending = []
+    finally:
+        for f, tmp_path, _ in pending:
+            f.close()
+            tmp_path.unlink(missing_ok=True)
+
+    if hasattr(os, 'O_DIRECTORY'):
+        # Make the renames durable
+        for directory in {str((root / path).parent) for path in bundle}:
+            fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+def read_manifest(root: str) -> Dict:
+    with open(drive_root(root) / MANIFEST_PATH, 'r') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported config manifest version {manifest.get('version')}")
+    return manifest
+
+def verify_bundle(root: str) -> List[str]:
+    """Check the files of a written bundle against its manifest
+
+    Returns the paths that are missing or whose size or hash differ.
+    """
+    root = drive_root(root)
+    problems = []
+    for path, expected in read_manifest(root)['files'].items():
+        try:
+            data = (root / path).read_bytes()
+        except OSError:
+            problems.append(path)
+            continue
+        if len(data) != expected['size'] or hashlib.sha256(data).hexdigest() != expected['sha256']:
+            problems.append(path)
+    return problems
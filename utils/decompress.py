@@ -0,0 +1,282 @@
+import lzma
+import os
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Magic bytes at the start of each supported container
+MAGIC = {
+    'gz': b'\x1f\x8b',
+    'xz': b'\xfd7zXZ\x00',
+    'zst': b'\x28\xb5\x2f\xfd',
+}
+SUFFIXES = {'.gz': 'gz', '.xz': 'xz', '.zst': 'zst'}
+
+# Decompressed output is handed on in pieces of at most this size
+OUTPUT_CHUNK = 4 * 1024 * 1024
+# Decoded zstd frames waiting to be handed on, at most
+MAX_PENDING_OUTPUT = 64 * 1024 * 1024
+
+def compression_for(name: str) -> Optional[str]:
+    """Get the compression of a release artifact from its file name or URL"""
+    return SUFFIXES.get(Path(name.split('?')[0]).suffix.lower())
+
+def detect_compression(header: bytes) -> Optional[str]:
+    """Get the compression of a stream from its first bytes"""
+    for compression, magic in MAGIC.items():
+        if header.startswith(magic):
+            return compression
+    return None
+
+def file_chunks(path: Path, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    """Read a file as a sequence of chunks"""
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            yield chunk
+
+def _stdlib_chunks(chunks: Iterable[bytes], new_decompressor) -> Iterator[bytes]:
+    """Decompress gzip/xz input, including concatenated members/streams"""
+    decompressor = new_decompressor()
+    started = False
+    for chunk in chunks:
+        data = chunk
+        started = started or bool(chunk)
+        while True:
+            output = decompressor.decompress(data, OUTPUT_CHUNK)
+            if output:
+                yield output
+            if decompressor.eof:
+                data = decompressor.unused_data
+                decompressor = new_decompressor()
+                started = bool(data)
+                if not data:
+                    break
+            elif isinstance(decompressor, lzma.LZMADecompressor):
+                # Output held back by the size limit is drained before new input
+                if decompressor.needs_input:
+                    break
+                data = b''
+            else:
+                data = decompressor.unconsumed_tail
+                if not data and len(output) < OUTPUT_CHUNK:
+                    break
+    if started:
+        raise ValueError("Truncated compressed stream")
+
+def _zstd_header_length(buf: bytearray, start: int) -> int:
+    """Length of the header of the (non-skippable) zstd frame at ``start``"""
+    descriptor = buf[start + 4]
+    single_segment = descriptor & 0x20
+    length = 5
+    length += 0 if single_segment else 1
+    length += (0, 1, 2, 4)[descriptor & 0x03]
+    length += (1 if single_segment else 0, 2, 4, 8)[descriptor >> 6]
+    return length
+
+def _zstd_frame_info(buf: bytearray) -> Optional[Tuple[bool, Optional[int]]]:
+    """Whether the frame at the start of ``buf`` is skippable, and its decoded size
+
+    The size is None when the frame does not declare it; the result is
+    None while the frame header is incomplete.
+    """
+    if len(buf) < 5:
+        return None
+    magic = int.from_bytes(buf[:4], 'little')
+    if 0x184D2A50 <= magic <= 0x184D2A5F:
+        return True, 0
+    if magic != 0xFD2FB528:
+        raise ValueError("Invalid zstd frame magic")
+    header_length = _zstd_header_length(buf, 0)
+    if len(buf) < header_length:
+        return None
+    descriptor = buf[4]
+    field_size = (1 if descriptor & 0x20 else 0, 2, 4, 8)[descriptor >> 6]
+    if not field_size:
+        return False, None
+    size = int.from_bytes(buf[header_length - field_size:header_length], 'little')
+    return False, size + 256 if field_size == 2 else size
+
+def _zstd_frame_length(buf: bytearray, start: int) -> Optional[int]:
+    """Length of the zstd frame at ``start``, or None if it is incomplete"""
+    end = len(buf)
+    if end - start < 5:
+        return None
+    magic = int.from_bytes(buf[start:start + 4], 'little')
+    if 0x184D2A50 <= magic <= 0x184D2A5F:
+        # Skippable frame: magic, 4-byte size, payload
+        if end - start < 8:
+            return None
+        length = 8 + int.from_bytes(buf[start + 4:start + 8], 'little')
+        return length if end - start >= length else None
+    if magic != 0xFD2FB528:
+        raise ValueError("Invalid zstd frame magic")
+
+    has_checksum = buf[start + 4] & 0x04
+    pos = start + _zstd_header_length(buf, start)
+    while True:
+        if pos + 3 > end:
+            return None
+        header = int.from_bytes(buf[pos:pos + 3], 'little')
+        last = header & 1
+        block_type = (header >> 1) & 3
+        size = header >> 3
+        pos += 3 + (1 if block_type == 1 else size)
+        if last:
+            break
+    pos += 4 if has_checksum else 0
+    return pos - start if pos <= end else None
+
+def _zstd_frame_pieces(buf: bytearray, chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """The bytes of the zstd frame at the start of ``buf``, pulling more from ``chunks``
+
+    Block headers are followed as the data passes, so a frame of any size
+    is handed on without being buffered and a frame cut short is noticed.
+    Whatever follows the frame is left in ``buf``.
+    """
+    def fill(count: int):
+        while len(buf) < count:
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError("Truncated zstd stream")
+            buf.extend(chunk)
+
+    def take(count: int) -> Iterator[bytes]:
+        while count:
+            fill(1)
+            piece = bytes(buf[:count])
+            del buf[:len(piece)]
+            count -= len(piece)
+            yield piece
+
+    fill(8)
+    magic = int.from_bytes(buf[:4], 'little')
+    if 0x184D2A50 <= magic <= 0x184D2A5F:
+        yield from take(8 + int.from_bytes(buf[4:8], 'little'))
+        return
+    has_checksum = buf[4] & 0x04
+    header_length = _zstd_header_length(buf, 0)
+    fill(header_length)
+    yield from take(header_length)
+    while True:
+        fill(3)
+        header = int.from_bytes(buf[:3], 'little')
+        block_type = (header >> 1) & 3
+        yield from take(3 + (1 if block_type == 1 else header >> 3))
+        if header & 1:
+            break
+    if has_checksum:
+        yield from take(4)
+
+class _PieceReader:
+    """Read-only file object over an iterator of byte strings"""
+
+    def __init__(self, pieces: Iterator[bytes]):
+        self.pieces = pieces
+        self.rest = b''
+
+    def read(self, size: int = -1) -> bytes:
+        if not self.rest:
+            self.rest = next(self.pieces, b'')
+        if size < 0:
+            size = len(self.rest)
+        data, self.rest = self.rest[:size], self.rest[size:]
+        return data
+
+def _zstd_decompress_frame(frame: bytes) -> bytes:
+    return zstandard.ZstdDecompressor().decompress(frame)
+
+def _pieces(data: bytes) -> Iterator[bytes]:
+    """Split decoded output into OUTPUT_CHUNK pieces"""
+    for offset in range(0, len(data), OUTPUT_CHUNK):
+        yield data[offset:offset + OUTPUT_CHUNK]
+
+def _zstd_chunks(chunks: Iterable[bytes], threads: int,
+                 max_frame_output: int) -> Iterator[bytes]:
+    """Decompress zstd, fanning small frames out to a thread pool
+
+    Multi-frame archives (pzstd, seekable zstd) whose frames declare a
+    decoded size of at most ``max_frame_output`` are decoded in parallel
+    and reassembled in order, with at most MAX_PENDING_OUTPUT bytes of
+    decoded frames waiting. Larger frames and frames of unknown size are
+    decoded as a stream in the calling thread, so no more than
+    OUTPUT_CHUNK of their output is held at a time however well they
+    compress.
+    """
+    if zstandard is None:
+        raise RuntimeError("zstandard is required for .zst images")
+
+    chunks = iter(chunks)
+    buf = bytearray()
+    pending = deque()
+    pending_bytes = 0
+
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="zstd") as pool:
+        while True:
+            info = _zstd_frame_info(buf)
+            length = None
+            if info is not None:
+                skippable, size = info
+                if not skippable and (size is None or size > max_frame_output):
+                    # Decode in order, OUTPUT_CHUNK at a time
+                    while pending:
+                        yield from _pieces(pending.popleft()[0].result())
+                    pending_bytes = 0
+                    reader = zstandard.ZstdDecompressor().stream_reader(
+                        _PieceReader(_zstd_frame_pieces(buf, chunks)), read_across_frames=False
+                    )
+                    yield from iter(lambda: reader.read(OUTPUT_CHUNK), b'')
+                    continue
+                length = _zstd_frame_length(buf, 0)
+
+            if length is None:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                buf.extend(chunk)
+                continue
+
+            frame = bytes(buf[:length])
+            del buf[:length]
+            if skippable:
+                continue
+            pending.append((pool.submit(_zstd_decompress_frame, frame), size))
+            pending_bytes += size
+            # Bound the decoded output in flight (backpressure)
+            while len(pending) > 1 and (len(pending) > threads * 2 or pending_bytes > MAX_PENDING_OUTPUT):
+                future, size = pending.popleft()
+                pending_bytes -= size
+                yield from _pieces(future.result())
+
+        while pending:
+            yield from _pieces(pending.popleft()[0].result())
+        if buf.strip(b'\0'):
+            raise ValueError("Truncated zstd stream")
+
+def decompressed_chunks(chunks: Iterable[bytes], compression: Optional[str],
+                        threads: Optional[int] = None,
+                        max_frame_output: int = 16 * 1024 * 1024) -> Iterator[bytes]:
+    """Decompress a chunked stream on the fly
+
+    ``compression`` is one of ``gz``, ``xz`` or ``zst`` (None passes the
+    data through). Output comes in pieces of at most OUTPUT_CHUNK bytes.
+    zstd frames of up to ``max_frame_output`` decoded bytes are decoded on
+    ``threads`` worker threads; gzip, xz and larger zstd frames are
+    decoded in the calling thread, which the C libraries do without
+    holding the GIL.
+    """
+    if compression is None:
+        return iter(chunks)
+    if compression == 'gz':
+        return _stdlib_chunks(chunks, lambda: zlib.decompressobj(zlib.MAX_WBITS | 16))
+    if compression == 'xz':
+        return _stdlib_chunks(chunks, lzma.LZMADecompressor)
+    if compression == 'zst':
+        return _zstd_chunks(chunks, threads or os.cpu_count() or 1, max_frame_output)
+    raise ValueError(f"Unsupported compression: {compression}")
@@ -0,0 +1,454 @@
+import logging
+import os
+import select
+import socket
+import sys
+import threading
+from typing import Callable, Dict, List, Optional
+
+# Callback signature of backend hotplug events: (action, device), where
+# action is 'add', 'change' or 'remove'
+DeviceCallback = Callable[[str, Dict], None]
+
+# Netlink protocol carrying kernel uevents (linux/netlink.h)
+NETLINK_KOBJECT_UEVENT = 15
+
+class DeviceBackend:
+    """Source of removable drives and their hotplug events
+
+    Drives are dicts with ``letter`` (the identifier passed to the
+    installer: a drive letter on Windows, a device node elsewhere),
+    ``label``, ``size`` and ``free_space``.
+    """
+
+    def enumerate(self) -> List[Dict]:
+        """Get list of currently attached removable drives"""
+        raise NotImplementedError
+
+    def monitor(self, callback: DeviceCallback, stop: threading.Event,
+                started: threading.Event):
+        """Report hotplug events to ``callback`` until ``stop`` is set
+
+        ``started`` is set once events are being received, so nothing
+        that happens after a following enumeration is missed.
+        """
+        raise NotImplementedError
+
+    def identity(self, target: str) -> Dict:
+        """Model and serial number of the disk behind a target, where known"""
+        return {}
+
+class WmiBackend(DeviceBackend):
+    """Windows removable drives via WMI, with Win32_VolumeChangeEvent hotplug"""
+
+    # Win32_VolumeChangeEvent.EventType values
+    DEVICE_ARRIVAL = 2
+    DEVICE_REMOVAL = 3
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._local = threading.local()
+
+    def _wmi(self):
+        # WMI connections are COM objects bound to the creating thread
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            import pythoncom
+            import wmi
+            pythoncom.CoInitialize()
+            connection = wmi.WMI()
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _drive(disk) -> Dict:
+        return {
+            'letter': disk.DeviceID,
+            'label': disk.VolumeName or 'NO NAME',
+            'size': int(disk.Size or 0),
+            'free_space': int(disk.FreeSpace or 0)
+        }
+
+    def enumerate(self) -> List[Dict]:
+        return [
+            self._drive(disk) for disk in self._wmi().Win32_LogicalDisk(DriveType=2)
+        ]
+
+    def identity(self, target: str) -> Dict:
+        # \\.\E: names the logical disk E:, \\.\PhysicalDrive1 the disk itself
+        name = target.upper().rstrip('\\').rpartition('\\')[2]
+        if name.startswith('PHYSICALDRIVE'):
+            drives = self._wmi().Win32_DiskDrive(DeviceID=f"\\\\.\\{name}")
+        else:
+            drives = [
+                drive
+                for disk in self._wmi().Win32_LogicalDisk(DeviceID=name)
+                for partition in disk.associators("Win32_LogicalDiskToPartition")
+                for drive in partition.associators("Win32_DiskDriveToDiskPartition")
+            ]
+        for drive in drives:
+            return {'model': (drive.Model or '').strip() or None,
+                    'serial': (drive.SerialNumber or '').strip() or None}
+        return {}
+
+    def monitor(self, callback: DeviceCallback, stop: threading.Event,
+                started: threading.Event):
+        import wmi
+        watcher = self._wmi().watch_for(raw_wql="SELECT * FROM Win32_VolumeChangeEvent")
+        started.set()
+        while not stop.is_set():
+            try:
+                event = watcher(timeout_ms=500)
+            except wmi.x_wmi_timed_out:
+                continue
+            letter = event.DriveName
+            if int(event.EventType) == self.DEVICE_REMOVAL:
+                callback('remove', {'letter': letter})
+            elif int(event.EventType) == self.DEVICE_ARRIVAL:
+                for disk in self._wmi().Win32_LogicalDisk(DeviceID=letter, DriveType=2):
+                    callback('add', self._drive(disk))
+
+class LinuxBackend(DeviceBackend):
+    """Linux removable disks from sysfs, with kernel uevent hotplug
+
+    Removable disks, SD/MMC cards and attached loop devices are listed;
+    changes arrive as uevents on a netlink socket, so nothing is polled.
+    """
+
+    def __init__(self, sys_block: str = "/sys/block", dev: str = "/dev"):
+        self.logger = logging.getLogger(__name__)
+        self.sys_block = sys_block
+        self.dev = dev
+
+    def _read(self, name: str, attribute: str) -> Optional[str]:
+        try:
+            with open(os.path.join(self.sys_block, name, attribute), 'r') as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def _is_candidate(self, name: str) -> bool:
+        if name.startswith('loop'):
+            # Only loop devices with a backing file attached
+            return bool(self._read(name, 'loop/backing_file'))
+        if name.startswith('mmcblk'):
+            # eMMC hardware partitions are not cards
+            return 'boot' not in name and 'rpmb' not in name
+        return self._read(name, 'removable') == '1'
+
+    def _partitions(self, name: str) -> List[str]:
+        try:
+            entries = os.listdir(os.path.join(self.sys_block, name))
+        except OSError:
+            return []
+        return [entry for entry in entries if entry.startswith(name)]
+
+    def _label(self, name: str) -> str:
+        by_label = os.path.join(self.dev, "disk", "by-label")
+        try:
+            labels = os.listdir(by_label)
+        except OSError:
+            return 'NO NAME'
+        nodes = {name, *self._partitions(name)}
+        for label in sorted(labels):
+            target = os.path.basename(os.path.realpath(os.path.join(by_label, label)))
+            if target in nodes:
+                return label.encode().decode('unicode_escape')
+        return 'NO NAME'
+
+    def _free_space(self, name: str) -> int:
+        nodes = {os.path.join(self.dev, node) for node in (name, *self._partitions(name))}
+        free = 0
+        try:
+            with open("/proc/mounts", 'r') as f:
+                mounts = [line.split()[:2] for line in f]
+        except OSError:
+            return 0
+        for device, mountpoint in mounts:
+            if device in nodes:
+                try:
+                    stat = os.statvfs(mountpoint.replace('\\040', ' '))
+                    free += stat.f_bavail * stat.f_frsize
+                except OSError:
+                    continue
+        return free
+
+    def device(self, name: str) -> Optional[Dict]:
+        """Describe one disk, or None if it is not a usable removable drive"""
+        if not self._is_candidate(name):
+            return None
+        sectors = self._read(name, 'size')
+        size = int(sectors) * 512 if sectors and sectors.isdigit() else 0
+        if not size:
+            # Card reader without a card
+            return None
+        return {
+            'letter': os.path.join(self.dev, name),
+            'label': self._label(name),
+            'size': size,
+            'free_space': self._free_space(name)
+        }
+
+    def enumerate(self) -> List[Dict]:
+        drives = []
+        for name in sorted(os.listdir(self.sys_block)):
+            drive = self.device(name)
+            if drive:
+                drives.append(drive)
+        return drives
+
+    def monitor(self, callback: DeviceCallback, stop: threading.Event,
+                started: threading.Event):
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        try:
+            # Multicast group 1 carries the kernel's own uevents
+            sock.bind((0, 1))
+            started.set()
+            while not stop.is_set():
+                readable, _, _ = select.select([sock], [], [], 0.5)
+                if not readable:
+                    continue
+                self._handle_uevent(sock.recv(65536), callback)
+        finally:
+            sock.close()
+
+    def _handle_uevent(self, message: bytes, callback: DeviceCallback):
+        fields = message.split(b'\0')
+        if b'@' not in fields[0]:
+            return
+        properties = dict(
+            field.decode(errors='replace').split('=', 1) for field in fields[1:] if b'=' in field
+        )
+        if properties.get('SUBSYSTEM') != 'block' or properties.get('DEVTYPE') != 'disk':
+            return
+        name = properties.get('DEVNAME', '').rpartition('/')[2]
+        if not name:
+            return
+        action = properties.get('ACTION')
+        drive = self.device(name) if action != 'remove' else None
+        if drive:
+            callback('add' if action == 'add' else 'change', drive)
+        else:
+            # Removed, or no longer usable (card pulled, loop detached)
+            callback('remove', {'letter': os.path.join(self.dev, name)})
+
+class FakeBackend(DeviceBackend):
+    """In-memory drives for tests and development without hardware"""
+
+    def __init__(self, drives: Optional[List[Dict]] = None):
+        self._drives: Dict[str, Dict] = {drive['letter']: drive for drive in drives or []}
+        self._callbacks: List[DeviceCallback] = []
+        self._lock = threading.Lock()
+
+    def enumerate(self) -> List[Dict]:
+        with self._lock:
+            return [dict(drive) for drive in self._drives.values()]
+
+    def monitor(self, callback: DeviceCallback, stop: threading.Event,
+                started: threading.Event):
+        with self._lock:
+            self._callbacks.append(callback)
+        started.set()
+        stop.wait()
+        with self._lock:
+            self._callbacks.remove(callback)
+
+    def _emit(self, action: str, drive: Dict):
+        with self._lock:
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback(action, dict(drive))
+
+    def insert(self, letter: str, size: int, label: str = 'NO NAME', free_space: int = 0):
+        """Simulate inserting a card"""
+        drive = {'letter': letter, 'label': label, 'size': size, 'free_space': free_space}
+        with self._lock:
+            self._drives[letter] = drive
+        self._emit('add', drive)
+
+    def eject(self, letter: str):
+        """Simulate removing a card"""
+        with self._lock:
+            drive = self._drives.pop(letter, None)
+        if drive:
+            self._emit('remove', drive)
+
+_shared_wmi: Optional[WmiBackend] = None
+_shared_wmi_lock = threading.Lock()
+
+def _wmi_backend() -> WmiBackend:
+    """A WmiBackend shared by the identity lookups (it connects once per thread)"""
+    global _shared_wmi
+    with _shared_wmi_lock:
+        if _shared_wmi is None:
+            _shared_wmi = WmiBackend()
+        return _shared_wmi
+
+def device_identity(target: str, sys_block: str = "/sys/block") -> Dict:
+    """What identifies the card behind a target: its size and, where known, model and serial"""
+    identity = {'target': target, 'size': None, 'model': None, 'serial': None}
+    if os.path.isfile(target):
+        # An image file grows as it is written
+        return identity
+    try:
+        fd = os.open(target, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            identity['size'] = os.lseek(fd, 0, os.SEEK_END)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+    if sys.platform == 'win32':
+        # Windows knows them from the disk drive behind the volume
+        try:
+            identity.update(_wmi_backend().identity(target))
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"Cannot identify {target} through WMI: {e}")
+        return identity
+
+    # Linux describes USB card readers and MMC cards in sysfs
+    def read(attribute: str) -> Optional[str]:
+        try:
+            with open(os.path.join(sys_block, name, attribute), 'r') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    name = os.path.basename(os.path.realpath(target))
+    model = " ".join(part for part in (read('device/vendor'), read('device/model') or read('device/name')) if part)
+    identity['model'] = model or None
+    identity['serial'] = read('device/serial') or read('device/wwid') or read('serial')
+    return identity
+
+def default_backend() -> DeviceBackend:
+    """The device backend for this platform"""
+    if sys.platform == 'win32':
+        return WmiBackend()
+    if sys.platform.startswith('linux'):
+        return LinuxBackend()
+    raise NotImplementedError(f"No device backend for {sys.platform}")
+
+class DeviceTable:
+    """Cached table of removable drives kept current by hotplug events
+
+    ``start()`` enumerates once and then follows the backend's hotplug
+    events on a background thread; ``devices()`` only reads the cache.
+    Listeners are called as ``listener(action, drive)`` on the monitor
+    thread, with ``'refresh'`` (and no drive) after a full enumeration.
+    """
+
+    def __init__(self, backend: DeviceBackend):
+        self.logger = logging.getLogger(__name__)
+        self.backend = backend
+        self._devices: Dict[str, Dict] = {}
+        self._listeners: List[Callable[[str, Optional[Dict]], None]] = []
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._rescan = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_listener(self, listener: Callable[[str, Optional[Dict]], None]):
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[str, Optional[Dict]], None]):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def _notify(self, action: str, drive: Optional[Dict]):
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(action, drive)
+            except Exception as e:
+                self.logger.warning(f"Device listener failed: {e}")
+
+    def _refresh(self):
+        drives = self.backend.enumerate()
+        with self._lock:
+            self._devices = {drive['letter']: drive for drive in drives}
+        self._ready.set()
+        self._notify('refresh', None)
+
+    def _on_event(self, action: str, drive: Dict):
+        with self._lock:
+            if action == 'remove':
+                if self._devices.pop(drive['letter'], None) is None:
+                    return
+            else:
+                self._devices[drive['letter']] = drive
+        self.logger.info(f"Drive {drive['letter']}: {action}")
+        self._notify(action, drive)
+
+    def _monitor(self, started: threading.Event):
+        try:
+            self.backend.monitor(self._on_event, self._stop, started)
+        except Exception as e:
+            self.logger.warning(f"Hotplug monitoring unavailable: {e}")
+        finally:
+            started.set()
+
+    def _run(self):
+        # Subscribe to hotplug events first so none are lost between the
+        # enumeration and the start of monitoring
+        started = threading.Event()
+        threading.Thread(target=self._monitor, args=(started,),
+                         name="device-hotplug", daemon=True).start()
+        started.wait()
+        try:
+            self._refresh()
+        except Exception as e:
+            self.logger.error(f"Error getting drives: {e}")
+            self._ready.set()
+        while not self._stop.is_set():
+            if self._rescan.wait(0.5):
+                self._rescan.clear()
+                try:
+                    self._refresh()
+                except Exception as e:
+                    self.logger.error(f"Error getting drives: {e}")
+
+    def start(self):
+        """Start enumeration and hotplug monitoring in the background"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="device-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def rescan(self):
+        """Ask for a full re-enumeration without blocking the caller"""
+        self.start()
+        self._rescan.set()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the first enumeration to complete"""
+        return self._ready.wait(timeout)
+
+    def devices(self) -> List[Dict]:
+        """Get the cached list of removable drives"""
+        with self._lock:
+            return [dict(drive) for drive in self._devices.values()]
+
+if __name__ == "__main__":
+    # Print the drive table and follow hotplug events until interrupted
+    import time
+
+    logging.basicConfig(level=logging.INFO)
+    table = DeviceTable(default_backend())
+    table.add_listener(lambda action, drive: print(action, drive or table.devices()))
+    table.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        table.stop()
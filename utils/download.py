@@ -0,0 +1,265 @@
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+def create_session(pool_size: int = 8) -> requests.Session:
+    """Create an HTTP session with a connection pool sized for ranged downloads"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+class RangedDownloader:
+    """Parallel, resumable HTTP downloader
+
+    The file is split into ``segments`` byte ranges that are fetched
+    concurrently over a pooled session and written at their offsets into a
+    preallocated file. Progress is kept in a small ``<file>.state`` sidecar
+    so an interrupted download resumes where it stopped. Servers without
+    range support are downloaded as a single stream.
+    """
+
+    def __init__(self, url: str, destination: Path, segments: int = 4,
+                 session: Optional[requests.Session] = None,
+                 chunk_size: int = 1024 * 1024, retries: int = 3, timeout: int = 30,
+                 progress: Optional[Callable[[int], None]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.url = url
+        self.destination = Path(destination)
+        self.state_path = self.destination.with_name(self.destination.name + ".state")
+        self.segments = max(1, segments)
+        self.session = session or create_session(self.segments)
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.timeout = timeout
+        self.progress = progress
+        self.size: Optional[int] = None
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self._lock = threading.Lock()
+        self._state: Dict = {}
+        self._last_save = 0.0
+
+    def _probe(self) -> bool:
+        """Find the size and validators; returns True if ranges are supported"""
+        response = self.session.get(self.url, headers={"Range": "bytes=0-0"},
+                                    stream=True, timeout=self.timeout)
+        try:
+            response.raise_for_status()
+            self.etag = response.headers.get("ETag")
+            self.last_modified = response.headers.get("Last-Modified")
+            if response.status_code == 206:
+                content_range = response.headers.get("Content-Range", "")
+                total = content_range.rpartition("/")[2]
+                if total.isdigit():
+                    self.size = int(total)
+                    return True
+            length = response.headers.get("Content-Length")
+            self.size = int(length) if length and length.isdigit() else None
+            return False
+        finally:
+            response.close()
+
+    def _load_state(self) -> bool:
+        """Load a matching sidecar state left by an interrupted download"""
+        try:
+            if not self.state_path.exists() or not self.destination.exists():
+                return False
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+            if (state.get('url') != self.url or state.get('size') != self.size
+                    or state.get('etag') != self.etag
+                    or state.get('last_modified') != self.last_modified):
+                self.logger.info("Remote image changed, discarding partial download")
+                return False
+            self._state = state
+            return True
+        except Exception as e:
+            self.logger.warning(f"Ignoring unreadable download state: {e}")
+            return False
+
+    def _save_state(self, force: bool = False):
+        """Persist segment progress, at most once per second unless forced"""
+        now = time.monotonic()
+        if not force and now - self._last_save < 1.0:
+            return
+        self._last_save = now
+        tmp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(self._state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _new_state(self) -> Dict:
+        """Split the file into segments and preallocate the destination"""
+        segment_size = -(-self.size // self.segments)
+        segments: List[List[int]] = []
+        for start in range(0, self.size, segment_size):
+            end = min(start + segment_size, self.size) - 1
+            segments.append([start, end, 0])
+
+        with open(self.destination, 'wb') as f:
+            if hasattr(os, 'posix_fallocate') and self.size:
+                os.posix_fallocate(f.fileno(), 0, self.size)
+            else:
+                f.truncate(self.size)
+
+        return {
+            'url': self.url,
+            'size': self.size,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'segments': segments
+        }
+
+    def _fetch_segment(self, index: int):
+        """Download one segment, resuming after dropped connections"""
+        segment = self._state['segments'][index]
+        attempt = 0
+        with open(self.destination, 'r+b') as f:
+            while True:
+                start, end, done = segment
+                if start + done > end:
+                    return
+                try:
+                    response = self.session.get(
+                        self.url,
+                        headers={"Range": f"bytes={start + done}-{end}"},
+                        stream=True,
+                        timeout=self.timeout
+                    )
+                    with response:
+                        response.raise_for_status()
+                        if response.status_code != 206:
+                            raise Exception(f"Server ignored range request ({response.status_code})")
+                        f.seek(start + done)
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            f.write(chunk)
+                            with self._lock:
+                                segment[2] += len(chunk)
+                                self._save_state()
+                            if self.progress:
+                                self.progress(self.bytes_done)
+                    f.flush()
+                    if start + segment[2] <= end:
+                        raise Exception("Connection closed before end of segment")
+                    return
+                except Exception as e:
+                    attempt += 1
+                    if attempt > self.retries:
+                        raise
+                    self.logger.warning(f"Segment {index} interrupted ({e}), retrying")
+                    time.sleep(min(2 ** attempt, 10))
+
+    def _download_single(self):
+        """Plain single-stream download for servers without range support"""
+        response = self.session.get(self.url, stream=True, timeout=self.timeout)
+        with response:
+            response.raise_for_status()
+            done = 0
+            with open(self.destination, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    done += len(chunk)
+                    if self.progress:
+                        self.progress(done)
+
+    def refetch(self, ranges: List[Tuple[int, int]]) -> bool:
+        """Download (offset, length) ranges again into the existing file"""
+        try:
+            with open(self.destination, 'r+b') as f:
+                for offset, length in ranges:
+                    response = self.session.get(
+                        self.url,
+                        headers={"Range": f"bytes={offset}-{offset + length - 1}"},
+                        timeout=self.timeout
+                    )
+                    response.raise_for_status()
+                    if response.status_code != 206 or len(response.content) != length:
+                        raise Exception(f"Server did not return range {offset}+{length}")
+                    f.seek(offset)
+                    f.write(response.content)
+            return True
+        except Exception as e:
+            self.logger.error(f"Error fetching ranges of {self.url}: {e}")
+            return False
+
+    @property
+    def bytes_done(self) -> int:
+        """Number of bytes downloaded so far (including resumed progress)"""
+        segments = self._state.get('segments', [])
+        return sum(segment[2] for segment in segments)
+
+    def download(self) -> bool:
+        """Download the file; returns True when it is complete on disk"""
+        try:
+            if not self._probe() or not self.size:
+                self.logger.info("Server does not support ranges, using a single stream")
+                self._download_single()
+                return True
+
+            if self._load_state():
+                self.logger.info(f"Resuming download at {self.bytes_done} of {self.size} bytes")
+            else:
+                self._state = self._new_state()
+                self._save_state(force=True)
+
+            errors = []
+
+            def worker(index: int):
+                try:
+                    self._fetch_segment(index)
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [
+                threading.Thread(target=worker, args=(i,), name=f"download-{i}", daemon=True)
+                for i in range(len(self._state['segments']))
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            with self._lock:
+                self._save_state(force=True)
+            if errors:
+                raise errors[0]
+
+            self.state_path.unlink()
+            return True
+
+        except Exception as e:
+            self.logger.error(f"Error downloading {self.url}: {e}")
+            return False
+
+if __name__ == "__main__":
+    # Throughput comparison of 1 vs N segments against a local range server
+    # whose connections are each capped, like a typical CDN edge
+    import shutil
+    import sys
+    import tempfile
+    from utils.range_server import serve_directory
+
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    workdir = Path(tempfile.mkdtemp())
+    try:
+        (workdir / "system.img").write_bytes(os.urandom(size_mb * 1024 * 1024))
+        server = serve_directory(str(workdir), rate_limit=8 * 1024 * 1024)
+        url = f"http://127.0.0.1:{server.server_port}/system.img"
+        for segments in (1, 4, 8):
+            target = workdir / f"download_{segments}.img"
+            started = time.monotonic()
+            ok = RangedDownloader(url, target, segments=segments).download()
+            elapsed = time.monotonic() - started
+            print(f"{segments} segment(s): {ok} {size_mb / elapsed:.1f} MB/s ({elapsed:.2f}s)")
+        server.shutdown()
+    finally:
+        shutil.rmtree(workdir)
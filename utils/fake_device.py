@@ -0,0 +1,205 @@
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from utils.raw_writer import RawWriter
+
+# Rough performance envelopes of common card classes
+PROFILES: Dict[str, Dict] = {
+    'unthrottled': {
+        'write_bandwidth': None,
+        'read_bandwidth': None,
+        'latency': 0.0,
+        'erase_block': 4 * 1024 * 1024,
+        'partial_block_penalty': 0.0
+    },
+    'class4': {
+        'write_bandwidth': 4 * 1024 * 1024,
+        'read_bandwidth': 15 * 1024 * 1024,
+        'latency': 0.002,
+        'erase_block': 4 * 1024 * 1024,
+        'partial_block_penalty': 0.05
+    },
+    'class10': {
+        'write_bandwidth': 10 * 1024 * 1024,
+        'read_bandwidth': 40 * 1024 * 1024,
+        'latency': 0.001,
+        'erase_block': 4 * 1024 * 1024,
+        'partial_block_penalty': 0.02
+    },
+    'uhs1': {
+        'write_bandwidth': 30 * 1024 * 1024,
+        'read_bandwidth': 90 * 1024 * 1024,
+        'latency': 0.0005,
+        'erase_block': 4 * 1024 * 1024,
+        'partial_block_penalty': 0.01
+    },
+    # A2 cards queue commands: many small writes in flight hide the latency
+    'a2': {
+        'write_bandwidth': 40 * 1024 * 1024,
+        'read_bandwidth': 90 * 1024 * 1024,
+        'latency': 0.02,
+        'erase_block': 4 * 1024 * 1024,
+        'partial_block_penalty': 0.005,
+        'command_queue': True
+    }
+}
+
+class FakeDevice:
+    """File-backed stand-in for an SD card with throttled I/O
+
+    Every operation costs ``latency`` plus its length divided by the read
+    or write bandwidth. Writes that cover an erase block only partially
+    additionally cost ``partial_block_penalty`` per such block, like the
+    read-modify-write cycle of a real card's controller. Costs accumulate
+    on a device clock, so concurrent callers share the bandwidth. With
+    ``command_queue`` the latency is not on the clock: it overlaps with
+    the transfers of other outstanding operations.
+
+    A ``capacity`` below ``size`` makes a counterfeit card: only that much
+    flash exists and addresses past it wrap around onto it.
+    """
+
+    def __init__(self, path: Path, size: int, write_bandwidth: Optional[int] = None,
+                 read_bandwidth: Optional[int] = None, latency: float = 0.0,
+                 erase_block: int = 4 * 1024 * 1024, partial_block_penalty: float = 0.0,
+                 command_queue: bool = False, capacity: Optional[int] = None):
+        self.logger = logging.getLogger(__name__)
+        self.path = Path(path)
+        self.size = size
+        self.write_bandwidth = write_bandwidth
+        self.read_bandwidth = read_bandwidth
+        self.latency = latency
+        self.erase_block = erase_block
+        self.partial_block_penalty = partial_block_penalty
+        self.command_queue = command_queue
+        self.capacity = capacity
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.time_throttled = 0.0
+        self._clock = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_profile(cls, path: Path, size: int, profile: str) -> 'FakeDevice':
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown device profile: {profile}")
+        return cls(path, size, **PROFILES[profile])
+
+    def create(self) -> 'FakeDevice':
+        """Create the backing file as a sparse, zero-filled device"""
+        with open(self.path, 'wb') as f:
+            f.truncate(self.size)
+        return self
+
+    def cost(self, operation: str, offset: int, length: int) -> float:
+        """Simulated duration of an I/O operation in seconds"""
+        bandwidth = self.write_bandwidth if operation == 'write' else self.read_bandwidth
+        cost = self.latency
+        if bandwidth:
+            cost += length / bandwidth
+        if operation == 'write' and self.partial_block_penalty and length:
+            end = offset + length
+            first = offset // self.erase_block
+            last = (end - 1) // self.erase_block
+            partial = 0
+            if offset % self.erase_block:
+                partial += 1
+            if end % self.erase_block and (last != first or not partial):
+                partial += 1
+            cost += partial * self.partial_block_penalty
+        return cost
+
+    def throttle(self, operation: str, offset: int, length: int):
+        """Block the caller for as long as the operation would take"""
+        if offset + length > self.size:
+            raise OSError(f"I/O past the end of the device ({offset + length} > {self.size})")
+        cost = self.cost(operation, offset, length)
+        latency = self.latency if self.command_queue else 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._clock = max(self._clock, now) + cost - latency
+            deadline = self._clock + latency
+            if operation == 'write':
+                self.bytes_written += length
+            else:
+                self.bytes_read += length
+            self.time_throttled += cost
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def extents(self, offset: int, length: int) -> List[Tuple[int, int]]:
+        """Where a range of addresses lies in the backing file, as (offset, length)"""
+        if not self.capacity:
+            return [(offset, length)]
+        result = []
+        while length:
+            physical = offset % self.capacity
+            piece = min(length, self.capacity - physical)
+            result.append((physical, piece))
+            offset += piece
+            length -= piece
+        return result
+
+    def read(self, offset: int, length: int) -> bytes:
+        """Read a range of the device"""
+        self.throttle('read', offset, length)
+        with open(self.path, 'rb') as f:
+            chunks = []
+            for physical, piece in self.extents(offset, length):
+                f.seek(physical)
+                chunks.append(f.read(piece))
+            return b"".join(chunks)
+
+    def writer(self, **kwargs) -> 'ThrottledWriter':
+        """A RawWriter for this device"""
+        return ThrottledWriter(self, **kwargs)
+
+    def stats(self) -> Dict:
+        return {
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'time_throttled': self.time_throttled
+        }
+
+class ThrottledWriter(RawWriter):
+    """RawWriter whose writes are paced by a FakeDevice"""
+
+    def __init__(self, device: FakeDevice, **kwargs):
+        # An in-kernel copy would bypass the throttling
+        kwargs.setdefault('kernel_copy', False)
+        super().__init__(str(device.path), **kwargs)
+        self.device = device
+
+    def _pwrite(self, offset: int, data) -> None:
+        self.device.throttle('write', offset, len(data))
+        view = memoryview(data)
+        for physical, piece in self.device.extents(offset, len(data)):
+            super()._pwrite(physical, view[:piece])
+            view = view[piece:]
+
+if __name__ == "__main__":
+    # Show the effective write speed of each profile for a few block sizes
+    import shutil
+    import tempfile
+
+    workdir = Path(tempfile.mkdtemp())
+    try:
+        data = os.urandom(1024 * 1024)
+        for name in PROFILES:
+            device = FakeDevice.from_profile(workdir / f"{name}.img", 64 * 1024 * 1024, name).create()
+            for block_size in (64 * 1024, 1024 * 1024, 4 * 1024 * 1024):
+                chunk = (data * (block_size // len(data) + 1))[:block_size]
+                started = time.monotonic()
+                with device.writer(block_size=block_size, zero_mode='write') as writer:
+                    for offset in range(0, 8 * 1024 * 1024, block_size):
+                        writer.write_at(offset, chunk)
+                    writer.finish()
+                elapsed = time.monotonic() - started
+                print(f"{name:<12} {block_size // 1024:>5} KiB blocks: {8 / elapsed:6.1f} MB/s")
+    finally:
+        shutil.rmtree(workdir)
@@ -0,0 +1,459 @@
+import logging
+import struct
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utils.overlay import PatchSet
+
+ATTR_READ_ONLY = 0x01
+ATTR_HIDDEN = 0x02
+ATTR_SYSTEM = 0x04
+ATTR_VOLUME_ID = 0x08
+ATTR_DIRECTORY = 0x10
+ATTR_ARCHIVE = 0x20
+ATTR_LONG_NAME = 0x0f
+
+ENTRY_SIZE = 32
+DELETED = 0xe5
+# Characters of a long file name stored in one LFN entry, and their offsets
+LFN_CHARS = 13
+LFN_OFFSETS = (1, 3, 5, 7, 9, 14, 16, 18, 20, 22, 24, 28, 30)
+SHORT_NAME_INVALID = set('"*+,./:;<=>?[\\]| ')
+
+FSINFO_LEAD_SIGNATURE = 0x41615252
+FSINFO_UNKNOWN = 0xffffffff
+
+def _fat_datetime(moment: datetime) -> Tuple[int, int]:
+    date = ((moment.year - 1980) << 9) | (moment.month << 5) | moment.day
+    time = (moment.hour << 11) | (moment.minute << 5) | (moment.second // 2)
+    return date, time
+
+def lfn_checksum(short_name: bytes) -> int:
+    checksum = 0
+    for byte in short_name:
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + byte) & 0xff
+    return checksum
+
+class DirEntry:
+    """A file or directory found in a FAT directory"""
+
+    def __init__(self, name: str, short_name: bytes, offset: int, lfn_offsets: List[int], raw: bytes):
+        self.name = name
+        self.short_name = short_name
+        self.offset = offset
+        self.lfn_offsets = lfn_offsets
+        self.attributes = raw[11]
+        high, = struct.unpack_from("<H", raw, 20)
+        low, self.size = struct.unpack_from("<HI", raw, 26)
+        self.cluster = (high << 16) | low
+
+    @property
+    def is_directory(self) -> bool:
+        return bool(self.attributes & ATTR_DIRECTORY)
+
+class FatVolume:
+    """Read and modify a FAT16/FAT32 filesystem inside an image
+
+    Nothing is written to the image: modified sectors are collected in
+    memory and returned by ``patches()`` as byte ranges relative to the
+    start of the image, to be laid over the image data while it is
+    written to the card.
+    """
+
+    def __init__(self, read: Callable[[int, int], bytes], offset: int = 0):
+        self.logger = logging.getLogger(__name__)
+        self._read_image = read
+        self.offset = offset
+        self._sectors: Dict[int, bytearray] = {}
+
+        boot = read(offset, 512)
+        (self.sector_size, self.sectors_per_cluster, self.reserved_sectors, self.num_fats,
+         self.root_entries, total16, _, fat16_size) = struct.unpack_from("<HBHBHHBH", boot, 11)
+        total32, = struct.unpack_from("<I", boot, 32)
+        fat32_size, = struct.unpack_from("<I", boot, 36)
+        self.total_sectors = total16 or total32
+        self.fat_size = fat16_size or fat32_size
+        root_dir_sectors = -(-self.root_entries * ENTRY_SIZE // self.sector_size)
+        self.root_dir_sector = self.reserved_sectors + self.num_fats * self.fat_size
+        self.data_sector = self.root_dir_sector + root_dir_sectors
+        self.cluster_size = self.sector_size * self.sectors_per_cluster
+        self.cluster_count = (self.total_sectors - self.data_sector) // self.sectors_per_cluster
+
+        if fat16_size and self.cluster_count < 4085:
+            raise ValueError("FAT12 filesystems are not supported")
+        if fat16_size:
+            self.fat_type = 16
+            self.root_cluster = 0
+            self.fsinfo_sector = None
+            self.end_of_chain = 0xffff
+        else:
+            self.fat_type = 32
+            self.root_cluster, fsinfo = struct.unpack_from("<IH", boot, 44)
+            self.fsinfo_sector = fsinfo if fsinfo not in (0, 0xffff) else None
+            self.end_of_chain = 0x0fffffff
+        self._next_free = 2
+
+    # Sector overlay
+
+    def _sector(self, sector: int) -> bytes:
+        data = self._sectors.get(sector)
+        if data is not None:
+            return data
+        data = self._read_image(self.offset + sector * self.sector_size, self.sector_size)
+        if len(data) < self.sector_size:
+            raise ValueError(f"Image ends inside the filesystem (sector {sector})")
+        return data
+
+    def read(self, offset: int, length: int) -> bytes:
+        """Read bytes of the volume, including pending modifications"""
+        out = bytearray()
+        while length > 0:
+            sector, skip = divmod(offset, self.sector_size)
+            count = min(length, self.sector_size - skip)
+            out += self._sector(sector)[skip:skip + count]
+            offset += count
+            length -= count
+        return bytes(out)
+
+    def write(self, offset: int, data: bytes):
+        """Modify bytes of the volume in the overlay"""
+        view = memoryview(data)
+        while view:
+            sector, skip = divmod(offset, self.sector_size)
+            count = min(len(view), self.sector_size - skip)
+            block = self._sectors.get(sector)
+            if block is None:
+                block = self._sectors[sector] = bytearray(self._sector(sector))
+            block[skip:skip + count] = view[:count]
+            offset += count
+            view = view[count:]
+
+    def patches(self) -> PatchSet:
+        """Modified sectors as patches relative to the start of the image"""
+        return PatchSet(
+            (self.offset + sector * self.sector_size, bytes(data))
+            for sector, data in sorted(self._sectors.items())
+        )
+
+    # File allocation table
+
+    def _fat_offset(self, cluster: int, copy: int = 0) -> int:
+        return ((self.reserved_sectors + copy * self.fat_size) * self.sector_size
+                + cluster * (self.fat_type // 8))
+
+    def fat_entry(self, cluster: int) -> int:
+        if self.fat_type == 16:
+            value, = struct.unpack("<H", self.read(self._fat_offset(cluster), 2))
+            return value
+        value, = struct.unpack("<I", self.read(self._fat_offset(cluster), 4))
+        return value & 0x0fffffff
+
+    def _set_fat_entry(self, cluster: int, value: int):
+        for copy in range(self.num_fats):
+            offset = self._fat_offset(cluster, copy)
+            if self.fat_type == 16:
+                self.write(offset, struct.pack("<H", value))
+            else:
+                # The top four bits are reserved and must be preserved
+                old, = struct.unpack("<I", self.read(offset, 4))
+                self.write(offset, struct.pack("<I", (old & 0xf0000000) | value))
+
+    def _is_end(self, value: int) -> bool:
+        return value >= (0xfff8 if self.fat_type == 16 else 0x0ffffff8)
+
+    def chain(self, cluster: int) -> List[int]:
+        """Clusters of a chain starting at ``cluster``"""
+        clusters = []
+        while 2 <= cluster < self.cluster_count + 2 and not self._is_end(cluster):
+            if len(clusters) > self.cluster_count:
+                raise ValueError("Cluster chain loops")
+            clusters.append(cluster)
+            cluster = self.fat_entry(cluster)
+        return clusters
+
+    def _allocate(self, count: int, after: Optional[int] = None) -> List[int]:
+        """Allocate ``count`` clusters as one chain, linked after cluster ``after``"""
+        clusters = []
+        cluster = self._next_free
+        scanned = 0
+        while len(clusters) < count:
+            if scanned >= self.cluster_count:
+                raise OSError("No free space left in the FAT filesystem")
+            if cluster >= self.cluster_count + 2:
+                cluster = 2
+            if self.fat_entry(cluster) == 0:
+                clusters.append(cluster)
+            cluster += 1
+            scanned += 1
+        self._next_free = cluster
+
+        for current, following in zip(clusters, clusters[1:]):
+            self._set_fat_entry(current, following)
+        self._set_fat_entry(clusters[-1], self.end_of_chain)
+        if after is not None:
+            self._set_fat_entry(after, clusters[0])
+        self._update_fsinfo(-count)
+        return clusters
+
+    def _free_chain(self, cluster: int):
+        clusters = self.chain(cluster)
+        for current in clusters:
+            self._set_fat_entry(current, 0)
+        self._update_fsinfo(len(clusters))
+
+    def _update_fsinfo(self, change: int):
+        if self.fsinfo_sector is None:
+            return
+        base = self.fsinfo_sector * self.sector_size
+        signature, = struct.unpack("<I", self.read(base, 4))
+        if signature != FSINFO_LEAD_SIGNATURE:
+            return
+        free, = struct.unpack("<I", self.read(base + 488, 4))
+        if free != FSINFO_UNKNOWN:
+            free = max(0, min(free + change, self.cluster_count))
+        self.write(base + 488, struct.pack("<II", free, self._next_free))
+
+    def _cluster_offset(self, cluster: int) -> int:
+        return (self.data_sector + (cluster - 2) * self.sectors_per_cluster) * self.sector_size
+
+    # Directories
+
+    def _slots(self, directory: int) -> List[int]:
+        """Byte offsets of every entry slot of a directory"""
+        if directory == 0:
+            start = self.root_dir_sector * self.sector_size
+            return list(range(start, start + self.root_entries * ENTRY_SIZE, ENTRY_SIZE))
+        slots = []
+        for cluster in self.chain(directory):
+            start = self._cluster_offset(cluster)
+            slots.extend(range(start, start + self.cluster_size, ENTRY_SIZE))
+        return slots
+
+    @staticmethod
+    def _display_name(raw: bytes) -> str:
+        base = raw[:8].decode('ascii', errors='replace').rstrip()
+        ext = raw[8:11].decode('ascii', errors='replace').rstrip()
+        # NT case flags for all-lowercase names without an LFN entry
+        if raw[12] & 0x08:
+            base = base.lower()
+        if raw[12] & 0x10:
+            ext = ext.lower()
+        return f"{base}.{ext}" if ext else base
+
+    def list_directory(self, directory: int) -> List[DirEntry]:
+        entries = []
+        lfn_parts: Dict[int, str] = {}
+        lfn_offsets: List[int] = []
+        for slot in self._slots(directory):
+            raw = self.read(slot, ENTRY_SIZE)
+            if raw[0] == 0:
+                break
+            if raw[0] == DELETED:
+                lfn_parts, lfn_offsets = {}, []
+                continue
+            if raw[11] == ATTR_LONG_NAME:
+                if raw[0] & 0x40:
+                    lfn_parts, lfn_offsets = {}, []
+                chars = b"".join(raw[i:i + 2] for i in LFN_OFFSETS).decode('utf-16-le', errors='replace')
+                lfn_parts[raw[0] & 0x1f] = chars
+                lfn_offsets.append(slot)
+                continue
+            if raw[11] & ATTR_VOLUME_ID:
+                lfn_parts, lfn_offsets = {}, []
+                continue
+            name = self._display_name(raw)
+            if lfn_parts:
+                long_name = "".join(lfn_parts[index] for index in sorted(lfn_parts))
+                name = long_name.split('\0')[0]
+            if name not in ('.', '..'):
+                entries.append(DirEntry(name, raw[:11], slot, lfn_offsets, raw))
+            lfn_parts, lfn_offsets = {}, []
+        return entries
+
+    def _find(self, directory: int, name: str) -> Optional[DirEntry]:
+        wanted = name.lower()
+        for entry in self.list_directory(directory):
+            if entry.name.lower() == wanted or self._display_name(entry.short_name + bytes(21)).lower() == wanted:
+                return entry
+        return None
+
+    def _short_name(self, name: str, directory: int) -> bytes:
+        """A unique 8.3 alias (e.g. NETWOR~1YAM) for a long name"""
+        upper = name.upper()
+        stem, dot, suffix = upper.rpartition('.')
+        if not dot:
+            stem, suffix = upper, ''
+        clean = lambda text: "".join('_' if c in SHORT_NAME_INVALID or ord(c) > 127 else c for c in text)
+        base = clean(stem.lstrip('. ').replace('.', '').replace(' ', ''))
+        ext = clean(suffix.replace(' ', ''))
+        existing = {entry.short_name for entry in self.list_directory(directory)}
+        if base == stem and ext == suffix and 0 < len(base) <= 8 and len(ext) <= 3:
+            candidate = base.ljust(8).encode() + ext.ljust(3).encode()
+            if candidate not in existing:
+                return candidate
+        ext = ext[:3]
+        for number in range(1, 1000000):
+            tail = f"~{number}"
+            candidate = (base[:8 - len(tail)] + tail).ljust(8).encode() + ext.ljust(3).encode()
+            if candidate not in existing:
+                return candidate
+        raise OSError(f"No free short name for {name}")
+
+    def _add_entry(self, directory: int, name: str, attributes: int, cluster: int,
+                   size: int, moment: datetime) -> int:
+        """Add a directory entry (with LFN entries); returns its offset"""
+        short_name = self._short_name(name, directory)
+        checksum = lfn_checksum(short_name)
+        encoded = name.encode('utf-16-le')
+        count = -(-len(name) // LFN_CHARS)
+        padded = encoded + (b"\0\0" + b"\xff\xff" * LFN_CHARS if len(name) % LFN_CHARS else b"")
+
+        raw_entries = []
+        for sequence in range(count, 0, -1):
+            raw = bytearray(ENTRY_SIZE)
+            raw[0] = sequence | (0x40 if sequence == count else 0)
+            raw[11] = ATTR_LONG_NAME
+            raw[13] = checksum
+            part = padded[(sequence - 1) * LFN_CHARS * 2:sequence * LFN_CHARS * 2]
+            for index, position in enumerate(LFN_OFFSETS):
+                raw[position:position + 2] = part[index * 2:index * 2 + 2]
+            raw_entries.append(bytes(raw))
+
+        date, time = _fat_datetime(moment)
+        raw = bytearray(ENTRY_SIZE)
+        raw[:11] = short_name
+        raw[11] = attributes
+        struct.pack_into("<HHHHHHHI", raw, 14, time, date, date, cluster >> 16, time, date,
+                         cluster & 0xffff, size)
+        raw_entries.append(bytes(raw))
+
+        # Find a run of free slots, growing the directory if needed
+        while True:
+            slots = self._slots(directory)
+            run = []
+            at_end = False
+            for slot in slots:
+                first = self.read(slot, 1)[0]
+                if first == 0:
+                    at_end = True
+                if at_end or first == DELETED:
+                    run.append(slot)
+                    if len(run) == len(raw_entries):
+                        break
+                else:
+                    run = []
+            if len(run) == len(raw_entries):
+                break
+            if directory == 0:
+                raise OSError("The FAT16 root directory is full")
+            last = self.chain(directory)[-1]
+            new_cluster = self._allocate(1, after=last)[0]
+            self.write(self._cluster_offset(new_cluster), bytes(self.cluster_size))
+
+        for slot, entry in zip(run, raw_entries):
+            self.write(slot, entry)
+        if at_end:
+            # Keep the end-of-directory marker right after the new entries
+            following = slots.index(run[-1]) + 1
+            if following < len(slots):
+                self.write(slots[following], b"\0")
+        return run[-1]
+
+    def _resolve(self, path: str, create: bool, moment: datetime) -> int:
+        """Cluster of the directory at ``path``, creating it if asked"""
+        directory = self.root_cluster
+        for part in [part for part in path.replace('\\', '/').split('/') if part]:
+            entry = self._find(directory, part)
+            if entry is None:
+                if not create:
+                    raise FileNotFoundError(path)
+                cluster = self._allocate(1)[0]
+                self.write(self._cluster_offset(cluster), bytes(self.cluster_size))
+                self._add_entry(directory, part, ATTR_DIRECTORY, cluster, 0, moment)
+                self._write_dot_entries(cluster, directory, moment)
+                directory = cluster
+            elif not entry.is_directory:
+                raise NotADirectoryError(path)
+            else:
+                directory = entry.cluster
+        return directory
+
+    def _write_dot_entries(self, cluster: int, parent: int, moment: datetime):
+        date, time = _fat_datetime(moment)
+        # '..' of a first-level directory points at cluster 0, even on FAT32
+        parent = 0 if parent == self.root_cluster else parent
+        for index, (name, target) in enumerate(((b".", cluster), (b"..", parent))):
+            raw = bytearray(ENTRY_SIZE)
+            raw[:11] = name.ljust(11)
+            raw[11] = ATTR_DIRECTORY
+            struct.pack_into("<HHHHHHHI", raw, 14, time, date, date, target >> 16, time, date,
+                             target & 0xffff, 0)
+            self.write(self._cluster_offset(cluster) + index * ENTRY_SIZE, bytes(raw))
+
+    # Files
+
+    def makedirs(self, path: str):
+        self._resolve(path, True, datetime.now())
+
+    def read_file(self, path: str) -> Optional[bytes]:
+        """Contents of a file, or None if it does not exist"""
+        directory, _, name = path.replace('\\', '/').rpartition('/')
+        try:
+            entry = self._find(self._resolve(directory, False, datetime.now()), name)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if entry is None or entry.is_directory:
+            return None
+        data = bytearray()
+        for cluster in self.chain(entry.cluster):
+            data += self.read(self._cluster_offset(cluster), self.cluster_size)
+        return bytes(data[:entry.size])
+
+    def write_file(self, path: str, data: bytes, moment: Optional[datetime] = None):
+        """Create or replace a file, creating its directories as needed"""
+        moment = moment or datetime.now()
+        directory_path, _, name = path.replace('\\', '/').rpartition('/')
+        directory = self._resolve(directory_path, True, moment)
+
+        entry = self._find(directory, name)
+        if entry is not None:
+            if entry.is_directory:
+                raise IsADirectoryError(path)
+            if entry.cluster:
+                self._free_chain(entry.cluster)
+            # Drop the old entry together with its long name
+            for slot in entry.lfn_offsets + [entry.offset]:
+                self.write(slot, bytes([DELETED]))
+
+        cluster = 0
+        if data:
+            clusters = self._allocate(-(-len(data) // self.cluster_size))
+            cluster = clusters[0]
+            for index, current in enumerate(clusters):
+                piece = data[index * self.cluster_size:(index + 1) * self.cluster_size]
+                self.write(self._cluster_offset(current), piece.ljust(self.cluster_size, b"\0"))
+        self._add_entry(directory, name, ATTR_ARCHIVE, cluster, len(data), moment)
+
+def inject_files(read: Callable[[int, int], bytes], files: Dict[str, bytes]) -> Optional[PatchSet]:
+    """Write files into the first FAT partition of an image as patches
+
+    Returns None when the image has no FAT partition.
+    """
+    from utils.partitions import find_fat_partition
+    partition = find_fat_partition(read)
+    if partition is None:
+        return None
+    volume = FatVolume(read, partition['offset'])
+    moment = datetime.now()
+    for path, data in files.items():
+        volume.write_file(path, data, moment)
+    return volume.patches()
+
+def read_files(read: Callable[[int, int], bytes], paths: List[str]) -> Dict[str, Optional[bytes]]:
+    """Read files from the first FAT partition of an image or device"""
+    from utils.partitions import find_fat_partition
+    partition = find_fat_partition(read)
+    if partition is None:
+        return {path: None for path in paths}
+    volume = FatVolume(read, partition['offset'])
+    return {path: volume.read_file(path) for path in paths}
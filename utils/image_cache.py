@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+class ImageCache:
+    """Persistent, content-addressed store for downloaded system images
+
+    Images live under ``images/<sha256>.img`` and are described in
+    ``index.json`` by their source URL, HTTP validators (ETag and
+    Last-Modified), size, last use and whether they have been verified
+    against the published checksum. The cache is bounded to ``max_bytes``
+    and evicts least recently used images first; pinned images are never
+    evicted.
+    """
+
+    def __init__(self, cache_dir: Path = Path("cache"), max_bytes: int = 16 * 1024 ** 3):
+        self.logger = logging.getLogger(__name__)
+        self.cache_dir = Path(cache_dir)
+        self.images_dir = self.cache_dir / "images"
+        self.images_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.cache_dir / "index.json"
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        self._entries: Dict[str, Dict] = self._load_index()
+
+    def _load_index(self) -> Dict[str, Dict]:
+        try:
+            with open(self.index_path, 'r') as f:
+                return json.load(f).get('images', {})
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            self.logger.warning(f"Ignoring unreadable image cache index: {e}")
+            return {}
+
+    def _save_index(self):
+        tmp_path = self.index_path.with_name(self.index_path.name + ".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump({'images': self._entries}, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def path_for(self, sha256: str) -> Path:
+        """Get the storage path of an image by its SHA-256"""
+        return self.images_dir / f"{sha256.lower()}.img"
+
+    def _files(self, sha256: str) -> List[Path]:
+        """An image with its download state, block map and chunk manifest"""
+        path = self.path_for(sha256)
+        return [path, path.with_name(path.name + ".state"), path.with_suffix(".bmap"),
+                path.with_suffix(".merkle")]
+
+    def _unlink(self, sha256: str):
+        for path in self._files(sha256):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def get(self, sha256: str) -> Optional[Dict]:
+        """Get the entry for an image if it is present on disk"""
+        with self._lock:
+            entry = self._entries.get(sha256.lower())
+            if entry and self.path_for(entry['sha256']).exists():
+                return dict(entry)
+            return None
+
+    def lookup_url(self, url: str) -> Optional[Dict]:
+        """Get the most recently used image downloaded from a URL"""
+        with self._lock:
+            candidates = [e for e in self._entries.values() if e.get('url') == url]
+            candidates.sort(key=lambda e: e.get('last_used', 0), reverse=True)
+            for entry in candidates:
+                if self.path_for(entry['sha256']).exists():
+                    return dict(entry)
+            return None
+
+    def entry_for_path(self, path: Path) -> Optional[Dict]:
+        """Get the entry an image path belongs to, if it is in the cache"""
+        try:
+            path = Path(path).resolve()
+            if path.parent != self.images_dir.resolve():
+                return None
+            return self.get(path.name.split('.')[0])
+        except Exception:
+            return None
+
+    def entries(self) -> List[Dict]:
+        """List all cache entries, most recently used first"""
+        with self._lock:
+            return sorted((dict(e) for e in self._entries.values()),
+                          key=lambda e: e.get('last_used', 0), reverse=True)
+
+    def add(self, sha256: str, url: str, etag: Optional[str] = None,
+            last_modified: Optional[str] = None, verified: bool = False) -> Dict:
+        """Register an image stored at ``path_for(sha256)``"""
+        sha256 = sha256.lower()
+        with self._lock:
+            previous = self._entries.get(sha256, {})
+            entry = {
+                'sha256': sha256,
+                'url': url,
+                'etag': etag,
+                'last_modified': last_modified,
+                'size': self.path_for(sha256).stat().st_size,
+                'last_used': time.time(),
+                'pinned': previous.get('pinned', False),
+                'verified': verified or previous.get('verified', False)
+            }
+            self._entries[sha256] = entry
+            self._evict(keep=sha256)
+            self._save_index()
+            return dict(entry)
+
+    def touch(self, sha256: str, **updates):
+        """Mark an image as used now, optionally updating its metadata"""
+        with self._lock:
+            entry = self._entries.get(sha256.lower())
+            if entry:
+                entry.update(updates)
+                entry['last_used'] = time.time()
+                self._save_index()
+
+    def mark_verified(self, sha256: str):
+        """Record that an image matched its published checksum"""
+        self.touch(sha256, verified=True)
+
+    def pin(self, sha256: str, pinned: bool = True) -> bool:
+        """Pin (or unpin) a release so it is never evicted"""
+        with self._lock:
+            entry = self._entries.get(sha256.lower())
+            if not entry:
+                return False
+            entry['pinned'] = pinned
+            self._save_index()
+            return True
+
+    def remove(self, sha256: str):
+        """Drop an image and its metadata from the cache"""
+        sha256 = sha256.lower()
+        with self._lock:
+            self._entries.pop(sha256, None)
+            self._unlink(sha256)
+            self._save_index()
+
+    def _evict(self, keep: Optional[str] = None):
+        """Evict least recently used, unpinned images above the size bound"""
+        total = sum(e.get('size', 0) for e in self._entries.values())
+        candidates = sorted(
+            (e for e in self._entries.values() if not e.get('pinned') and e['sha256'] != keep),
+            key=lambda e: e.get('last_used', 0)
+        )
+        for entry in candidates:
+            if total <= self.max_bytes:
+                break
+            self.logger.info(f"Evicting cached image {entry['sha256']} ({entry.get('url')})")
+            total -= entry.get('size', 0)
+            self._entries.pop(entry['sha256'], None)
+            self._unlink(entry['sha256'])
+
+    def revalidate(self, session, url: str) -> Optional[Dict]:
+        """Reuse the cached copy of ``url`` if the server reports it unchanged
+
+        Sends a conditional request with the stored ETag/Last-Modified and
+        returns the verified entry on ``304 Not Modified``, else None.
+        """
+        entry = self.lookup_url(url)
+        if not entry or not entry.get('verified'):
+            return None
+
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        if not headers:
+            return None
+
+        try:
+            response = session.head(url, headers=headers, allow_redirects=True, timeout=30)
+            if response.status_code != 304:
+                return None
+        except Exception as e:
+            self.logger.warning(f"Could not revalidate cached image: {e}")
+            return None
+
+        self.touch(entry['sha256'])
+        return entry
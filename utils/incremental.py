@@ -0,0 +1,136 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+
+from utils.decompress import decompressed_chunks, detect_compression, file_chunks
+from utils.raw_writer import RawWriter
+
+# Raw volumes on Windows only accept sector-aligned reads
+SECTOR_SIZE = 512
+
+class DeviceHasher:
+    """Hash fixed-size chunks of a device on a pool of reader threads"""
+
+    def __init__(self, target: str, chunk_size: int, workers: Optional[int] = None):
+        self.target = target
+        self.chunk_size = chunk_size
+        self.workers = workers or min(8, (os.cpu_count() or 1) * 2)
+        self._local = threading.local()
+        self._handles = []
+        self._lock = threading.Lock()
+
+    def _handle(self):
+        handle = getattr(self._local, 'handle', None)
+        if handle is None:
+            handle = open(self.target, 'rb', buffering=0)
+            self._local.handle = handle
+            with self._lock:
+                self._handles.append(handle)
+        return handle
+
+    def hash_chunk(self, index: int, length: int) -> Optional[str]:
+        """SHA-256 of a chunk of the device, or None if it is out of range"""
+        handle = self._handle()
+        handle.seek(index * self.chunk_size)
+        aligned = -(-length // SECTOR_SIZE) * SECTOR_SIZE
+        data = handle.read(aligned)
+        if len(data) < length:
+            return None
+        return hashlib.sha256(data[:length]).hexdigest()
+
+    def close(self):
+        with self._lock:
+            for handle in self._handles:
+                handle.close()
+            self._handles = []
+
+def incremental_write(chunks: Iterable[bytes], target: str, chunk_size: int,
+                      workers: Optional[int] = None, readback: bool = True,
+                      progress: Optional[Callable[[int], None]] = None) -> Dict:
+    """Write only the image chunks that differ from what the device holds
+
+    ``chunks`` must yield the image in pieces of exactly ``chunk_size``
+    (the last one may be shorter). Device chunks are hashed in parallel
+    ahead of the image stream, each image chunk is hashed as it arrives
+    and only mismatching chunks are written.
+    """
+    logger = logging.getLogger(__name__)
+    hasher = DeviceHasher(target, chunk_size, workers)
+    writer = RawWriter(target, block_size=chunk_size, readback=readback)
+    stats = {'chunks': 0, 'chunks_written': 0, 'bytes_read': 0, 'image_size': 0}
+    window = hasher.workers * 4
+    pending = {}
+
+    try:
+        with ThreadPoolExecutor(max_workers=hasher.workers, thread_name_prefix="device-hash") as pool:
+            writer.open()
+            try:
+                index = 0
+                offset = 0
+                for chunk in chunks:
+                    # Keep the device readers a window ahead of the image stream
+                    for ahead in range(index, index + window):
+                        if ahead not in pending:
+                            pending[ahead] = pool.submit(hasher.hash_chunk, ahead, chunk_size)
+                    future = pending.pop(index, None)
+                    device_hash = future.result() if future else None
+                    if device_hash is None or len(chunk) != chunk_size:
+                        # Short final chunk: compare just the image's bytes
+                        device_hash = hasher.hash_chunk(index, len(chunk))
+                    stats['bytes_read'] += len(chunk)
+
+                    if device_hash != hashlib.sha256(chunk).hexdigest():
+                        writer.write_at(offset, chunk)
+                        stats['chunks_written'] += 1
+                    index += 1
+                    offset += len(chunk)
+                    if progress:
+                        progress(offset)
+                for future in pending.values():
+                    future.cancel()
+                stats['chunks'] = index
+                stats['image_size'] = offset
+                writer.finish(offset)
+            finally:
+                writer.close()
+    finally:
+        hasher.close()
+
+    stats['bytes_written'] = writer.bytes_written + writer.bytes_zeroed
+    stats['readback'] = writer.readback_report
+    logger.info(
+        f"Incremental write to {target}: {stats['chunks_written']} of {stats['chunks']} "
+        f"chunks differed, {stats['bytes_written']} bytes written"
+    )
+    return stats
+
+def rechunk(chunks: Iterable[bytes], chunk_size: int) -> Iterable[bytes]:
+    """Regroup a stream into pieces of exactly ``chunk_size`` bytes"""
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= chunk_size:
+            yield bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    if buffer:
+        yield bytes(buffer)
+
+def incremental_write_file(image_path: Path, target: str, chunk_size: int = 4 * 1024 * 1024,
+                           workers: Optional[int] = None, readback: bool = True,
+                           progress: Optional[Callable[[int], None]] = None,
+                           patches=None) -> Dict:
+    """Incrementally write an image file (optionally compressed) to a device
+
+    ``patches`` (a PatchSet) are laid over the image before comparing.
+    """
+    with open(image_path, 'rb') as f:
+        compression = detect_compression(f.read(8))
+    chunks = decompressed_chunks(file_chunks(image_path, chunk_size), compression)
+    if patches:
+        chunks = patches.patch_chunks(chunks)
+    return incremental_write(rechunk(chunks, chunk_size), target, chunk_size,
+                             workers=workers, readback=readback, progress=progress)
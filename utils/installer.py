@@ -1,87 +1,458 @@
 import logging
 import os
-import wmi
-import win32api
-import win32file
-import win32con
-from typing import List, Dict, Optional
-import yaml
+import threading
+from typing import TYPE_CHECKING, List, Dict, Optional
 import subprocess
 import shutil
-import requests
 from pathlib import Path
 import hashlib
 import json
+import copy
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import cached_property
+from utils.logger import current_context, log_context, new_install_id
+from utils.telemetry import Telemetry, timed_stage
+
+# Heavy modules (requests, yaml, compression, device backends) are
+# imported where they are first needed so the window opens quickly
+if TYPE_CHECKING:
+    import requests
+    from utils.bmap import BlockMap
+    from utils.devices import DeviceBackend, DeviceTable
+    from utils.image_cache import ImageCache
+    from utils.journal import InstallJournal
+    from utils.merkle import ChunkManifest
+    from utils.overlay import PatchSet
+    from utils.printer_catalog import PrinterCatalog
+    from utils.write_tuning import TuningStore
 
 class InstallerManager:
-    def __init__(self):
+    def __init__(self, backend: Optional['DeviceBackend'] = None):
         self.logger = logging.getLogger(__name__)
-        self.wmi = wmi.WMI()
+        self.backend = backend
         self.system_files_url = "https://github.com/InnovateOS/releases/latest/download/system.img"
-        self.temp_dir = Path("temp")
-        self.temp_dir.mkdir(exist_ok=True)
+        self.download_segments = 4
+        self.expected_checksum: Optional[str] = None
+        # Merkle root of the release's chunk manifest, if it publishes one
+        self.expected_merkle_root: Optional[str] = None
+        self.readback_verify = True
+        # Writes kept outstanding on the card while the next chunk is read
+        self.write_queue_depth = 4
+        self.write_block_size = 4 * 1024 * 1024
+        # Calibrate block size and queue depth per card model; see utils.write_tuning
+        self.write_tuning = True
+        self.readback_report: Optional[Dict] = None
+        self.telemetry = Telemetry()
+        # Write the configuration into the image instead of onto the mounted card
+        self.offline_config = True
+        self.injected_config: Optional[Dict[str, bytes]] = None
+        self._inject_lock = threading.Lock()
+        # quick, standard or full; see utils.verification
+        self.verify_tier = 'standard'
+        self.verification_reports: Dict[str, Dict] = {}
+        self.probe_reports: Dict[str, Dict] = {}
+        # Keep a journal per card so a failed install resumes where it stopped
+        self.resume_installs = True
+        # Other stations serving their cached images; see utils.mirror
+        self.mirrors: List[str] = [
+            mirror for mirror in os.environ.get("INNOVATEOS_MIRRORS", "").split(",") if mirror
+        ]
+        # Mirrors that served an image failing verification, skipped from then on
+        self.bad_mirrors: set = set()
+        self.image_source: Optional[str] = None
+        self.mirror_server = None
+        # Whether block maps match their images, by image and map file state
+        self._checked_block_maps: Dict[tuple, bool] = {}
+        
+    @cached_property
+    def devices(self) -> 'DeviceTable':
+        """Removable drives, kept current by hotplug events"""
+        from utils.devices import DeviceTable, default_backend
+        return DeviceTable(self.backend or default_backend())
+        
+    @cached_property
+    def session(self) -> 'requests.Session':
+        from utils.download import create_session
+        return create_session(self.download_segments)
+        
+    @cached_property
+    def image_cache(self) -> 'ImageCache':
+        from utils.image_cache import ImageCache
+        return ImageCache(Path("cache"))
+        
+    @cached_property
+    def printer_catalog(self) -> 'PrinterCatalog':
+        """Printer profiles, loaded from their index when it is current"""
+        from utils.printer_catalog import PrinterCatalog
+        return PrinterCatalog.load()
+        
+    @cached_property
+    def tuning_store(self) -> 'TuningStore':
+        from utils.write_tuning import TuningStore
+        return TuningStore()
+        
+    @cached_property
+    def temp_dir(self) -> Path:
+        temp_dir = Path("temp")
+        temp_dir.mkdir(exist_ok=True)
+        return temp_dir
         
     def get_available_drives(self) -> List[Dict]:
         """Get list of available removable drives"""
         try:
-            drives = []
-            for drive in self.wmi.Win32_LogicalDisk():
-                if drive.DriveType == 2:  # Removable drive
-                    drives.append({
-                        'letter': drive.DeviceID,
-                        'label': drive.VolumeName or 'NO NAME',
-                        'size': int(drive.Size),
-                        'free_space': int(drive.FreeSpace)
-                    })
-            return drives
+            self.devices.start()
+            self.devices.wait_ready()
+            return self.devices.devices()
         except Exception as e:
             self.logger.error(f"Error getting drives: {e}")
             return []
             
+    @timed_stage("download")
     def download_system_image(self) -> Optional[Path]:
         """Download the system image"""
         try:
-            self.logger.info("Downloading system image...")
-            response = requests.get(self.system_files_url, stream=True)
-            response.raise_for_status()
-            
-            image_path = self.temp_dir / "system.img"
-            with open(image_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-                    
+            self.image_source = None
+            # A checksum given up front (a manifest's) pins the image
+            pinned = self.expected_checksum
+            # Reuse the cached copy if the server says nothing changed
+            cached = self.image_cache.revalidate(self.session, self.system_files_url)
+            if cached and pinned in (None, cached['sha256']):
+                self.logger.info(f"Using cached system image {cached['sha256']}")
+                self.expected_checksum = cached['sha256']
+                return self.image_cache.path_for(cached['sha256'])
+                
+            # Same release under a new URL or validators
+            self.expected_checksum = pinned or self._fetch_expected_checksum()
+            cached = self.image_cache.get(self.expected_checksum)
+            if cached:
+                self.logger.info(f"Using cached system image {cached['sha256']}")
+                self.image_cache.touch(cached['sha256'], url=self.system_files_url)
+                return self.image_cache.path_for(cached['sha256'])
+                
+            from utils.download import RangedDownloader
+            image_path = self.image_cache.path_for(self.expected_checksum)
+            stage = self.telemetry.current()
+            for source in self._image_sources():
+                self.logger.info(f"Downloading system image from {source['url']}...")
+                downloader = RangedDownloader(
+                    source['url'],
+                    image_path,
+                    segments=self.download_segments,
+                    session=self.session,
+                    progress=stage.update
+                )
+                if downloader.download():
+                    break
+                if source['mirror']:
+                    self.logger.warning(f"Mirror {source['mirror']} failed, trying the next source")
+            else:
+                return None
+            stage.details['source'] = source['url']
+            self.image_source = source['mirror']
+                
+            # A mirror's validators say nothing about upstream's
+            upstream = source['mirror'] is None
+            self.image_cache.add(
+                self.expected_checksum,
+                self.system_files_url,
+                etag=downloader.etag if upstream else None,
+                last_modified=downloader.last_modified if upstream else None
+            )
             return image_path
             
         except Exception as e:
             self.logger.error(f"Error downloading system image: {e}")
             return None
             
+    def _image_sources(self) -> List[Dict]:
+        """Where to download the expected image from, fastest first, upstream as fallback"""
+        upstream = {'url': self.system_files_url, 'mirror': None}
+        mirrors = [mirror for mirror in self.mirrors if mirror not in self.bad_mirrors]
+        if not mirrors:
+            return [upstream]
+        from utils.mirror import rank_sources
+        sources = rank_sources(self.session, self.system_files_url, mirrors, self.expected_checksum)
+        self.telemetry.current().details['sources'] = [
+            {key: source[key] for key in ('url', 'latency', 'rate')} for source in sources
+        ]
+        return sources
+        
+    def _reject_image(self, sha256: str):
+        """Drop a cached image that failed verification, and the mirror it came from"""
+        self.image_cache.remove(sha256)
+        if self.image_source:
+            self.logger.warning(f"Mirror {self.image_source} served a corrupt image, no longer using it")
+            self.bad_mirrors.add(self.image_source)
+            self.image_source = None
+        
+    def start_mirror(self, host: str = "0.0.0.0", port: Optional[int] = None) -> bool:
+        """Serve this station's verified cached images to other stations"""
+        from utils.mirror import MIRROR_PORT, serve_mirror
+        if self.mirror_server:
+            return True
+        try:
+            self.mirror_server = serve_mirror(self.image_cache, host, MIRROR_PORT if port is None else port)
+            return True
+        except OSError as e:
+            self.logger.error(f"Could not start image mirror: {e}")
+            return False
+            
+    def stop_mirror(self):
+        if self.mirror_server:
+            self.mirror_server.shutdown()
+            self.mirror_server.server_close()
+            self.mirror_server = None
+            
+    def _fetch_expected_checksum(self) -> str:
+        """Download the published checksum for the system image"""
+        if not self.system_files_url:
+            raise Exception("No checksum given for the local system image")
+        from utils.merkle import parse_checksums
+        checksum_url = f"{self.system_files_url}.sha256"
+        response = self.session.get(checksum_url)
+        response.raise_for_status()
+        # Accept a bare digest, "<digest>  system.img" and tagged lines
+        checksums = parse_checksums(response.text)
+        if 'sha256' not in checksums:
+            raise Exception(f"No SHA-256 digest in {checksum_url}")
+        self.expected_merkle_root = self.expected_merkle_root or checksums.get('merkle_root')
+        return checksums['sha256']
+        
+    def _block_map_path(self, image_path: Path) -> Path:
+        """Get the block map sidecar path of an image"""
+        return Path(image_path).with_suffix(".bmap")
+        
+    def _load_block_map(self, image_path: Path) -> Optional['BlockMap']:
+        """Load the image's block map, downloading it if it is published"""
+        from utils.bmap import BlockMap
+        bmap_path = self._block_map_path(image_path)
+        try:
+            if not bmap_path.exists():
+                if not self.system_files_url:
+                    return None
+                response = self.session.get(f"{self.system_files_url}.bmap")
+                if response.status_code == 404:
+                    return None
+                response.raise_for_status()
+                bmap_path.write_bytes(response.content)
+            return BlockMap.load(bmap_path)
+        except Exception as e:
+            self.logger.warning(f"Ignoring block map: {e}")
+            return None
+            
+    def _block_map_key(self, image_path: Path) -> tuple:
+        """Identify an image and its block map as they are on disk"""
+        image = os.stat(image_path)
+        bmap = os.stat(self._block_map_path(image_path))
+        return (str(image_path), image.st_size, image.st_mtime_ns, bmap.st_size, bmap.st_mtime_ns)
+        
+    def _block_map_checked(self, image_path: Path, problem: Optional[str]) -> bool:
+        """Remember whether the block map matches the image, dropping it if not"""
+        self._checked_block_maps[self._block_map_key(image_path)] = problem is None
+        if problem:
+            # The image is authentic, so the block map is stale or broken
+            self.logger.warning(f"Block map does not match image ({problem}), "
+                                f"writing and verifying the full image instead")
+            self._block_map_path(image_path).unlink(missing_ok=True)
+        return problem is None
+        
+    def _fetch_block_map(self, image_path: Path) -> Optional['BlockMap']:
+        """Get the image's block map once it is seen to match the image
+        
+        The map restricts what is written and verified, so it is only used
+        if it has the image's size, its range checksums match and the image
+        holds nothing but zeros outside its ranges.
+        """
+        from utils.bmap import check_block_map
+        block_map = self._load_block_map(image_path)
+        if block_map is None:
+            return None
+        try:
+            checked = self._checked_block_maps.get(self._block_map_key(image_path))
+            if checked is None:
+                manifest = self._fetch_chunk_manifest(image_path)
+                verifier = check_block_map(block_map, image_path, manifest)
+                checked = self._block_map_checked(image_path, verifier.problem())
+            return block_map if checked else None
+        except Exception as e:
+            self.logger.warning(f"Ignoring block map: {e}")
+            return None
+            
+    def _chunk_manifest_path(self, image_path: Path) -> Path:
+        """Get the chunk manifest sidecar path of an image"""
+        return Path(image_path).with_suffix(".merkle")
+        
+    def _fetch_chunk_manifest(self, image_path: Path) -> Optional['ChunkManifest']:
+        """Load the image's chunk manifest if its root matches the published one"""
+        from utils.merkle import ChunkManifest
+        if not self.expected_merkle_root:
+            return None
+        manifest_path = self._chunk_manifest_path(image_path)
+        try:
+            if not manifest_path.exists():
+                if not self.system_files_url:
+                    return None
+                response = self.session.get(f"{self.system_files_url}.merkle")
+                if response.status_code == 404:
+                    return None
+                response.raise_for_status()
+                manifest_path.write_bytes(response.content)
+            manifest = ChunkManifest.load(manifest_path)
+            if manifest.root != self.expected_merkle_root.lower():
+                raise Exception("root does not match the published one")
+            if manifest.image_size != os.path.getsize(image_path):
+                raise Exception("image size does not match")
+            return manifest
+        except Exception as e:
+            self.logger.warning(f"Ignoring chunk manifest: {e}")
+            manifest_path.unlink(missing_ok=True)
+            return None
+            
+    def _verify_chunks(self, image_path: Path, manifest: 'ChunkManifest') -> bool:
+        """Verify the image against its chunk manifest on all cores
+        
+        Damaged chunks of a downloaded image are fetched again on their own
+        instead of failing the whole download.
+        """
+        from utils.download import RangedDownloader
+        stage = self.telemetry.current()
+        stage.set_total(manifest.image_size)
+        bad = manifest.verify(str(image_path), progress=stage.update)
+        if bad and self.system_files_url:
+            self.logger.warning(f"{len(bad)} of {len(manifest)} image chunks damaged, fetching them again")
+            downloader = RangedDownloader(self.system_files_url, image_path, session=self.session)
+            if downloader.refetch([manifest.chunk_range(index) for index in bad]):
+                bad = manifest.verify(str(image_path), bad)
+        if bad:
+            offsets = [manifest.chunk_range(index)[0] for index in bad]
+            self.logger.error(f"Image chunks at offsets {offsets[:10]} do not match the manifest")
+        return not bad
+        
+    @timed_stage("verify_image")
     def verify_image_checksum(self, image_path: Path) -> bool:
         """Verify the downloaded image checksum"""
+        from utils.bmap import RangeVerifier
+        from utils.decompress import decompressed_chunks, detect_compression, file_chunks
         try:
-            # Download checksum file
-            checksum_url = f"{self.system_files_url}.sha256"
-            response = requests.get(checksum_url)
-            response.raise_for_status()
-            expected_checksum = response.text.strip()
+            # Download checksum file unless the download step already did
+            expected_checksum = self.expected_checksum or self._fetch_expected_checksum()
+            
+            # Images verified on an earlier run need no re-hashing
+            cached = self.image_cache.entry_for_path(image_path)
+            if cached and cached['verified'] and cached['sha256'] == expected_checksum:
+                return True
+            
+            # A published chunk manifest is checked in parallel and chunk by chunk
+            manifest = self._fetch_chunk_manifest(image_path)
+            if manifest:
+                ok = self._verify_chunks(image_path, manifest)
+                if cached:
+                    if ok:
+                        self.image_cache.mark_verified(cached['sha256'])
+                    else:
+                        self._reject_image(cached['sha256'])
+                return ok
+            
+            # Check a raw image's block map in the same pass, if there is one
+            with open(image_path, "rb") as f:
+                compression = detect_compression(f.read(8))
+            block_map = self._load_block_map(image_path) if compression is None else None
+            range_verifier = RangeVerifier(block_map) if block_map else None
             
             # Calculate actual checksum
+            stage = self.telemetry.current()
+            stage.set_total(os.path.getsize(image_path))
             sha256_hash = hashlib.sha256()
+            offset = 0
             with open(image_path, "rb") as f:
-                for byte_block in iter(lambda: f.read(4096), b""):
+                for byte_block in iter(lambda: f.read(1024 * 1024), b""):
                     sha256_hash.update(byte_block)
+                    if range_verifier:
+                        range_verifier.update(offset, byte_block)
+                    offset += len(byte_block)
+                    stage.update(offset)
             actual_checksum = sha256_hash.hexdigest()
             
+            if range_verifier and actual_checksum == expected_checksum:
+                self._block_map_checked(image_path, range_verifier.problem())
+            
+            # Compressed releases may publish the checksum of the raw image
+            if actual_checksum != expected_checksum:
+                if compression:
+                    sha256_hash = hashlib.sha256()
+                    for block in decompressed_chunks(file_chunks(image_path), compression):
+                        sha256_hash.update(block)
+                    actual_checksum = sha256_hash.hexdigest()
+            
+            if cached:
+                if actual_checksum == expected_checksum:
+                    self.image_cache.mark_verified(cached['sha256'])
+                else:
+                    # Never serve a corrupt download again
+                    self._reject_image(cached['sha256'])
+            
             return expected_checksum == actual_checksum
             
         except Exception as e:
             self.logger.error(f"Error verifying checksum: {e}")
             return False
             
+    @timed_stage("probe_card")
+    def probe_card(self, drive_letter: str, size: Optional[int] = None,
+                   restore: bool = True, cancel: Optional[threading.Event] = None) -> Dict:
+        """Check a card for fake capacity and slow writes; see utils.card_probe
+        
+        Returns the probe report with its ``verdict`` (pass, warn or fail,
+        or cancelled once ``cancel`` is set). Without ``restore`` the probed
+        blocks are left overwritten, which is fine for a card that is about
+        to be written.
+        """
+        from utils.card_probe import WARN, CardProbe
+        from utils.devices import device_identity
+        from utils.journal import forget
+        target = self._device_path(drive_letter)
+        stage = self.telemetry.current()
+        
+        def progress(bytes_done: int, bytes_total: int):
+            stage.set_total(bytes_total)
+            stage.update(bytes_done)
+            
+        try:
+            size = size or device_identity(target)['size']
+            if not size:
+                raise Exception("Card size unknown")
+            report = CardProbe(target, size, restore=restore, progress=progress, cancel=cancel).run()
+            if not restore:
+                # An interrupted install on this card can no longer be resumed
+                forget(target)
+        except Exception as e:
+            self.logger.error(f"Error probing card: {e}")
+            report = {'target': target, 'verdict': WARN, 'reasons': [f"The card could not be checked: {e}"]}
+        stage.details.update(verdict=report['verdict'], reasons=report['reasons'])
+        self.probe_reports[drive_letter] = report
+        return report
+        
+    def card_identity(self, drive_letter: str) -> Dict:
+        """Size and, where known, model and serial of the card in a drive"""
+        from utils.devices import device_identity
+        return device_identity(self._device_path(drive_letter))
+        
+    def _is_file_target(self, target: str) -> bool:
+        """Whether a target is an image file or loop device rather than a card"""
+        if os.name == 'nt':
+            return os.path.isfile(target)
+        return (os.path.isfile(target) or not os.path.exists(target)
+                or os.path.basename(target).startswith('loop'))
+        
+    @timed_stage("prepare_drive")
     def prepare_drive(self, drive_letter: str) -> bool:
         """Prepare the selected drive for InnovateOS installation"""
         try:
+            if self._is_file_target(drive_letter):
+                # The image brings its own filesystem; there is nothing to format
+                self.logger.info(f"{drive_letter} is an image file or loop device, not formatting it")
+                return True
             self.logger.info(f"Preparing drive {drive_letter}")
             
             # Format drive
@@ -102,16 +473,64 @@ class InstallerManager:
             self.logger.error(f"Error preparing drive: {e}")
             return False
             
-    def write_image_to_drive(self, image_path: Path, drive_letter: str) -> bool:
-        """Write system image to drive"""
+    @timed_stage("write_image")
+    def write_image_to_drive(self, image_path: Path, drive_letter: str,
+                             patches: Optional['PatchSet'] = None,
+                             journal: Optional['InstallJournal'] = None) -> bool:
+        """Write system image to drive
+        
+        With a journal, progress is checkpointed into it and a write it
+        records as interrupted continues from its last checkpoint.
+        """
+        from utils.bmap import write_mapped_ranges
+        from utils.decompress import detect_compression
+        from utils.raw_writer import RawWriter
         try:
             self.logger.info(f"Writing system image to {drive_letter}")
+            block_map = self._fetch_block_map(image_path)
+            start = 0
+            if journal is not None:
+                start = self._resume_offset(journal, image_path, drive_letter, patches, block_map)
             
-            # Use dd for Windows to write image
-            dd_cmd = f"dd if={image_path} of=\\\\.\\{drive_letter} bs=4M"
-            result = subprocess.run(dd_cmd, shell=True, capture_output=True)
-            if result.returncode != 0:
-                raise Exception(f"DD failed: {result.stderr.decode()}")
+            settings = self.tune_write(drive_letter, image_path, patches)
+            
+            # Written chunks are read back from the card while later ones are written
+            writer = RawWriter(
+                self._device_path(drive_letter),
+                block_size=settings['block_size'],
+                readback=self.readback_verify,
+                queue_depth=settings['queue_depth'],
+                checkpoint=journal.checkpoint if journal is not None else None
+            )
+            
+            # With a block map only the mapped ranges are written and verified
+            stage = self.telemetry.current()
+            stage.details.update(resumed_at=start, block_size=settings['block_size'],
+                                 queue_depth=settings['queue_depth'], tuning=settings['source'])
+            if block_map:
+                stage.set_total(block_map.mapped_bytes)
+                with writer:
+                    written = write_mapped_ranges(writer, image_path, block_map, stage.update,
+                                                  patches, start)
+                self.readback_report = writer.readback_report
+                if self.readback_report and not self.readback_report['ok']:
+                    raise Exception(
+                        f"Read-back mismatch at offsets {self.readback_report['mismatches'][:10]}"
+                    )
+                self.logger.info(
+                    f"Wrote {written} mapped bytes of {block_map.image_size} byte image"
+                )
+                return True
+                
+            # Write in-process, zeroing or skipping empty blocks instead of writing them
+            with open(image_path, 'rb') as f:
+                if detect_compression(f.read(8)) is None:
+                    stage.set_total(os.path.getsize(image_path))
+            ok = writer.write_file(image_path, stage.update, patches, start)
+            stage.details.update(writer.stats)
+            self.readback_report = writer.readback_report
+            if not ok:
+                raise Exception(f"Raw write to {drive_letter} failed")
                 
             return True
             
@@ -119,38 +538,206 @@ class InstallerManager:
             self.logger.error(f"Error writing image: {e}")
             return False
             
+    @timed_stage("tune_write")
+    def tune_write(self, drive_letter: str, image_path: Path,
+                   patches: Optional['PatchSet'] = None) -> Dict:
+        """Block size and queue depth to write a card with
+        
+        Settings stored for the card's serial or model are reused. Otherwise
+        a short calibration writes the head of the image (which the card
+        receives anyway) with each candidate and the fastest is stored.
+        Image files and failures get the configured defaults.
+        """
+        from utils.devices import device_identity
+        from utils.overlay import ImageReader
+        from utils.raw_writer import RawWriter
+        from utils.write_tuning import WriteTuner
+        settings = {'block_size': self.write_block_size, 'queue_depth': self.write_queue_depth,
+                    'source': 'default'}
+        stage = self.telemetry.current()
+        target = self._device_path(drive_letter)
+        try:
+            if self.write_tuning and not self._is_file_target(target):
+                identity = device_identity(target)
+                stored = self.tuning_store.get(identity)
+                if stored:
+                    settings = {'block_size': stored['block_size'], 'queue_depth': stored['queue_depth'],
+                                'source': 'stored'}
+                else:
+                    with ImageReader(image_path) as image:
+                        sample = image.read(0, 32 * 1024 * 1024)
+                    if patches:
+                        sample = patches.apply(0, sample)
+                    tuner = WriteTuner(
+                        lambda block_size, queue_depth: RawWriter(
+                            target, block_size=block_size, queue_depth=queue_depth,
+                            zero_mode='write', kernel_copy=False
+                        ),
+                        sample
+                    )
+                    result = tuner.calibrate()
+                    if result:
+                        self.tuning_store.put(identity, result)
+                        settings = {'block_size': result['block_size'], 'queue_depth': result['queue_depth'],
+                                    'source': 'calibrated'}
+                        stage.details['trials'] = result['trials']
+                        
+        except Exception as e:
+            self.logger.warning(f"Write calibration failed, using the defaults: {e}")
+        stage.details.update(settings)
+        self.logger.info(
+            f"Writing {drive_letter} with {settings['block_size'] // 1024} KiB blocks, "
+            f"{settings['queue_depth']} outstanding ({settings['source']})"
+        )
+        return settings
+        
+    def _resume_offset(self, journal: 'InstallJournal', image_path: Path, drive_letter: str,
+                       patches: Optional['PatchSet'], block_map: Optional['BlockMap']) -> int:
+        """Where an interrupted write continues, once the card is seen to still hold it
+        
+        The start of the card and the data just before the checkpoint are
+        compared with the image; anything else starts the write over.
+        """
+        from utils.overlay import DeviceReader, ImageReader
+        offset = journal.write_offset
+        if not offset:
+            return 0
+        sample = 1024 * 1024
+        # Only the mapped ranges of a block-mapped image were written
+        written = [(0, offset)]
+        if block_map:
+            written = [(first, min(first + length, offset))
+                       for first, length, _ in block_map.byte_ranges() if first < offset]
+        try:
+            with ImageReader(image_path) as image, DeviceReader(self._device_path(drive_letter)) as device:
+                first, end = written[0]
+                samples = [(first, min(end, first + sample))]
+                if image.compression is None:
+                    # Reaching the checkpoint in a compressed image means decompressing up to it
+                    first, end = written[-1]
+                    samples.append((max(first, end - sample), end))
+                for lo, hi in samples:
+                    expected = image.read(lo, hi - lo)
+                    if patches:
+                        expected = patches.apply(lo, expected)
+                    if device.read(lo, hi - lo) != expected:
+                        raise ValueError(f"card differs from the image at offset {lo}")
+        except Exception as e:
+            self.logger.warning(f"Writing {drive_letter} from the start, cannot resume: {e}")
+            journal.checkpoint(0)
+            return 0
+        self.logger.info(f"Resuming the write to {drive_letter} at {offset} bytes")
+        return offset
+        
+    @timed_stage("write_image")
+    def write_image_incremental(self, image_path: Path, drive_letter: str,
+                                patches: Optional['PatchSet'] = None) -> bool:
+        """Rewrite only the chunks of the drive that differ from the image"""
+        from utils.incremental import incremental_write_file
+        try:
+            self.logger.info(f"Incrementally writing system image to {drive_letter}")
+            stats = incremental_write_file(
+                image_path,
+                self._device_path(drive_letter),
+                readback=self.readback_verify,
+                progress=self.telemetry.current().update,
+                patches=patches
+            )
+            self.readback_report = stats['readback']
+            if self.readback_report and not self.readback_report['ok']:
+                raise Exception(
+                    f"Read-back mismatch at offsets {self.readback_report['mismatches'][:10]}"
+                )
+            return True
+            
+        except Exception as e:
+            self.logger.error(f"Error writing image incrementally: {e}")
+            return False
+            
+    def _device_path(self, drive_letter: str) -> str:
+        """Get the raw device path for a drive"""
+        if os.name == 'nt':
+            return f"\\\\.\\{drive_letter}"
+        return drive_letter
+        
+    @timed_stage("stream_image")
+    def stream_image_to_drive(self, drive_letter: str) -> bool:
+        """Download, verify and write the system image in a single pass"""
+        from utils.pipeline import StreamingPipeline
+        try:
+            self.logger.info(f"Streaming system image to {drive_letter}")
+            expected_checksum = self.expected_checksum or self._fetch_expected_checksum()
+            
+            response = self.session.get(self.system_files_url, stream=True)
+            response.raise_for_status()
+            
+            stage = self.telemetry.current()
+            length = response.headers.get('Content-Length')
+            stage.set_total(int(length) if length and length.isdigit() else None)
+            pipeline = StreamingPipeline(
+                response.iter_content(chunk_size=1024 * 1024),
+                self._device_path(drive_letter),
+                expected_checksum,
+                progress=stage.update
+            )
+            try:
+                return pipeline.run()
+            finally:
+                response.close()
+            
+        except Exception as e:
+            self.logger.error(f"Error streaming image: {e}")
+            return False
+            
+    # Configuration files of the installed system, relative to the card root
+    CONFIG_FILES = (
+        'innovateos/config/system.yaml',
+        'innovateos/config/network.yaml',
+        'innovateos/config/printer.yaml'
+    )
+    
+    def _config_files(self, config: Dict) -> Dict[str, bytes]:
+        """Render the system, network and printer configuration files
+        
+        The bundle also holds a manifest with the hash of every file.
+        """
+        from utils.config_bundle import build_bundle, dump_yaml
+        
+        # Add system version and installation date
+        config['system']['version'] = "1.0.0"
+        config['system']['install_date'] = datetime.now().isoformat()
+        
+        # Create network configuration
+        network_config = {
+            'wifi': {
+                'ssid': config['network']['ssid'],
+                'password': config['network']['password']
+            }
+        }
+        
+        # Create printer configuration
+        printer_config = {
+            'model': config['printer']['model'],
+            'connection': config['printer']['connection'],
+            'settings': self._get_printer_defaults(config['printer']['model'])
+        }
+        
+        system_path, network_path, printer_path = self.CONFIG_FILES
+        return build_bundle({
+            system_path: dump_yaml(config),
+            network_path: dump_yaml(network_config),
+            printer_path: dump_yaml(printer_config)
+        })
+        
+    @timed_stage("configure")
     def configure_system(self, drive_letter: str, config: Dict) -> bool:
         """Configure the installed system"""
+        from utils.config_bundle import write_bundle
         try:
             self.logger.info("Configuring system")
-            config_path = f"{drive_letter}/innovateos/config/system.yaml"
-            
-            # Add system version and installation date
-            config['system']['version'] = "1.0.0"
-            config['system']['install_date'] = datetime.now().isoformat()
             
-            # Write configuration
-            with open(config_path, 'w') as f:
-                yaml.dump(config, f)
-                
-            # Create network configuration
-            network_config = {
-                'wifi': {
-                    'ssid': config['network']['ssid'],
-                    'password': config['network']['password']
-                }
-            }
-            with open(f"{drive_letter}/innovateos/config/network.yaml", 'w') as f:
-                yaml.dump(network_config, f)
-                
-            # Create printer configuration
-            printer_config = {
-                'model': config['printer']['model'],
-                'connection': config['printer']['connection'],
-                'settings': self._get_printer_defaults(config['printer']['model'])
-            }
-            with open(f"{drive_letter}/innovateos/config/printer.yaml", 'w') as f:
-                yaml.dump(printer_config, f)
+            # Write all configuration files at once, replacing none on failure
+            write_bundle(drive_letter, self._config_files(config))
                 
             return True
             
@@ -158,49 +745,121 @@ class InstallerManager:
             self.logger.error(f"Error configuring system: {e}")
             return False
             
+    @timed_stage("inject_config")
+    def inject_config(self, image_path: Path, config: Dict,
+                      journal: Optional['InstallJournal'] = None) -> Optional['PatchSet']:
+        """Build the configuration into the image's FAT partition
+        
+        Returns the modified sectors as patches to lay over the image while
+        it is written, or None if the image has no usable FAT partition.
+        The patches recorded in ``journal`` are reused: a resumed write must
+        finish with the same bytes it started with.
+        """
+        from utils.fat import inject_files
+        from utils.journal import decode_files, decode_patches, encode_files, encode_patches
+        from utils.overlay import ImageReader
+        self.injected_config = None
+        try:
+            recorded = journal.completed('inject_config') if journal is not None else None
+            if recorded:
+                self.injected_config = decode_files(recorded['files'])
+                self.logger.info("Using the configuration patches of the interrupted install")
+                return decode_patches(recorded['patches'])
+            files = self._config_files(config)
+            with ImageReader(image_path) as reader:
+                patches = inject_files(reader.read, files)
+            if patches is None:
+                self.logger.warning("No FAT partition in the image, configuring after writing")
+                return None
+            self.injected_config = files
+            if journal is not None:
+                journal.complete('inject_config', patches=encode_patches(patches),
+                                 files=encode_files(files))
+            self.logger.info(f"Injected configuration as {len(patches)} patches ({patches.size} bytes)")
+            return patches
+            
+        except Exception as e:
+            self.logger.error(f"Error injecting configuration: {e}")
+            return None
+            
+    @timed_stage("verify_installation")
+    def verify_injected_config(self, drive_letter: str,
+                               expected: Optional[Dict[str, bytes]] = None,
+                               image_path: Optional[Path] = None,
+                               patches: Optional['PatchSet'] = None,
+                               tier: Optional[str] = None) -> bool:
+        """Verify a card configured through the image by reading it raw"""
+        try:
+            report = self._verify(drive_letter, self._device_path(drive_letter), None, image_path,
+                                  patches, expected or self.injected_config, tier)
+            return report['ok']
+            
+        except Exception as e:
+            self.logger.error(f"Error verifying installation: {e}")
+            return False
+            
     def _get_printer_defaults(self, model: str) -> Dict:
         """Get default settings for printer model"""
-        # This would be expanded with more models and settings
-        defaults = {
-            "Prusa i3 MK3S+": {
-                "bed_size": {"x": 250, "y": 210, "z": 210},
-                "nozzle_diameter": 0.4,
-                "max_temp": {"bed": 120, "nozzle": 280}
-            },
-            "Creality Ender 3": {
-                "bed_size": {"x": 220, "y": 220, "z": 250},
-                "nozzle_diameter": 0.4,
-                "max_temp": {"bed": 110, "nozzle": 260}
-            }
-        }
-        return defaults.get(model, {})
-            
-    def verify_installation(self, drive_letter: str) -> bool:
-        """Verify the installation was successful"""
         try:
-            required_files = [
-                'innovateos/config/system.yaml',
-                'innovateos/config/network.yaml',
-                'innovateos/config/printer.yaml',
-                'innovateos/system/boot.img',
-                'innovateos/system/rootfs.img'
-            ]
-            
-            for file in required_files:
-                full_path = f"{drive_letter}/{file}"
-                if not os.path.exists(full_path):
-                    self.logger.error(f"Missing required file: {file}")
-                    return False
+            return self.printer_catalog.settings(model)
+        except Exception as e:
+            self.logger.error(f"Error loading printer profiles: {e}")
+            return {}
+            
+    def _verify(self, drive_letter: str, device: Optional[str], mount: Optional[str],
+                image_path: Optional[Path], patches: Optional['PatchSet'],
+                expected: Optional[Dict[str, bytes]], tier: Optional[str]) -> Dict:
+        """Run the verification checks and keep the report of the drive"""
+        from utils.decompress import detect_compression
+        from utils.verification import InstallationVerifier, failures
+        tier = tier or self.verify_tier
+        stage = self.telemetry.current()
+        manifest = ranges = None
+        if image_path and tier == 'full':
+            # Published chunk hashes save hashing the image a second time
+            manifest = self._fetch_chunk_manifest(image_path)
+            block_map = self._fetch_block_map(image_path)
+            if block_map:
+                ranges = [(offset, length) for offset, length, _ in block_map.byte_ranges()]
+            with open(image_path, 'rb') as f:
+                if detect_compression(f.read(8)) is None:
+                    stage.set_total(os.path.getsize(image_path))
                     
-            # Verify system.yaml can be loaded
-            try:
-                with open(f"{drive_letter}/innovateos/config/system.yaml", 'r') as f:
-                    yaml.safe_load(f)
-            except Exception as e:
-                self.logger.error(f"Invalid system configuration: {e}")
-                return False
-                
-            return True
+        verifier = InstallationVerifier(
+            device=device,
+            mount=mount,
+            image_path=image_path,
+            patches=patches,
+            expected=expected,
+            manifest=manifest,
+            ranges=ranges,
+            progress=stage.update
+        )
+        report = verifier.run(tier)
+        self.verification_reports[drive_letter] = report
+        for item in failures(report):
+            self.logger.error(f"Verification of {item['item']} failed: {item['detail']}")
+        self.logger.info(
+            f"{tier.capitalize()} verification of {drive_letter}: {report['counts']['ok']} checks passed, "
+            f"{report['counts']['failed']} failed, {report['counts']['skipped']} skipped "
+            f"in {report['duration']:.1f}s"
+        )
+        return report
+        
+    @timed_stage("verify_installation")
+    def verify_installation(self, drive_letter: str, tier: Optional[str] = None,
+                            image_path: Optional[Path] = None,
+                            device: Optional[str] = None) -> bool:
+        """Verify the installation was successful
+        
+        ``drive_letter`` is where the card's filesystem is mounted; the raw
+        checks read ``device`` (by default the drive itself). The report
+        of every check is kept in ``verification_reports``.
+        """
+        try:
+            report = self._verify(drive_letter, self._device_path(device or drive_letter),
+                                  drive_letter, image_path, None, None, tier)
+            return report['ok']
             
         except Exception as e:
             self.logger.error(f"Error verifying installation: {e}")
@@ -208,44 +867,242 @@ class InstallerManager:
             
     def cleanup(self):
         """Clean up temporary files"""
+        if 'temp_dir' not in self.__dict__:
+            return
         try:
             shutil.rmtree(self.temp_dir)
         except Exception as e:
             self.logger.error(f"Error cleaning up: {e}")
 
-    def install_system(self, drive_letter: str, config: Dict) -> bool:
-        """Install InnovateOS on the selected drive"""
-        try:
-            # Download system image
-            image_path = self.download_system_image()
-            if not image_path:
-                return False
-            
-            # Verify image checksum
-            if not self.verify_image_checksum(image_path):
-                return False
-            
-            # Prepare drive
-            if not self.prepare_drive(drive_letter):
-                return False
-            
-            # Write image to drive
-            if not self.write_image_to_drive(image_path, drive_letter):
-                return False
-            
-            # Configure system
-            if not self.configure_system(drive_letter, config):
-                return False
-            
-            # Verify installation
-            if not self.verify_installation(drive_letter):
+    def open_journal(self, drive_letter: str, config: Dict, mode: str = 'standard') -> 'InstallJournal':
+        """The journal of an install onto a card; kept in memory only unless resume_installs"""
+        from utils.journal import JOURNAL_DIR, InstallJournal
+        return InstallJournal.open(self._device_path(drive_letter), config, mode,
+                                   JOURNAL_DIR if self.resume_installs else None)
+        
+    def resumable_image(self, journal: 'InstallJournal') -> Optional[Path]:
+        """The image an interrupted install downloaded and verified, if it is unchanged"""
+        download = journal.completed('download')
+        verified = journal.completed('verify_image')
+        if download and verified:
+            image_path = Path(download['image'])
+            try:
+                info = image_path.stat()
+                if info.st_size == download['size'] and info.st_mtime_ns == download['mtime_ns']:
+                    self.logger.info(f"Resuming with verified system image {verified['sha256']}")
+                    self.expected_checksum = verified['sha256']
+                    return image_path
+            except OSError:
+                pass
+            self.logger.info("System image of the interrupted install changed, starting over")
+        # Nothing recorded after a new image applies to it
+        journal.reset('download')
+        return None
+        
+    def record_image(self, journal: 'InstallJournal', image_path: Path):
+        """Record a downloaded and verified image so a retry can skip both"""
+        info = image_path.stat()
+        journal.complete('download', image=str(image_path), size=info.st_size,
+                         mtime_ns=info.st_mtime_ns)
+        journal.complete('verify_image', sha256=self.expected_checksum)
+        
+    def _install_id(self) -> str:
+        """The ID of the install running on this thread, or a new one"""
+        return current_context().get('install_id') or new_install_id()
+        
+    def install_system(self, drive_letter: str, config: Dict, streaming: bool = False,
+                       incremental: bool = False, image_path: Optional[Path] = None,
+                       mount: Optional[str] = None, prepare: bool = True,
+                       verify: bool = True) -> bool:
+        """Install InnovateOS on the selected drive
+        
+        ``image_path`` is an image already downloaded and verified for
+        several drives; without it the image is downloaded. Cards configured
+        through their filesystem are configured and checked at ``mount``
+        (default: the drive). Stages a failed attempt completed are skipped.
+        The caller resets and summarises ``telemetry`` around its run.
+        """
+        mount = mount or drive_letter
+        with log_context(install_id=self._install_id(), device=drive_letter):
+            try:
+                if streaming:
+                    # Download, verify and write in one pass without temp files
+                    if prepare and not self.prepare_drive(drive_letter):
+                        return False
+                    if not self.stream_image_to_drive(drive_letter):
+                        return False
+                    if not self.configure_system(mount, config):
+                        return False
+                    return not verify or self.verify_installation(mount, device=drive_letter)
+                
+                journal = self.open_journal(drive_letter, config,
+                                            'incremental' if incremental else 'standard')
+                recorded = self.resumable_image(journal)
+                if image_path:
+                    # The shared image replaces whatever an earlier attempt used
+                    if recorded != image_path:
+                        journal.reset('download')
+                        self.record_image(journal, image_path)
+                else:
+                    image_path = recorded
+                if not image_path:
+                    # Download system image
+                    image_path = self.download_system_image()
+                    if not image_path:
+                        return False
+                    
+                    # Verify image checksum
+                    if not self.verify_image_checksum(image_path):
+                        return False
+                    self.record_image(journal, image_path)
+                
+                # Build the configuration into the image so the card is written in one pass
+                patches = injected = None
+                if self.offline_config:
+                    # Drives installed in parallel share the installer's injected files
+                    with self._inject_lock:
+                        patches = self.inject_config(image_path, copy.deepcopy(config), journal)
+                        injected = self.injected_config
+                
+                if incremental:
+                    # Re-provision: keep the card's contents and fix up what differs
+                    if not self.write_image_incremental(image_path, drive_letter, patches):
+                        return False
+                elif not journal.completed('write_image'):
+                    # Formatting is only needed to configure through the filesystem
+                    if prepare and not patches and not journal.completed('prepare_drive'):
+                        if not self.prepare_drive(drive_letter):
+                            return False
+                        journal.complete('prepare_drive')
+                    
+                    # Write image to drive
+                    if not self.write_image_to_drive(image_path, drive_letter, patches, journal):
+                        return False
+                journal.complete('write_image')
+                
+                if patches:
+                    # Check the configuration on the card without mounting it
+                    verified = not verify or self.verify_injected_config(drive_letter, injected,
+                                                                         image_path, patches)
+                else:
+                    # Configure system
+                    if not journal.completed('configure'):
+                        if not self.configure_system(mount, config):
+                            return False
+                        journal.complete('configure')
+                    
+                    # Verify installation
+                    verified = not verify or self.verify_installation(mount, image_path=image_path,
+                                                                      device=drive_letter)
+                if verified:
+                    journal.discard()
+                else:
+                    # The card does not hold what was written; the retry writes it again
+                    journal.reset('write_image')
+                return verified
+                
+            except Exception as e:
+                self.logger.error(f"Error installing system: {e}")
                 return False
             
-            return True
-            
-        except Exception as e:
-            self.logger.error(f"Error installing system: {e}")
-            return False
+    def stage_timings(self) -> List[Dict]:
+        """Per-stage timings and throughput of the last run"""
+        return self.telemetry.summary()
+
+    def install_station(self, drive_letters: List[str], config: Dict,
+                        device_configs: Optional[Dict[str, Dict]] = None,
+                        mounts: Optional[Dict[str, str]] = None,
+                        prepare: bool = True, verify: bool = True) -> Dict[str, bool]:
+        """Install InnovateOS on several drives at once from one image
+        
+        As in ``install_system``, each drive's configuration is built into
+        the image (once per distinct configuration) and laid over the shared
+        stream for that drive. Drives without patches are formatted first if
+        ``prepare`` is set and configured through their filesystem, which
+        ``mounts`` locates (default: the drive itself).
+        """
+        from utils.station import FlashStation
+        results = {drive: False for drive in drive_letters}
+        install_id = self._install_id()
+        with log_context(install_id=install_id):
+            try:
+                # Download and verify the image once for all drives
+                image_path = self.download_system_image()
+                if not image_path or not self.verify_image_checksum(image_path):
+                    return results
+                    
+                configs = {drive: (device_configs or {}).get(drive, config) for drive in drive_letters}
+                patches: Dict[str, Optional['PatchSet']] = {drive: None for drive in drive_letters}
+                injected: Dict[str, Optional[Dict[str, bytes]]] = {}
+                if self.offline_config:
+                    built = {}
+                    for drive in drive_letters:
+                        key = json.dumps(configs[drive], sort_keys=True, default=str)
+                        if key not in built:
+                            built[key] = (self.inject_config(image_path, copy.deepcopy(configs[drive])),
+                                          self.injected_config)
+                        patches[drive], injected[drive] = built[key]
+                        
+                # Formatting is only needed to configure through the filesystem
+                unpatched = [drive for drive in drive_letters if not patches[drive]]
+                prepared = {drive: True for drive in drive_letters}
+                if prepare and unpatched:
+                    with ThreadPoolExecutor(max_workers=len(unpatched)) as pool:
+                        prepared.update(zip(unpatched, pool.map(self.prepare_drive, unpatched)))
+                drives = [drive for drive in drive_letters if prepared[drive]]
+                if not drives:
+                    return results
+                    
+                # Fan the image out to one writer thread per drive
+                targets = {self._device_path(drive): drive for drive in drives}
+                with self.telemetry.stage("station_write") as stage:
+                    written = {target: 0 for target in targets}
+                    
+                    def progress(target: str, bytes_done: int):
+                        # Aggregate throughput across all drives
+                        written[target] = bytes_done
+                        stage.update(sum(written.values()))
+                        
+                    station = FlashStation(list(targets), progress=progress,
+                                           patches={target: patches[drive] for target, drive in targets.items()})
+                    for target, result in station.flash_file(image_path).items():
+                        if not result['ok']:
+                            self.logger.error(f"Writing {targets[target]} failed: {result['error']}")
+                            drives.remove(targets[target])
+                    stage.ok = bool(drives)
+                        
+                def finish_drive(drive: str) -> bool:
+                    mount = (mounts or {}).get(drive, drive)
+                    with log_context(install_id=install_id, device=drive):
+                        if patches[drive]:
+                            # Check the configuration on the card without mounting it
+                            return not verify or self.verify_injected_config(
+                                drive, injected[drive], image_path, patches[drive])
+                        if not self.configure_system(mount, copy.deepcopy(configs[drive])):
+                            return False
+                        return not verify or self.verify_installation(mount, image_path=image_path,
+                                                                      device=drive)
+                            
+                with ThreadPoolExecutor(max_workers=len(drives) or 1) as pool:
+                    for drive, ok in zip(drives, pool.map(finish_drive, drives)):
+                        results[drive] = ok
+                        
+                return results
+                
+            except Exception as e:
+                self.logger.error(f"Error installing station: {e}")
+                return results
+
+_installer: Optional[InstallerManager] = None
+_installer_lock = threading.Lock()
+
+def get_installer() -> InstallerManager:
+    """Get the installer service shared by the whole application"""
+    global _installer
+    with _installer_lock:
+        if _installer is None:
+            _installer = InstallerManager()
+        return _installer
 
 if __name__ == "__main__":
     # Test installation process
@@ -0,0 +1,146 @@
+import errno
+import mmap
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+# mmap-backed buffers start on a page boundary; O_DIRECT and most block
+# layers want at least 4 KiB alignment
+ALIGNMENT = mmap.PAGESIZE
+
+# errno values meaning "no in-kernel copy between these two files"
+_NO_KERNEL_COPY = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EBADF,
+                   getattr(errno, 'EOPNOTSUPP', errno.ENOSYS)}
+
+def aligned_size(size: int, alignment: int = ALIGNMENT) -> int:
+    """Round ``size`` up to a multiple of ``alignment``"""
+    return -(-size // alignment) * alignment
+
+class AlignedBufferPool:
+    """A fixed set of reusable, page-aligned buffers
+
+    ``acquire()`` blocks until a buffer is free again, so the pool size
+    bounds how much data is in flight between the reader and the writes.
+    """
+
+    def __init__(self, count: int, size: int):
+        self.size = size
+        self._free = queue.Queue()
+        for _ in range(count):
+            # Anonymous maps are page aligned and zero filled
+            self._free.put(mmap.mmap(-1, aligned_size(size)))
+
+    def acquire(self) -> mmap.mmap:
+        return self._free.get()
+
+    def release(self, buffer: mmap.mmap):
+        self._free.put(buffer)
+
+class IOEngine:
+    """Issue positional writes on worker threads, ``queue_depth`` at a time
+
+    The caller keeps preparing the next chunk (reading, decompressing,
+    hashing) while up to ``queue_depth`` writes are outstanding on the
+    device. ``after_pending()`` runs a callback once every write submitted
+    so far has completed, which is when a chunk may be re-read or its
+    buffer reused. The first write error is raised from ``submit()`` or
+    ``drain()``.
+    """
+
+    def __init__(self, write: Callable[[int, bytes], None], queue_depth: int = 4):
+        self.queue_depth = max(1, queue_depth)
+        self.error: Optional[BaseException] = None
+        self._write = write
+        self._pool = ThreadPoolExecutor(max_workers=self.queue_depth, thread_name_prefix="io-write")
+        self._slots = threading.Semaphore(self.queue_depth)
+        self._condition = threading.Condition()
+        self._next = 0
+        self._outstanding = set()
+        self._callbacks = deque()
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def submit(self, offset: int, data):
+        """Queue a write; blocks while ``queue_depth`` writes are outstanding"""
+        self._check()
+        self._slots.acquire()
+        with self._condition:
+            sequence = self._next
+            self._next += 1
+            self._outstanding.add(sequence)
+        self._pool.submit(self._run, sequence, offset, data)
+
+    def _run(self, sequence: int, offset: int, data):
+        try:
+            self._write(offset, data)
+        except BaseException as e:
+            if self.error is None:
+                self.error = e
+        finally:
+            with self._condition:
+                self._outstanding.discard(sequence)
+                ready = self._ready()
+                self._condition.notify_all()
+            self._slots.release()
+            for callback in ready:
+                try:
+                    callback()
+                except Exception as e:
+                    if self.error is None:
+                        self.error = e
+
+    def _ready(self) -> list:
+        low = min(self._outstanding, default=self._next)
+        ready = []
+        while self._callbacks and self._callbacks[0][0] <= low:
+            ready.append(self._callbacks.popleft()[1])
+        return ready
+
+    def after_pending(self, callback: Callable[[], None]):
+        """Run ``callback`` once all writes submitted so far have completed"""
+        with self._condition:
+            if self._outstanding:
+                self._callbacks.append((self._next, callback))
+                return
+        callback()
+
+    def drain(self):
+        """Wait for all outstanding writes"""
+        with self._condition:
+            while self._outstanding:
+                self._condition.wait()
+        self._check()
+
+    def close(self):
+        with self._condition:
+            while self._outstanding:
+                self._condition.wait()
+        self._pool.shutdown()
+
+def kernel_copy(src_fd: int, dst_fd: int, src_offset: int, dst_offset: int, length: int) -> int:
+    """Copy a byte range between two files without passing it through user space
+
+    Uses copy_file_range(2), or sendfile(2) where the files are on
+    different filesystems (an image on disk and a block device). Returns
+    the bytes copied, 0 at the end of the source; raises OSError with
+    ENOSYS if neither is available for these files.
+    """
+    if hasattr(os, 'copy_file_range'):
+        try:
+            return os.copy_file_range(src_fd, dst_fd, length, src_offset, dst_offset)
+        except OSError as e:
+            if e.errno not in _NO_KERNEL_COPY:
+                raise
+    if hasattr(os, 'sendfile'):
+        try:
+            os.lseek(dst_fd, dst_offset, os.SEEK_SET)
+            return os.sendfile(dst_fd, src_fd, src_offset, length)
+        except OSError as e:
+            if e.errno not in _NO_KERNEL_COPY:
+                raise
+    raise OSError(errno.ENOSYS, "No in-kernel copy between these files")
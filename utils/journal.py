@@ -0,0 +1,158 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Optional
+
+from utils.devices import device_identity
+from utils.overlay import PatchSet
+
+JOURNAL_DIR = Path("cache") / "journal"
+JOURNAL_VERSION = 1
+
+# Stages a retry can skip, in install order
+STAGES = ('download', 'verify_image', 'inject_config', 'prepare_drive', 'write_image', 'configure')
+
+def journal_path(target: str, directory: Path = JOURNAL_DIR) -> Path:
+    return Path(directory) / f"{hashlib.sha256(target.encode()).hexdigest()[:16]}.json"
+
+def forget(target: str, directory: Path = JOURNAL_DIR):
+    """Drop the journal of a card whose contents were changed outside the install"""
+    journal_path(target, directory).unlink(missing_ok=True)
+
+def config_digest(config: Dict) -> str:
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+def encode_patches(patches: PatchSet) -> list:
+    return [[offset, base64.b64encode(data).decode()] for offset, data in patches]
+
+def decode_patches(encoded: list) -> PatchSet:
+    return PatchSet((offset, base64.b64decode(data)) for offset, data in encoded)
+
+def encode_files(files: Dict[str, bytes]) -> Dict[str, str]:
+    return {path: base64.b64encode(data).decode() for path, data in files.items()}
+
+def decode_files(encoded: Dict[str, str]) -> Dict[str, bytes]:
+    return {path: base64.b64decode(data) for path, data in encoded.items()}
+
+class InstallJournal:
+    """Persistent record of how far an install onto one card got
+
+    The journal lists the completed stages with what they produced (the
+    verified image and its hash, the configuration patches) and the offset
+    up to which the image is durably and verifiably on the card. A retry
+    onto the same card with the same configuration skips the completed
+    stages and continues the write from that offset. It is discarded when
+    the install succeeds, and started over when the card, the mode or the
+    configuration differ. ``path`` None keeps it in memory only.
+    """
+
+    def __init__(self, path: Optional[Path], data: Dict):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.data = data
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, target: str, config: Dict, mode: str = 'standard',
+             directory: Optional[Path] = JOURNAL_DIR) -> 'InstallJournal':
+        """The journal of an install onto ``target``, resumed if it matches"""
+        logger = logging.getLogger(__name__)
+        fresh = {
+            'version': JOURNAL_VERSION,
+            'device': device_identity(target),
+            'mode': mode,
+            'config_sha256': config_digest(config),
+            'stages': {},
+            'write_offset': 0
+        }
+        if directory is None:
+            return cls(None, fresh)
+        path = journal_path(target, directory)
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls(path, fresh)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable install journal {path}: {e}")
+            return cls(path, fresh)
+
+        for key in ('version', 'device', 'mode', 'config_sha256'):
+            if data.get(key) != fresh[key]:
+                logger.info(f"Install journal for {target} does not match ({key} differs), starting over")
+                return cls(path, fresh)
+        journal = cls(path, data)
+        if journal.data['stages']:
+            logger.info(f"Resuming install on {target} after {', '.join(journal.data['stages'])}"
+                        f" ({journal.write_offset} bytes written)")
+        return journal
+
+    def completed(self, stage: str) -> Optional[Dict]:
+        """The artifacts recorded for a completed stage, or None"""
+        return self.data['stages'].get(stage)
+
+    def complete(self, stage: str, **artifacts):
+        with self._lock:
+            self.data['stages'][stage] = {
+                'time': datetime.now(timezone.utc).isoformat(),
+                **artifacts
+            }
+            self._save()
+
+    def reset(self, stage: str):
+        """Forget ``stage`` and every stage after it"""
+        with self._lock:
+            for later in STAGES[STAGES.index(stage):]:
+                self.data['stages'].pop(later, None)
+            if STAGES.index(stage) <= STAGES.index('write_image'):
+                self.data['write_offset'] = 0
+            self._save()
+
+    @property
+    def write_offset(self) -> int:
+        """Bytes of the image durably (and verifiably) on the card"""
+        return self.data['write_offset']
+
+    def checkpoint(self, offset: int):
+        """Record write progress; called by RawWriter"""
+        with self._lock:
+            self.data['write_offset'] = offset
+            self._save()
+
+    def discard(self):
+        """Forget the install; it finished"""
+        with self._lock:
+            self.data['stages'] = {}
+            self.data['write_offset'] = 0
+            if self.path is not None:
+                try:
+                    self.path.unlink(missing_ok=True)
+                except OSError as e:
+                    self.logger.warning(f"Could not remove install journal {self.path}: {e}")
+
+    def _save(self):
+        if self.path is None:
+            return
+        self.data['updated'] = datetime.now(timezone.utc).isoformat()
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp_path, 'w') as f:
+                json.dump(self.data, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            # An install without a journal still works, it just cannot resume
+            self.logger.warning(f"Could not write install journal {self.path}: {e}")
+
+if __name__ == "__main__":
+    # python -m utils.journal target: show the journal of an install onto a card
+    import sys
+    path = journal_path(sys.argv[1])
+    print(path.read_text() if path.exists() else f"No install journal for {sys.argv[1]}")
@@ -1,29 +1,154 @@
+import atexit
+import json
 import logging
-import os
-from datetime import datetime
+import logging.handlers
+import queue
+import sys
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from pathlib import Path
+from typing import Dict, Optional
 
-def setup_logger():
-    """Setup logging configuration"""
-    # Create logs directory
-    log_dir = Path("logs")
-    log_dir.mkdir(exist_ok=True)
-    
-    # Create log filename with timestamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    log_file = log_dir / f"installer_{timestamp}.log"
-    
-    # Configure logging
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_file),
-            logging.StreamHandler()
-        ]
-    )
-    
-    # Log system info
+LOG_FILE = Path("logs") / "installer.log"
+CONSOLE_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Context fields stamped on every record logged by the current thread
+CONTEXT_FIELDS = ('install_id', 'device')
+
+_context = threading.local()
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+def new_install_id() -> str:
+    """A short random ID tying together the records of one installation"""
+    return uuid.uuid4().hex[:12]
+
+def current_context() -> Dict[str, str]:
+    """The log context of the current thread"""
+    return dict(getattr(_context, 'fields', {}))
+
+@contextmanager
+def log_context(**fields):
+    """Add fields (e.g. ``install_id``, ``device``) to the records of this thread
+
+    Contexts nest; fields set to None are left as they are.
+    """
+    previous = getattr(_context, 'fields', {})
+    _context.fields = {**previous, **{key: value for key, value in fields.items() if value is not None}}
+    try:
+        yield
+    finally:
+        _context.fields = previous
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """Hand records to the writer thread without blocking the caller
+
+    The message, traceback and log context are resolved here, on the
+    logging thread, so the record is self-contained once it is queued.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        for key, value in current_context().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName
+        }
+        for key in CONTEXT_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        span = getattr(record, 'span', None)
+        if span is not None:
+            entry['span'] = span
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class _NoSpans(logging.Filter):
+    """Keep trace spans out of the console; they are for the log file"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return not hasattr(record, 'span')
+
+def setup_logging(log_file: Optional[Path] = LOG_FILE, level: int = logging.INFO,
+                  console=sys.stderr, max_bytes: int = 10 * 1024 * 1024,
+                  backup_count: int = 5) -> logging.handlers.QueueListener:
+    """Route all logging through a queue to a background writer thread
+
+    The writer appends JSON lines to ``log_file``, rotating it at
+    ``max_bytes``, and prints a readable line to ``console``. Any earlier
+    setup is replaced; the writer is flushed at exit.
+    """
+    shutdown_logging()
+    global _listener
+    with _setup_lock:
+        handlers = []
+        if console is not None:
+            stream = logging.StreamHandler(console)
+            stream.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+            stream.addFilter(_NoSpans())
+            handlers.append(stream)
+        if log_file is not None:
+            Path(log_file).parent.mkdir(parents=True, exist_ok=True)
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=max_bytes, backupCount=backup_count,
+                encoding='utf-8'
+            )
+            file_handler.setFormatter(JsonFormatter())
+            handlers.append(file_handler)
+
+        # An unbounded queue: logging never waits for the disk
+        records = queue.SimpleQueue()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+            handler.close()
+        root.addHandler(ContextQueueHandler(records))
+        root.setLevel(level)
+        _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+        _listener.start()
+        return _listener
+
+def shutdown_logging():
+    """Write out the queued records and stop the writer thread"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+
+atexit.register(shutdown_logging)
+
+if __name__ == "__main__":
+    # python -m utils.logger: write a few records and report the log file
+    setup_logging()
     logger = logging.getLogger(__name__)
-    logger.info("InnovateOS Installer started")
-    logger.info(f"Log file: {log_file}")
+    with log_context(install_id=new_install_id(), device='E:'):
+        logger.info("InnovateOS Installer started")
+        try:
+            raise RuntimeError("example")
+        except RuntimeError:
+            logger.exception("Example failure")
+    shutdown_logging()
+    print(LOG_FILE)
@@ -0,0 +1,230 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+MANIFEST_VERSION = 1
+
+# Raw volumes on Windows only accept sector-aligned reads
+SECTOR_SIZE = 512
+
+# "<digest>  <name>" (sha256sum) and "<TAG> (<name>) = <digest>" (--tag) lines
+_PLAIN_LINE = re.compile(r"^([0-9a-fA-F]{64})(?:\s+\*?(.*))?$")
+_TAGGED_LINE = re.compile(r"^([A-Z0-9-]+) \((.*)\) = ([0-9a-fA-F]{64})$")
+
+def parse_checksums(text: str) -> Dict[str, str]:
+    """Read a published checksum file
+
+    Returns the image's ``sha256`` and, if the release lists one as
+    ``MERKLE-SHA256 (system.img) = <root>``, its chunk manifest's
+    ``merkle_root``.
+    """
+    checksums = {}
+    for line in text.splitlines():
+        line = line.strip()
+        tagged = _TAGGED_LINE.match(line)
+        if tagged:
+            key = {'SHA256': 'sha256', 'MERKLE-SHA256': 'merkle_root'}.get(tagged.group(1))
+            if key:
+                checksums.setdefault(key, tagged.group(3).lower())
+            continue
+        plain = _PLAIN_LINE.match(line)
+        if plain:
+            checksums.setdefault('sha256', plain.group(1).lower())
+    return checksums
+
+def merkle_root(leaves: List[str]) -> str:
+    """Root of a binary SHA-256 tree over hex leaf hashes
+
+    Parents hash the concatenation of their children's digests; an odd
+    node at the end of a level is carried up unchanged.
+    """
+    if not leaves:
+        return hashlib.sha256(b"").hexdigest()
+    level = [bytes.fromhex(leaf) for leaf in leaves]
+    while len(level) > 1:
+        parents = [hashlib.sha256(level[i] + level[i + 1]).digest()
+                   for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        level = parents
+    return level[0].hex()
+
+class _ChunkReader:
+    """Thread-local handles for reading chunks of a file or raw device"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._handles = []
+        self._lock = threading.Lock()
+
+    def read(self, offset: int, length: int) -> bytes:
+        handle = getattr(self._local, 'handle', None)
+        if handle is None:
+            handle = open(self.path, 'rb', buffering=0)
+            self._local.handle = handle
+            with self._lock:
+                self._handles.append(handle)
+        handle.seek(offset)
+        return handle.read(-(-length // SECTOR_SIZE) * SECTOR_SIZE)[:length]
+
+    def close(self):
+        with self._lock:
+            for handle in self._handles:
+                handle.close()
+            self._handles = []
+
+class ChunkManifest:
+    """Per-chunk SHA-256 hashes of an image, combined into a Merkle tree
+
+    The root is what a release vouches for (next to the flat SHA-256 in
+    its checksum file). Loading a manifest recomputes the root from the
+    chunk hashes, so a manifest whose root matches the published one
+    authenticates every chunk. Chunks are hashed on all cores, and any
+    subset of them can be checked on its own: a resumed download, a range
+    read back from a card, or the card as a whole before an incremental
+    write.
+    """
+
+    def __init__(self, image_size: int, chunk_size: int, chunks: List[str]):
+        if chunk_size <= 0 or chunk_size % SECTOR_SIZE:
+            raise ValueError(f"Chunk size must be a positive multiple of {SECTOR_SIZE}")
+        if len(chunks) != -(-image_size // chunk_size):
+            raise ValueError("Chunk hashes do not cover the image")
+        self.image_size = image_size
+        self.chunk_size = chunk_size
+        self.chunks = chunks
+        self.root = merkle_root(chunks)
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def chunk_range(self, index: int) -> tuple:
+        """Byte offset and length of a chunk"""
+        offset = index * self.chunk_size
+        return offset, min(self.chunk_size, self.image_size - offset)
+
+    def chunks_for(self, offset: int, length: int) -> range:
+        """Indices of the chunks overlapping a byte range"""
+        if length <= 0:
+            return range(0)
+        first = offset // self.chunk_size
+        last = min((offset + length - 1) // self.chunk_size, len(self.chunks) - 1)
+        return range(first, last + 1)
+
+    def verify_chunk(self, index: int, data: bytes) -> bool:
+        return hashlib.sha256(data).hexdigest() == self.chunks[index]
+
+    @classmethod
+    def build(cls, path: Path, chunk_size: int = 4 * 1024 * 1024,
+              workers: Optional[int] = None,
+              progress: Optional[Callable[[int], None]] = None) -> 'ChunkManifest':
+        """Hash an image on all cores"""
+        size = os.path.getsize(path)
+        count = -(-size // chunk_size)
+        hashes = _hash_chunks(str(path), chunk_size, size, range(count), workers, progress)
+        return cls(size, chunk_size, [hashes[index] for index in range(count)])
+
+    def verify(self, path: str, indices: Optional[Iterable[int]] = None,
+               workers: Optional[int] = None,
+               progress: Optional[Callable[[int], None]] = None) -> List[int]:
+        """Hash the given chunks (default: all) of a file or device in parallel
+
+        Returns the indices of the chunks that do not match, including
+        chunks the file is too short to hold.
+        """
+        indices = range(len(self.chunks)) if indices is None else sorted(set(indices))
+        hashes = _hash_chunks(path, self.chunk_size, self.image_size, indices, workers, progress)
+        return sorted(index for index in indices if hashes.get(index) != self.chunks[index])
+
+    def to_dict(self) -> Dict:
+        return {
+            'version': MANIFEST_VERSION,
+            'hash': 'sha256',
+            'image_size': self.image_size,
+            'chunk_size': self.chunk_size,
+            'root': self.root,
+            'chunks': self.chunks
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'ChunkManifest':
+        if data.get('version') != MANIFEST_VERSION or data.get('hash') != 'sha256':
+            raise ValueError("Unsupported chunk manifest")
+        manifest = cls(int(data['image_size']), int(data['chunk_size']),
+                       [chunk.lower() for chunk in data['chunks']])
+        if data.get('root', '').lower() != manifest.root:
+            raise ValueError("Chunk manifest root does not match its chunk hashes")
+        return manifest
+
+    def save(self, path: Path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path: Path) -> 'ChunkManifest':
+        with open(path, 'r') as f:
+            return cls.from_dict(json.load(f))
+
+def _hash_chunks(path: str, chunk_size: int, image_size: int, indices: Iterable[int],
+                 workers: Optional[int] = None,
+                 progress: Optional[Callable[[int], None]] = None) -> Dict[int, Optional[str]]:
+    """SHA-256 of chunks of a file or device, hashed on a thread pool
+
+    hashlib releases the GIL for large buffers, so threads hash on all
+    cores. Chunks the file is too short to hold hash to None.
+    """
+    reader = _ChunkReader(path)
+
+    def hash_chunk(index: int):
+        offset = index * chunk_size
+        length = min(chunk_size, image_size - offset)
+        data = reader.read(offset, length)
+        if len(data) < length:
+            return index, None, length
+        return index, hashlib.sha256(data).hexdigest(), length
+
+    hashes = {}
+    done = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+                                thread_name_prefix="merkle") as pool:
+            for future in as_completed([pool.submit(hash_chunk, index) for index in indices]):
+                index, digest, length = future.result()
+                hashes[index] = digest
+                done += length
+                if progress:
+                    progress(done)
+    finally:
+        reader.close()
+    return hashes
+
+if __name__ == "__main__":
+    # python -m utils.merkle create system.img [chunk KiB]
+    # python -m utils.merkle verify system.img|/dev/sdX [system.merkle]
+    import sys
+    import time
+
+    logging.basicConfig(level=logging.INFO)
+    command, target = sys.argv[1], Path(sys.argv[2])
+    if command == 'create':
+        chunk_kib = int(sys.argv[3]) if len(sys.argv) > 3 else 4096
+        started = time.monotonic()
+        manifest = ChunkManifest.build(target, chunk_kib * 1024)
+        output = target.with_suffix(".merkle")
+        manifest.save(output)
+        print(f"{output}: {len(manifest)} chunks in {time.monotonic() - started:.2f}s")
+        print(f"MERKLE-SHA256 ({target.name}) = {manifest.root}")
+    else:
+        manifest = ChunkManifest.load(Path(sys.argv[3]) if len(sys.argv) > 3 else target.with_suffix(".merkle"))
+        started = time.monotonic()
+        bad = manifest.verify(str(target))
+        print(f"{len(bad)} of {len(manifest)} chunks differ "
+              f"({time.monotonic() - started:.2f}s): {[manifest.chunk_range(i)[0] for i in bad[:10]]}")
+        sys.exit(1 if bad else 0)
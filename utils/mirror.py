@@ -0,0 +1,149 @@
+import io
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from utils.image_cache import ImageCache
+from utils.range_server import RangeRequestHandler
+
+MIRROR_PORT = 8765
+IMAGE_PATH = re.compile(r'/images/([0-9a-f]{64})\.img')
+
+def image_url(mirror: str, sha256: str) -> str:
+    """Where a mirror serves the image with the given SHA-256"""
+    return f"{mirror.rstrip('/')}/images/{sha256.lower()}.img"
+
+class MirrorRequestHandler(RangeRequestHandler):
+    """Serve the verified images of an ImageCache to other stations
+
+    ``/index.json`` lists the images on offer; ``/images/<sha256>.img``
+    serves one with range, ETag and keep-alive support. Images that are
+    still downloading or failed verification are not served.
+    """
+
+    cache: ImageCache = None
+
+    def _verified_path(self, path: str) -> Optional[str]:
+        match = IMAGE_PATH.fullmatch(urlsplit(path).path)
+        if not match:
+            return None
+        entry = self.cache.get(match.group(1))
+        if not entry or not entry.get('verified'):
+            return None
+        return str(self.cache.path_for(entry['sha256']))
+
+    def translate_path(self, path: str) -> str:
+        return self._verified_path(path) or ""
+
+    def send_head(self):
+        self._range = None
+        if urlsplit(self.path).path == '/index.json':
+            images = [{'sha256': entry['sha256'], 'size': entry.get('size'), 'url': entry.get('url')}
+                      for entry in self.cache.entries() if entry.get('verified')]
+            body = json.dumps({'images': images}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self._remaining = len(body)
+            return io.BytesIO(body)
+        if self._verified_path(self.path) is None:
+            self.send_error(404, "Image not available")
+            return None
+        return super().send_head()
+
+def serve_mirror(cache: ImageCache, host: str = "0.0.0.0", port: int = MIRROR_PORT,
+                 rate_limit: Optional[int] = None) -> ThreadingHTTPServer:
+    """Serve a cache's verified images on a background thread
+
+    Call ``server.shutdown()`` to stop it.
+    """
+    handler = type("MirrorRequestHandler", (MirrorRequestHandler,),
+                   {"cache": cache, "rate_limit": rate_limit})
+    server = ThreadingHTTPServer((host, port), partial(handler, directory=str(cache.images_dir)))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="image-mirror", daemon=True)
+    thread.start()
+    logging.getLogger(__name__).info(f"Serving cached images on {host}:{server.server_port}")
+    return server
+
+def probe_source(session, url: str, probe_bytes: int = 1024 * 1024, timeout: float = 5) -> Optional[Dict]:
+    """Latency and throughput of fetching the first ``probe_bytes`` of a URL
+
+    Returns None if the source does not have the file or does not answer.
+    """
+    logger = logging.getLogger(__name__)
+    started = time.monotonic()
+    try:
+        response = session.get(url, headers={"Range": f"bytes=0-{probe_bytes - 1}"},
+                               stream=True, timeout=timeout)
+        try:
+            if response.status_code not in (200, 206):
+                logger.debug(f"Source {url} answered {response.status_code}")
+                return None
+            latency = time.monotonic() - started
+            received = 0
+            for chunk in response.iter_content(64 * 1024):
+                received += len(chunk)
+                if received >= probe_bytes or time.monotonic() - started > timeout:
+                    break
+        finally:
+            response.close()
+    except Exception as e:
+        logger.debug(f"Source {url} unreachable: {e}")
+        return None
+    elapsed = time.monotonic() - started
+    return {
+        'url': url,
+        'latency': latency,
+        'rate': received / max(elapsed - latency, 1e-6),
+        'ranges': response.status_code == 206
+    }
+
+def rank_sources(session, upstream: Optional[str], mirrors: List[str], sha256: str,
+                 probe_bytes: int = 1024 * 1024, timeout: float = 5) -> List[Dict]:
+    """Sources of an image, fastest first, probed in parallel
+
+    Each source is its probe result with ``mirror`` set to the mirror's
+    base URL, or None for upstream. Mirrors without the image are left
+    out. Upstream is ranked with the mirrors and always included, last if
+    it did not answer the probe, so there is something to fall back to.
+    """
+    logger = logging.getLogger(__name__)
+    candidates = [(mirror, image_url(mirror, sha256)) for mirror in mirrors]
+    if upstream:
+        candidates.append((None, upstream))
+
+    def probe(candidate):
+        mirror, url = candidate
+        result = probe_source(session, url, probe_bytes, timeout)
+        return {**result, 'mirror': mirror} if result else None
+
+    with ThreadPoolExecutor(max_workers=max(1, len(candidates)), thread_name_prefix="mirror-probe") as pool:
+        probes = list(pool.map(probe, candidates))
+    ranked = sorted((result for result in probes if result), key=lambda result: result['rate'], reverse=True)
+    for result in ranked:
+        logger.info(f"Source {result['url']}: {result['latency'] * 1000:.0f} ms, "
+                    f"{result['rate'] / 1e6:.1f} MB/s")
+    if upstream and not any(result['mirror'] is None for result in ranked):
+        ranked.append({'url': upstream, 'mirror': None, 'latency': None, 'rate': None, 'ranges': None})
+    return ranked
+
+if __name__ == "__main__":
+    # python -m utils.mirror [port]: serve this station's cached images
+    import sys
+    from pathlib import Path
+
+    logging.basicConfig(level=logging.INFO)
+    server = serve_mirror(ImageCache(Path("cache")), port=int(sys.argv[1]) if len(sys.argv) > 1 else MIRROR_PORT)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,191 @@
+import bisect
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from utils.decompress import decompressed_chunks, detect_compression, file_chunks
+
+class PatchSet:
+    """Byte ranges that replace parts of an image while it is written
+
+    Patches are kept sorted and non-overlapping; a later patch replaces
+    the bytes of earlier ones it overlaps.
+    """
+
+    def __init__(self, patches: Iterable[Tuple[int, bytes]] = ()):
+        self._offsets: List[int] = []
+        self._data: List[bytes] = []
+        for offset, data in patches:
+            self.add(offset, data)
+
+    def add(self, offset: int, data: bytes):
+        if not data:
+            return
+        end = offset + len(data)
+        # Merge with every patch that overlaps or touches the new one
+        first = bisect.bisect_right(self._offsets, offset) - 1
+        if first < 0 or self._offsets[first] + len(self._data[first]) < offset:
+            first += 1
+        last = first
+        while last < len(self._offsets) and self._offsets[last] <= end:
+            last += 1
+        start = min([offset] + self._offsets[first:last])
+        stop = max([end] + [o + len(d) for o, d in zip(self._offsets[first:last], self._data[first:last])])
+        merged = bytearray(stop - start)
+        for old_offset, old_data in zip(self._offsets[first:last], self._data[first:last]):
+            merged[old_offset - start:old_offset - start + len(old_data)] = old_data
+        merged[offset - start:end - start] = data
+        self._offsets[first:last] = [start]
+        self._data[first:last] = [bytes(merged)]
+
+    def __iter__(self) -> Iterator[Tuple[int, bytes]]:
+        return iter(zip(self._offsets, self._data))
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    @property
+    def size(self) -> int:
+        """Number of patched bytes"""
+        return sum(len(data) for data in self._data)
+
+    @property
+    def end(self) -> int:
+        """Offset just past the last patched byte"""
+        return self._offsets[-1] + len(self._data[-1]) if self._offsets else 0
+
+    def apply(self, offset: int, data) -> bytes:
+        """Return ``data`` (located at ``offset``) with the patches laid over it"""
+        end = offset + len(data)
+        index = max(bisect.bisect_right(self._offsets, offset) - 1, 0)
+        patched = None
+        while index < len(self._offsets) and self._offsets[index] < end:
+            start = self._offsets[index]
+            patch = self._data[index]
+            lo = max(start, offset)
+            hi = min(start + len(patch), end)
+            if lo < hi:
+                if patched is None:
+                    patched = bytearray(data)
+                patched[lo - offset:hi - offset] = patch[lo - start:hi - start]
+            index += 1
+        return data if patched is None else bytes(patched)
+
+    def patch_chunks(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Overlay the patches onto a sequential chunk stream"""
+        offset = 0
+        for chunk in chunks:
+            yield self.apply(offset, chunk)
+            offset += len(chunk)
+
+    def outside(self, ranges: Iterable[Tuple[int, int]]) -> List[Tuple[int, bytes]]:
+        """The patched bytes not covered by the (offset, length) ``ranges``"""
+        pieces = list(self)
+        for range_start, range_length in sorted(ranges):
+            range_end = range_start + range_length
+            remaining = []
+            for start, data in pieces:
+                end = start + len(data)
+                if end <= range_start or start >= range_end:
+                    remaining.append((start, data))
+                    continue
+                if start < range_start:
+                    remaining.append((start, data[:range_start - start]))
+                if end > range_end:
+                    remaining.append((range_end, data[range_end - start:]))
+            pieces = remaining
+        return pieces
+
+class ImageReader:
+    """Random read access to an image file, compressed or not
+
+    Compressed images are decompressed on demand into a temporary file,
+    only as far as the furthest byte read so far, so looking at the
+    partitions near the start of an image stays cheap. Reads are
+    serialised, so one reader can be shared between threads.
+    """
+
+    def __init__(self, image_path: Path):
+        self.image_path = Path(image_path)
+        self._lock = threading.Lock()
+        self._file = open(self.image_path, 'rb')
+        self.compression = detect_compression(self._file.read(8))
+        self._spool = None
+        self._chunks: Optional[Iterator[bytes]] = None
+        self._available = 0
+        if self.compression is not None:
+            self._file.close()
+            self._file = None
+            self._spool = tempfile.TemporaryFile()
+            self._chunks = iter(decompressed_chunks(file_chunks(self.image_path), self.compression))
+
+    def _fill(self, end: int):
+        while self._available < end and self._chunks is not None:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._chunks = None
+                break
+            self._spool.seek(self._available)
+            self._spool.write(chunk)
+            self._available += len(chunk)
+
+    def read(self, offset: int, length: int) -> bytes:
+        with self._lock:
+            if self._spool is None:
+                self._file.seek(offset)
+                return self._file.read(length)
+            self._fill(offset + length)
+            self._spool.seek(offset)
+            return self._spool.read(max(0, min(length, self._available - offset)))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    def __enter__(self) -> 'ImageReader':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class DeviceReader:
+    """Sector-aligned random reads from a raw device or image file
+
+    Reads may be issued from several threads at once.
+    """
+
+    def __init__(self, target: str, sector_size: int = 512):
+        self.sector_size = sector_size
+        self._fd = os.open(target, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        self._lock = threading.Lock()
+
+    def _read_at(self, offset: int, length: int) -> bytes:
+        if hasattr(os, 'pread'):
+            return os.pread(self._fd, length, offset)
+        with self._lock:
+            os.lseek(self._fd, offset, os.SEEK_SET)
+            return os.read(self._fd, length)
+
+    def read(self, offset: int, length: int) -> bytes:
+        # Raw Windows volumes only accept whole, aligned sectors
+        start = offset - offset % self.sector_size
+        end = -(-(offset + length) // self.sector_size) * self.sector_size
+        data = self._read_at(start, end - start)
+        return data[offset - start:offset - start + length]
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self) -> 'DeviceReader':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,132 @@
+import struct
+import uuid
+from typing import Callable, Dict, List, Optional
+
+# Partition tables address 512-byte logical sectors on SD cards and images
+SECTOR_SIZE = 512
+
+# MBR partition types that hold a FAT filesystem
+MBR_FAT_TYPES = {0x01, 0x04, 0x06, 0x0b, 0x0c, 0x0e, 0xef}
+MBR_EXTENDED_TYPES = {0x05, 0x0f, 0x85}
+MBR_GPT_PROTECTIVE = 0xee
+
+# GPT partition type GUIDs that may hold a FAT filesystem
+GPT_FAT_TYPES = {
+    uuid.UUID("ebd0a0a2-b9e5-4433-87c0-68b6b72699c7"),  # Microsoft basic data
+    uuid.UUID("c12a7328-f81f-11d2-ba4b-00a0c93ec93b"),  # EFI system partition
+}
+
+# A function returning ``length`` bytes of the image at ``offset``
+ReadAt = Callable[[int, int], bytes]
+
+def _mbr_entries(sector: bytes) -> List[Dict]:
+    entries = []
+    for index in range(4):
+        entry = sector[446 + index * 16:446 + (index + 1) * 16]
+        part_type = entry[4]
+        start_lba, sectors = struct.unpack_from("<II", entry, 8)
+        if part_type and sectors:
+            entries.append({'type': part_type, 'start_lba': start_lba, 'sectors': sectors})
+    return entries
+
+def _read_mbr(read: ReadAt, mbr: bytes) -> List[Dict]:
+    partitions = []
+    for entry in _mbr_entries(mbr):
+        if entry['type'] in MBR_EXTENDED_TYPES:
+            # Walk the chain of extended boot records for logical partitions
+            base = entry['start_lba']
+            ebr_lba = base
+            for _ in range(128):
+                ebr = read(ebr_lba * SECTOR_SIZE, SECTOR_SIZE)
+                if len(ebr) < SECTOR_SIZE or ebr[510:512] != b"\x55\xaa":
+                    break
+                entries = _mbr_entries(ebr)
+                if not entries:
+                    break
+                logical = entries[0]
+                partitions.append({
+                    'scheme': 'mbr',
+                    'type': logical['type'],
+                    'offset': (ebr_lba + logical['start_lba']) * SECTOR_SIZE,
+                    'size': logical['sectors'] * SECTOR_SIZE
+                })
+                if len(entries) < 2:
+                    break
+                ebr_lba = base + entries[1]['start_lba']
+            continue
+        partitions.append({
+            'scheme': 'mbr',
+            'type': entry['type'],
+            'offset': entry['start_lba'] * SECTOR_SIZE,
+            'size': entry['sectors'] * SECTOR_SIZE
+        })
+    return partitions
+
+def _read_gpt(read: ReadAt) -> List[Dict]:
+    header = read(SECTOR_SIZE, SECTOR_SIZE)
+    if header[:8] != b"EFI PART":
+        raise ValueError("Protective MBR without a GPT header")
+    entries_lba, count, entry_size = struct.unpack_from("<QII", header, 72)
+    table = read(entries_lba * SECTOR_SIZE, count * entry_size)
+    partitions = []
+    for index in range(count):
+        entry = table[index * entry_size:(index + 1) * entry_size]
+        if len(entry) < 128 or not any(entry[:16]):
+            continue
+        first_lba, last_lba = struct.unpack_from("<QQ", entry, 32)
+        partitions.append({
+            'scheme': 'gpt',
+            'type': uuid.UUID(bytes_le=entry[:16]),
+            'name': entry[56:128].decode('utf-16-le', errors='replace').rstrip('\0'),
+            'offset': first_lba * SECTOR_SIZE,
+            'size': (last_lba - first_lba + 1) * SECTOR_SIZE
+        })
+    return partitions
+
+def read_partitions(read: ReadAt) -> List[Dict]:
+    """List the partitions of an MBR or GPT partitioned image
+
+    Each partition is a dict with ``scheme`` ('mbr' or 'gpt'), ``type``
+    (MBR type byte or GPT type GUID), ``offset`` and ``size`` in bytes;
+    GPT partitions also carry their ``name``.
+    """
+    mbr = read(0, SECTOR_SIZE)
+    if len(mbr) < SECTOR_SIZE or mbr[510:512] != b"\x55\xaa":
+        return []
+    if any(entry['type'] == MBR_GPT_PROTECTIVE for entry in _mbr_entries(mbr)):
+        return _read_gpt(read)
+    if is_fat_boot_sector(mbr):
+        # A superfloppy: the whole image is one FAT filesystem
+        return []
+    partitions = _read_mbr(read, mbr)
+    for index, partition in enumerate(partitions):
+        partition['index'] = index + 1
+    return partitions
+
+def is_fat_boot_sector(sector: bytes) -> bool:
+    """Whether a sector looks like the boot sector of a FAT filesystem"""
+    if len(sector) < 512 or sector[510:512] != b"\x55\xaa":
+        return False
+    if sector[0] not in (0xeb, 0xe9):
+        return False
+    bytes_per_sector, sectors_per_cluster = struct.unpack_from("<HB", sector, 11)
+    if bytes_per_sector not in (512, 1024, 2048, 4096):
+        return False
+    if sectors_per_cluster == 0 or sectors_per_cluster & (sectors_per_cluster - 1):
+        return False
+    return sector[16] in (1, 2)
+
+def find_fat_partition(read: ReadAt) -> Optional[Dict]:
+    """The first FAT partition of an image (e.g. the boot partition)
+
+    An unpartitioned image holding a single FAT filesystem is returned
+    as a partition at offset 0.
+    """
+    partitions = read_partitions(read)
+    if not partitions and is_fat_boot_sector(read(0, SECTOR_SIZE)):
+        return {'scheme': 'none', 'type': None, 'offset': 0, 'size': None}
+    for partition in partitions:
+        fat_type = partition['type'] in (GPT_FAT_TYPES if partition['scheme'] == 'gpt' else MBR_FAT_TYPES)
+        if fat_type and is_fat_boot_sector(read(partition['offset'], SECTOR_SIZE)):
+            return partition
+    return None
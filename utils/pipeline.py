@@ -0,0 +1,203 @@
+import hashlib
+import itertools
+import logging
+import queue
+import threading
+from typing import Callable, Iterable, Optional
+from utils.decompress import decompressed_chunks, detect_compression
+from utils.raw_writer import RawWriter
+
+# Sentinel that marks the end of the stream between stages
+_END = object()
+
+class StreamingPipeline:
+    """Download -> hash -> decompress -> device-write pipeline over bounded queues
+
+    Each stage runs in its own thread and hands chunks to the next one
+    through a bounded queue, so a slow card throttles the download instead
+    of buffering the image in memory or in temp/. The first
+    ``header_size`` bytes (partition table and boot sectors) are held back
+    and only committed to the device once the SHA-256 of the whole stream
+    matches, so a corrupt download never leaves a bootable card behind.
+
+    Compressed images (.gz/.xz/.zst) are detected from their first bytes
+    and decompressed on the fly; the expected checksum may then match
+    either the compressed or the decompressed stream.
+    """
+
+    def __init__(self, chunks: Iterable[bytes], target: str, expected_checksum: str,
+                 queue_depth: int = 8, header_size: int = 1024 * 1024,
+                 progress: Optional[Callable[[int], None]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.chunks = chunks
+        self.target = target
+        self.expected_checksum = expected_checksum.strip().lower()
+        self.header_size = header_size
+        self.progress = progress
+        self.hash_queue = queue.Queue(maxsize=queue_depth)
+        self.decompress_queue = queue.Queue(maxsize=queue_depth)
+        self.write_queue = queue.Queue(maxsize=queue_depth)
+        self.abort = threading.Event()
+        self.actual_checksum: Optional[str] = None
+        self.decompressed_checksum: Optional[str] = None
+        self.compression: Optional[str] = None
+        self.bytes_written = 0
+        self.error: Optional[Exception] = None
+        self._header = bytearray()
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        """Put an item on a queue, giving up if the pipeline was aborted"""
+        while not self.abort.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        """Get an item from a queue, returning the end sentinel on abort"""
+        while not self.abort.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _fail(self, error: Exception):
+        """Record the first error and stop all stages"""
+        if self.error is None:
+            self.error = error
+        self.abort.set()
+
+    def _download_stage(self):
+        try:
+            for chunk in self.chunks:
+                if not chunk:
+                    continue
+                if not self._put(self.hash_queue, chunk):
+                    return
+            self._put(self.hash_queue, _END)
+        except Exception as e:
+            self._fail(e)
+
+    def _hash_stage(self):
+        try:
+            sha256_hash = hashlib.sha256()
+            while True:
+                chunk = self._get(self.hash_queue)
+                if chunk is _END:
+                    break
+                sha256_hash.update(chunk)
+                if not self._put(self.decompress_queue, chunk):
+                    return
+            if not self.abort.is_set():
+                self.actual_checksum = sha256_hash.hexdigest()
+                self._put(self.decompress_queue, _END)
+        except Exception as e:
+            self._fail(e)
+
+    def _queued_chunks(self, q: queue.Queue):
+        """Iterate over the chunks on a queue up to the end sentinel"""
+        while True:
+            chunk = self._get(q)
+            if chunk is _END:
+                return
+            yield chunk
+
+    def _decompress_stage(self):
+        try:
+            chunks = self._queued_chunks(self.decompress_queue)
+            first = next(chunks, b"")
+            self.compression = detect_compression(first)
+            chunks = itertools.chain([first], chunks)
+            if self.compression is None:
+                for chunk in chunks:
+                    if not self._put(self.write_queue, chunk):
+                        return
+            else:
+                sha256_hash = hashlib.sha256()
+                for chunk in decompressed_chunks(chunks, self.compression):
+                    sha256_hash.update(chunk)
+                    if not self._put(self.write_queue, chunk):
+                        return
+                self.decompressed_checksum = sha256_hash.hexdigest()
+            if not self.abort.is_set():
+                self._put(self.write_queue, _END)
+        except Exception as e:
+            self._fail(e)
+
+    def _write_stage(self, writer: RawWriter):
+        try:
+            offset = 0
+            while True:
+                chunk = self._get(self.write_queue)
+                if chunk is _END:
+                    break
+                # Keep the header in memory until the checksum is known
+                if offset < self.header_size:
+                    held = chunk[:self.header_size - offset]
+                    self._header.extend(held)
+                    offset += len(held)
+                    self.bytes_written = offset
+                    chunk = chunk[len(held):]
+                    if not chunk:
+                        continue
+                writer.write_at(offset, chunk)
+                offset += len(chunk)
+                self.bytes_written = offset
+                if self.progress:
+                    self.progress(offset)
+        except Exception as e:
+            self._fail(e)
+
+    def _commit(self, writer: RawWriter):
+        """Write the held-back header and flush the device"""
+        writer.write_at(0, bytes(self._header))
+        writer.finish(self.bytes_written)
+
+    def run(self) -> bool:
+        """Run the pipeline; returns True once the image is committed"""
+        writer = RawWriter(self.target, readback=True)
+        try:
+            writer.open()
+        except Exception as e:
+            self.logger.error(f"Error opening {self.target}: {e}")
+            return False
+
+        try:
+            stages = [
+                threading.Thread(target=self._download_stage, name="pipeline-download", daemon=True),
+                threading.Thread(target=self._hash_stage, name="pipeline-hash", daemon=True),
+                threading.Thread(target=self._decompress_stage, name="pipeline-decompress", daemon=True),
+                threading.Thread(target=self._write_stage, args=(writer,), name="pipeline-write", daemon=True),
+            ]
+            for stage in stages:
+                stage.start()
+            for stage in stages:
+                stage.join()
+
+            if self.error is not None:
+                self.logger.error(f"Streaming install failed: {self.error}")
+                return False
+
+            if self.expected_checksum not in (self.actual_checksum, self.decompressed_checksum):
+                self.logger.error(
+                    f"Checksum mismatch: expected {self.expected_checksum}, "
+                    f"got {self.actual_checksum}; image not committed"
+                )
+                return False
+
+            self._commit(writer)
+            report = writer.readback_report
+            if report and not report['ok']:
+                self.logger.error(f"Read-back mismatch at offsets {report['mismatches'][:10]}")
+                return False
+            self.logger.info(f"Streamed {self.bytes_written} bytes to {self.target}")
+            return True
+
+        except Exception as e:
+            self.logger.error(f"Error running streaming pipeline: {e}")
+            return False
+        finally:
+            writer.close()
@@ -0,0 +1,242 @@
+import bisect
+import copy
+import hashlib
+import logging
+import os
+import pickle
+import re
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Bundled profiles; PyInstaller unpacks data files below sys._MEIPASS
+CATALOG_DIR = Path(getattr(sys, '_MEIPASS', Path(__file__).resolve().parent.parent)) / "resources" / "printers"
+INDEX_PATH = Path("cache") / "printer_profiles.idx"
+INDEX_VERSION = 1
+
+_WORD = re.compile(r"[0-9a-z]+")
+
+class CatalogError(Exception):
+    """A printer profile is malformed or inherits from an unknown profile"""
+
+def _merge(base: Dict, override: Dict) -> Dict:
+    """Recursively merge ``override`` into a copy of ``base``"""
+    merged = copy.deepcopy(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+def _profile_files(directory: Path) -> List[Path]:
+    return sorted(path for path in directory.rglob("*") if path.suffix in ('.yaml', '.yml'))
+
+def _signature(directory: Path, files: List[Path]) -> str:
+    """Fingerprint of the profile files: their paths, sizes and mtimes"""
+    digest = hashlib.sha256(f"{INDEX_VERSION}\n".encode())
+    for path in files:
+        info = path.stat()
+        digest.update(f"{path.relative_to(directory).as_posix()}\0{info.st_size}\0{info.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+def _read_profiles(directory: Path, files: List[Path]) -> Dict[str, Dict]:
+    """Parse the profile files; a file holds one profile or a list of them"""
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    raw = {}
+    for path in files:
+        with open(path, 'r', encoding='utf-8') as f:
+            documents = yaml.load(f, Loader=loader)
+        if documents is None:
+            continue
+        for profile in documents if isinstance(documents, list) else [documents]:
+            source = path.relative_to(directory).as_posix()
+            if not isinstance(profile, dict) or not profile.get('name'):
+                raise CatalogError(f"{source}: every profile needs a 'name'")
+            name = str(profile['name'])
+            if name in raw:
+                raise CatalogError(f"{source}: profile '{name}' is already defined in {raw[name]['source']}")
+            raw[name] = {**profile, 'name': name, 'source': source}
+    return raw
+
+def _resolve(raw: Dict[str, Dict]) -> Dict[str, Dict]:
+    """Apply inheritance (base model -> variant) to every profile"""
+    resolved: Dict[str, Dict] = {}
+
+    def resolve(name: str, chain: tuple) -> Dict:
+        if name in resolved:
+            return resolved[name]
+        if name in chain:
+            raise CatalogError(f"Inheritance cycle: {' -> '.join(chain + (name,))}")
+        profile = raw[name]
+        parent_name = profile.get('inherits')
+        settings = profile.get('settings') or {}
+        if parent_name:
+            if parent_name not in raw:
+                raise CatalogError(f"{profile['source']}: '{name}' inherits unknown profile '{parent_name}'")
+            parent = resolve(parent_name, chain + (name,))
+            settings = _merge(parent['settings'], settings)
+            vendor = profile.get('vendor', parent['vendor'])
+        else:
+            vendor = profile.get('vendor')
+        resolved[name] = {
+            'name': name,
+            'vendor': vendor,
+            'inherits': parent_name,
+            'hidden': bool(profile.get('hidden', False)),
+            'settings': settings,
+            'source': profile['source']
+        }
+        return resolved[name]
+
+    for name in raw:
+        resolve(name, ())
+    return resolved
+
+class PrinterCatalog:
+    """Printer profiles loaded from a directory of YAML files
+
+    Each profile has a ``name``, optionally a ``vendor``, the ``settings``
+    written to printer.yaml and ``inherits``, the name of the profile it
+    extends; its settings are merged over the parent's. ``hidden``
+    profiles (shared bases) can be inherited from but are not listed.
+
+    Inheritance is resolved once and the result, together with the sorted
+    search keys, is pickled to an index next to the image cache. The index
+    is rebuilt when any profile file is added, removed or changed (by
+    size or mtime), so a normal start only stats the files and unpickles.
+    """
+
+    def __init__(self, profiles: Dict[str, Dict]):
+        self.logger = logging.getLogger(__name__)
+        self._profiles = profiles
+        self._by_key = {name.casefold(): name for name in profiles}
+        self.names = sorted((name for name, profile in profiles.items() if not profile['hidden']),
+                            key=str.casefold)
+        self._keys = [name.casefold() for name in self.names]
+        self._name_words = {name: _WORD.findall(key) for name, key in zip(self.names, self._keys)}
+        # (word, name) pairs for prefix matches on any word of a name
+        self._words = sorted({(word, name) for name, words in self._name_words.items()
+                              for word in words})
+
+    @classmethod
+    def load(cls, directory: Path = CATALOG_DIR,
+             index_path: Optional[Path] = INDEX_PATH) -> 'PrinterCatalog':
+        """Load the catalog from its index, rebuilding the index if it is stale"""
+        logger = logging.getLogger(__name__)
+        directory = Path(directory)
+        files = _profile_files(directory)
+        signature = _signature(directory, files)
+        if index_path is not None and Path(index_path).exists():
+            try:
+                with open(index_path, 'rb') as f:
+                    index = pickle.load(f)
+                if index.get('version') == INDEX_VERSION and index.get('signature') == signature:
+                    catalog = cls.__new__(cls)
+                    catalog.__dict__.update(index['catalog'])
+                    catalog.logger = logger
+                    return catalog
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable printer profile index: {e}")
+
+        catalog = cls(_resolve(_read_profiles(directory, files)))
+        if index_path is not None:
+            catalog.save_index(Path(index_path), signature)
+        return catalog
+
+    def save_index(self, index_path: Path, signature: str):
+        state = {key: value for key, value in self.__dict__.items() if key != 'logger'}
+        try:
+            index_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = index_path.with_name(index_path.name + ".tmp")
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'version': INDEX_VERSION, 'signature': signature, 'catalog': state},
+                            f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            self.logger.warning(f"Could not write printer profile index: {e}")
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name.casefold() in self._by_key
+
+    def get(self, name: str) -> Optional[Dict]:
+        """The resolved profile of a model (case-insensitive), or None"""
+        key = self._by_key.get(name.casefold())
+        return self._profiles[key] if key is not None else None
+
+    def settings(self, name: str) -> Dict:
+        """The printer settings of a model; empty for unknown models"""
+        profile = self.get(name)
+        return copy.deepcopy(profile['settings']) if profile else {}
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[str]:
+        """Model names matching ``query``, best matches first
+
+        Names starting with the query come first, then names in which
+        every query word starts a word (``mk3`` finds "Prusa i3 MK3S+"),
+        then names containing the query's letters in order (``endr3``).
+        """
+        query = query.strip().casefold()
+        if not query:
+            return self.names[:limit]
+        results = []
+        seen = set()
+
+        def add(name: str):
+            if name not in seen:
+                seen.add(name)
+                results.append(name)
+
+        def full() -> bool:
+            return limit is not None and len(results) >= limit
+
+        index = bisect.bisect_left(self._keys, query)
+        while index < len(self._keys) and self._keys[index].startswith(query) and not full():
+            add(self.names[index])
+            index += 1
+
+        tokens = _WORD.findall(query)
+        if tokens:
+            first = tokens[0]
+            index = bisect.bisect_left(self._words, (first,))
+            candidates = []
+            while index < len(self._words) and self._words[index][0].startswith(first):
+                candidates.append(self._words[index][1])
+                index += 1
+            for name in sorted(set(candidates), key=str.casefold):
+                if full():
+                    break
+                words = self._name_words[name]
+                if all(any(word.startswith(token) for word in words) for token in tokens[1:]):
+                    add(name)
+        if full():
+            return results
+
+        letters = "".join(tokens)
+        fuzzy = []
+        for name, key in zip(self.names, self._keys):
+            if name in seen:
+                continue
+            start = position = key.find(letters[0]) if letters else -1
+            for char in letters[1:]:
+                if position < 0:
+                    break
+                position = key.find(char, position + 1)
+            if position >= 0:
+                # Tighter matches rank higher
+                fuzzy.append((position - start, name))
+        for _, name in sorted(fuzzy):
+            add(name)
+        return results[:limit]
+
+if __name__ == "__main__":
+    # python -m utils.printer_catalog [query]
+    logging.basicConfig(level=logging.INFO)
+    catalog = PrinterCatalog.load()
+    query = " ".join(sys.argv[1:])
+    for name in catalog.search(query) if query else catalog.names:
+        print(f"{name}: {catalog.settings(name)}")
@@ -0,0 +1,125 @@
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from email.utils import formatdate
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Static file handler with single-range, ETag and keep-alive support"""
+
+    protocol_version = "HTTP/1.1"
+    # Optional per-connection bandwidth cap in bytes/s (mimics a CDN edge)
+    rate_limit: Optional[int] = None
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format % args)
+
+    def _etag(self, fs: os.stat_result) -> str:
+        return f'"{int(fs.st_mtime)}-{fs.st_size}"'
+
+    def send_head(self):
+        self._range = None
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            return super().send_head()
+
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(404, "File not found")
+            return None
+
+        try:
+            fs = os.fstat(f.fileno())
+            size = fs.st_size
+            etag = self._etag(fs)
+            last_modified = formatdate(fs.st_mtime, usegmt=True)
+
+            if self.headers.get('If-None-Match') == etag or (
+                    'If-None-Match' not in self.headers
+                    and self.headers.get('If-Modified-Since') == last_modified):
+                f.close()
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+
+            start, end = 0, size - 1
+            range_header = self.headers.get('Range')
+            match = re.fullmatch(r'bytes=(\d*)-(\d*)', range_header or '')
+            if match and (match.group(1) or match.group(2)):
+                if match.group(1):
+                    start = int(match.group(1))
+                    if match.group(2):
+                        end = min(int(match.group(2)), size - 1)
+                else:
+                    # Suffix range: the last N bytes
+                    start = max(size - int(match.group(2)), 0)
+                if start >= size or start > end:
+                    f.close()
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return None
+                self._range = (start, end)
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            else:
+                self.send_response(200)
+
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            self.end_headers()
+            f.seek(start)
+            self._remaining = end - start + 1
+            return f
+        except Exception:
+            f.close()
+            raise
+
+    def copyfile(self, source, outputfile):
+        if self.rate_limit is None and self._range is None:
+            shutil.copyfileobj(source, outputfile)
+            return
+
+        remaining = self._remaining
+        chunk_size = 64 * 1024
+        started = time.monotonic()
+        sent = 0
+        while remaining > 0:
+            chunk = source.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            remaining -= len(chunk)
+            sent += len(chunk)
+            if self.rate_limit:
+                # Sleep until the connection is back under its budget
+                delay = sent / self.rate_limit - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+def serve_directory(directory: str, host: str = "127.0.0.1", port: int = 0,
+                    rate_limit: Optional[int] = None) -> ThreadingHTTPServer:
+    """Serve a directory with range support on a background thread
+
+    The returned server exposes the bound port as ``server.server_port``;
+    call ``server.shutdown()`` to stop it.
+    """
+    handler = type("RangeRequestHandler", (RangeRequestHandler,), {"rate_limit": rate_limit})
+    server = ThreadingHTTPServer((host, port), partial(handler, directory=directory))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="range-server", daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,454 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import stat
+import struct
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO, Callable, Dict, Iterable, Optional
+from utils.decompress import decompressed_chunks, detect_compression, file_chunks
+from utils.io_engine import AlignedBufferPool, IOEngine, kernel_copy
+from utils.readback import ReadbackVerifier
+
+if TYPE_CHECKING:
+    from utils.overlay import PatchSet
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Linux block device ioctl: zero a byte range, letting the device use
+# WRITE ZEROES/UNMAP where it can (_IO(0x12, 127))
+BLKZEROOUT = 0x127f
+# fallocate(2) flags for punching holes into file-backed targets
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+SECTOR_SIZE = 512
+
+def open_target(path: str) -> int:
+    """Open a raw device (or image file) for writing"""
+    flags = os.O_WRONLY | getattr(os, 'O_BINARY', 0)
+    if os.name != 'nt':
+        # Allow plain files as targets (image files, loop device backing)
+        flags |= os.O_CREAT
+    return os.open(path, flags, 0o644)
+
+class RawWriter:
+    """In-process raw image writer that avoids writing all-zero blocks
+
+    Data is examined in ``zero_granularity`` pieces. All-zero runs are
+    coalesced and, depending on ``zero_mode``, handled without writing
+    them:
+
+    - ``auto``: zero the range with BLKZEROOUT on Linux block devices or
+      punch a hole into file-backed targets; ranges past the end of a file
+      are skipped. Falls back to writing zeros where unsupported.
+    - ``skip``: leave the range untouched; only correct when the caller
+      knows the target already reads back as zeros.
+    - ``write``: always write every byte (what ``dd`` did).
+
+    ``finish()`` flushes pending zero ranges, sizes file targets and
+    fsyncs, so the target matches the image byte for byte afterwards.
+
+    With ``readback=True`` every chunk is re-read from the device by a
+    ReadbackVerifier while later chunks are still being written; the
+    result is kept in ``readback_report``.
+
+    With ``queue_depth`` above 1 writes are issued by an IOEngine, so up
+    to that many are outstanding on the device while the next chunk is
+    read. Uncompressed image files are read into a pool of page-aligned
+    buffers that are reused instead of allocating a chunk per read, and
+    with ``kernel_copy`` they are copied in the kernel (copy_file_range or
+    sendfile) when nothing needs to look at the data on the way.
+
+    ``checkpoint`` is called about every ``checkpoint_interval`` bytes
+    with an offset up to which the target durably holds the image (and,
+    with read-back, has been verified). A write interrupted after a
+    checkpoint can be continued from there with ``start``.
+    """
+
+    def __init__(self, target: str, block_size: int = 4 * 1024 * 1024,
+                 zero_mode: str = 'auto', zero_granularity: int = 64 * 1024,
+                 readback: bool = False, queue_depth: int = 1, kernel_copy: bool = True,
+                 checkpoint: Optional[Callable[[int], None]] = None,
+                 checkpoint_interval: int = 256 * 1024 * 1024):
+        if zero_mode not in ('auto', 'skip', 'write'):
+            raise ValueError(f"Unknown zero mode: {zero_mode}")
+        self.logger = logging.getLogger(__name__)
+        self.target = target
+        self.block_size = block_size
+        self.zero_mode = zero_mode
+        self.zero_granularity = zero_granularity
+        self.fd: Optional[int] = None
+        self.is_block_device = False
+        self.is_file = False
+        self.initial_size = 0
+        self.image_size = 0
+        self.bytes_written = 0
+        self.bytes_zeroed = 0
+        self.bytes_skipped = 0
+        self._pending_zero: Optional[list] = None
+        self._can_zero = True
+        self._zero_piece = bytes(zero_granularity)
+        # Optional ReadbackVerifier that is handed every chunk once written
+        self.readback = readback
+        self.verifier: Optional[ReadbackVerifier] = None
+        self.readback_report: Optional[Dict] = None
+        # Overlapped writes; without os.pwrite seek and write must not interleave
+        self.queue_depth = max(1, queue_depth)
+        self.kernel_copy = kernel_copy
+        self.engine: Optional[IOEngine] = None
+        self._seek_lock = threading.Lock()
+        self._file_size = 0
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self._next_checkpoint: Optional[int] = None
+        self._checkpointed = 0
+
+    def open(self):
+        """Open the target for writing"""
+        self.fd = open_target(self.target)
+        mode = os.fstat(self.fd).st_mode
+        self.is_block_device = stat.S_ISBLK(mode)
+        self.is_file = stat.S_ISREG(mode)
+        if self.is_file:
+            self.initial_size = self._file_size = os.fstat(self.fd).st_size
+        if self.queue_depth > 1:
+            self.engine = IOEngine(self._pwrite, self.queue_depth)
+        if self.readback:
+            self.verifier = ReadbackVerifier(self.target)
+            self.verifier.start()
+
+    def close(self):
+        if self.engine is not None:
+            self.engine.close()
+            self.engine = None
+        if self.verifier is not None and self.readback_report is None:
+            self.readback_report = self.verifier.finish()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            'image_size': self.image_size,
+            'bytes_written': self.bytes_written,
+            'bytes_zeroed': self.bytes_zeroed,
+            'bytes_skipped': self.bytes_skipped
+        }
+
+    def _pwrite(self, offset: int, data) -> None:
+        """Write ``data`` at ``offset``; called from the IOEngine's threads"""
+        if os.name == 'nt' and len(data) % SECTOR_SIZE:
+            # Raw volumes only accept whole sectors
+            data = bytes(data) + bytes(SECTOR_SIZE - len(data) % SECTOR_SIZE)
+        view = memoryview(data)
+        if hasattr(os, 'pwrite'):
+            while view:
+                written = os.pwrite(self.fd, view, offset)
+                view = view[written:]
+                offset += written
+            return
+        with self._seek_lock:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            while view:
+                written = os.write(self.fd, view)
+                view = view[written:]
+
+    def _write(self, offset: int, data) -> None:
+        """Write now, or queue the write when overlapping I/O"""
+        self.bytes_written += len(data)
+        if self.engine is not None:
+            self.engine.submit(offset, data)
+        else:
+            self._pwrite(offset, data)
+
+    def _after_writes(self, callback: Callable[[], None]):
+        """Run ``callback`` once everything written so far is on the device"""
+        if self.engine is not None:
+            self.engine.after_pending(callback)
+        else:
+            callback()
+
+    def _punch_hole(self, offset: int, length: int) -> bool:
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            return False
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        libc.fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+        result = libc.fallocate(self.fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE,
+                                offset, length)
+        return result == 0
+
+    def _zero_out(self, offset: int, length: int) -> bool:
+        """Zero a range without writing it; returns False if unsupported"""
+        if fcntl is None or not self._can_zero:
+            return False
+        try:
+            if self.is_block_device:
+                fcntl.ioctl(self.fd, BLKZEROOUT, struct.pack('QQ', offset, length))
+                return True
+            if self.is_file:
+                return self._punch_hole(offset, length)
+        except OSError as e:
+            self.logger.info(f"Zeroing not supported by {self.target} ({e}), writing zeros")
+        return False
+
+    def _flush_zeros(self):
+        """Handle the pending run of zero bytes"""
+        if self._pending_zero is None:
+            return
+        offset, length = self._pending_zero
+        self._pending_zero = None
+
+        if self.zero_mode == 'skip':
+            self.bytes_skipped += length
+            return
+
+        if self.zero_mode == 'auto':
+            # Bytes past the original end of a file read back as zeros
+            if self.is_file and offset >= self.initial_size:
+                self.bytes_skipped += length
+                return
+            if self.is_file and offset + length > self.initial_size:
+                self.bytes_skipped += offset + length - self.initial_size
+                length = self.initial_size - offset
+            if self._zero_out(offset, length):
+                self.bytes_zeroed += length
+                return
+            self._can_zero = False
+
+        end = offset + length
+        while offset < end:
+            size = min(self.block_size, end - offset)
+            self._write(offset, bytes(size))
+            offset += size
+
+    def _mark_zero(self, offset: int, length: int):
+        if self._pending_zero and self._pending_zero[0] + self._pending_zero[1] == offset:
+            self._pending_zero[1] += length
+        else:
+            self._flush_zeros()
+            self._pending_zero = [offset, length]
+
+    def write_at(self, offset: int, data) -> None:
+        """Write a chunk of the image at the given offset"""
+        self.image_size = max(self.image_size, offset + len(data))
+        if self.verifier is not None and self.is_file and offset + len(data) > self._file_size:
+            # Zeros skipped at the end of a growing file must read back as
+            # zeros; extend it before any write into the range is queued
+            self._file_size = offset + len(data)
+            os.ftruncate(self.fd, self._file_size)
+        if self.zero_mode == 'write':
+            self._write(offset, data)
+            self._submit_readback(offset, data)
+            self._maybe_checkpoint(offset + len(data))
+            return
+
+        view = memoryview(data)
+        step = self.zero_granularity
+        run_start = None
+        for start in range(0, len(view), step):
+            piece = view[start:start + step]
+            # bytes comparison is a memcmp; comparing memoryviews is not
+            is_zero = piece.tobytes() == (self._zero_piece if len(piece) == step else bytes(len(piece)))
+            if is_zero:
+                if run_start is not None:
+                    self._flush_zeros()
+                    self._write(offset + run_start, view[run_start:start])
+                    run_start = None
+                self._mark_zero(offset + start, len(piece))
+            elif run_start is None:
+                run_start = start
+        if run_start is not None:
+            self._flush_zeros()
+            self._write(offset + run_start, view[run_start:])
+        self._submit_readback(offset, data)
+        self._maybe_checkpoint(offset + len(data))
+
+    def _maybe_checkpoint(self, offset: int):
+        """Report how far the image is durably on the target, every interval"""
+        if self.checkpoint is None:
+            return
+        if self._next_checkpoint is None:
+            self._next_checkpoint = offset + self.checkpoint_interval
+        if offset < self._next_checkpoint:
+            return
+        self._next_checkpoint = offset + self.checkpoint_interval
+        self._flush_zeros()
+        if self.engine is not None:
+            self.engine.drain()
+        os.fsync(self.fd)
+        if self.verifier is not None:
+            # Read-back trails the writes by a few chunks
+            offset = min(offset, self.verifier.verified_end)
+        if offset > self._checkpointed:
+            self._checkpointed = offset
+            self.checkpoint(offset)
+
+    def _submit_readback(self, offset: int, data):
+        """Hand a written chunk to the read-back verifier, if any"""
+        if self.verifier is None:
+            return
+        # The chunk's zero runs must be on the device before it is re-read
+        self._flush_zeros()
+        verifier = self.verifier
+        self._after_writes(lambda: verifier.submit_data(offset, data))
+
+    def finish(self, size: Optional[int] = None):
+        """Flush pending work so the target matches the image exactly"""
+        self._flush_zeros()
+        if self.engine is not None:
+            self.engine.drain()
+        size = self.image_size if size is None else size
+        if self.is_file and os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        os.fsync(self.fd)
+        if self.verifier is not None:
+            self.readback_report = self.verifier.finish()
+
+    def write_chunks(self, chunks: Iterable[bytes],
+                     progress: Optional[Callable[[int], None]] = None,
+                     start: int = 0) -> int:
+        """Write a sequence of image chunks; returns the image size
+
+        Data before ``start`` is already on the target and is skipped.
+        """
+        offset = 0
+        for chunk in chunks:
+            end = offset + len(chunk)
+            if end > start:
+                skip = max(0, start - offset)
+                self.write_at(offset + skip, memoryview(chunk)[skip:] if skip else chunk)
+            offset = end
+            if progress:
+                progress(offset)
+        self.finish(offset)
+        return offset
+
+    def write_stream(self, source: BinaryIO,
+                     progress: Optional[Callable[[int], None]] = None) -> int:
+        """Write everything read from ``source``; returns the image size"""
+        return self.write_chunks(iter(lambda: source.read(self.block_size), b""), progress)
+
+    def write_file(self, image_path: Path,
+                   progress: Optional[Callable[[int], None]] = None,
+                   patches: Optional['PatchSet'] = None, start: int = 0) -> bool:
+        """Write an image file to the target, decompressing .gz/.xz/.zst on the fly
+
+        ``patches`` are laid over the image data as it is written. With
+        ``start`` the write continues an earlier one from that offset.
+        """
+        try:
+            with open(image_path, 'rb') as f:
+                compression = detect_compression(f.read(8))
+            with self:
+                if compression is not None:
+                    chunks = decompressed_chunks(file_chunks(image_path, self.block_size), compression)
+                    if patches:
+                        chunks = patches.patch_chunks(chunks)
+                    self.write_chunks(chunks, progress, start)
+                elif not (self.kernel_copy and not patches and self._copy_file(image_path, progress, start)):
+                    self._write_aligned(image_path, progress, patches, start)
+            report = self.readback_report
+            if report and not report['ok']:
+                raise Exception(
+                    f"Read-back verification failed: {report['error'] or report['mismatches'][:10]}"
+                )
+            self.logger.info(
+                f"Wrote {self.image_size} byte image to {self.target}: "
+                f"{self.bytes_written} written, {self.bytes_zeroed} zeroed, "
+                f"{self.bytes_skipped} skipped"
+            )
+            return True
+        except Exception as e:
+            self.logger.error(f"Error writing {image_path} to {self.target}: {e}")
+            return False
+
+    def _write_aligned(self, image_path: Path, progress: Optional[Callable[[int], None]] = None,
+                       patches: Optional['PatchSet'] = None, start: int = 0) -> int:
+        """Write an uncompressed image through reusable page-aligned buffers"""
+        # One buffer per outstanding write plus the one being filled
+        pool = AlignedBufferPool(self.queue_depth + 1, self.block_size)
+        offset = start
+        with open(image_path, 'rb', buffering=0) as f:
+            f.seek(start)
+            while True:
+                buffer = pool.acquire()
+                length = f.readinto(memoryview(buffer)[:self.block_size])
+                if not length:
+                    break
+                chunk = memoryview(buffer)[:length]
+                self.write_at(offset, patches.apply(offset, chunk) if patches else chunk)
+                self._after_writes(lambda buffer=buffer: pool.release(buffer))
+                offset += length
+                if progress:
+                    progress(offset)
+        self.finish(offset)
+        return offset
+
+    def _copy_file(self, image_path: Path,
+                   progress: Optional[Callable[[int], None]] = None, start: int = 0) -> bool:
+        """Copy an uncompressed image in the kernel; False if that is not possible
+
+        Only used when every byte is written as is and nothing is read
+        back, since zero detection and read-back need the data in memory.
+        """
+        if self.zero_mode != 'write' or self.verifier is not None:
+            return False
+        offset = start
+        with open(image_path, 'rb') as f:
+            src_fd = f.fileno()
+            while True:
+                try:
+                    copied = kernel_copy(src_fd, self.fd, offset, offset, self.block_size)
+                except OSError:
+                    if offset > start:
+                        raise
+                    self.logger.info(f"No in-kernel copy to {self.target}, using buffered writes")
+                    return False
+                if not copied:
+                    break
+                offset += copied
+                self.bytes_written += copied
+                self._maybe_checkpoint(offset)
+                if progress:
+                    progress(offset)
+        self.image_size = offset
+        self.finish(offset)
+        return True
+
+if __name__ == "__main__":
+    # Write a mostly-empty test image to a file-backed target, or to a
+    # device such as a loop device: python -m utils.raw_writer /dev/loop0
+    import sys
+    import tempfile
+    import time
+
+    logging.basicConfig(level=logging.INFO)
+    workdir = Path(tempfile.mkdtemp())
+    image = workdir / "system.img"
+    with open(image, 'wb') as f:
+        for i in range(64):
+            block = os.urandom(1024 * 1024) if i % 8 == 0 else bytes(1024 * 1024)
+            f.write(block)
+
+    target = sys.argv[1] if len(sys.argv) > 1 else str(workdir / "target.img")
+    started = time.monotonic()
+    writer = RawWriter(target)
+    ok = writer.write_file(image)
+    elapsed = time.monotonic() - started
+    with open(image, 'rb') as a, open(target, 'rb') as b:
+        identical = a.read() == b.read(image.stat().st_size)
+    print(f"ok={ok} identical={identical} {writer.stats} in {elapsed:.2f}s")
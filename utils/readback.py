@@ -0,0 +1,165 @@
+import hashlib
+import logging
+import mmap
+import os
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+# Direct I/O needs buffers, offsets and lengths aligned to the logical
+# block size; 4 KiB covers 512e and 4Kn devices
+ALIGNMENT = 4096
+
+class ReadbackVerifier:
+    """Verify written chunks by reading them back from the device
+
+    Chunks are submitted as they are written, either with their data or
+    with an expected SHA-256, and checked on a background thread that
+    stays ``lag`` chunks behind the writer, so chunk N is verified while
+    chunk N+lag is still being written. Reads bypass the page cache with
+    O_DIRECT where the target supports it, otherwise the range is flushed
+    and dropped from the cache (POSIX_FADV_DONTNEED) before it is read.
+    """
+
+    def __init__(self, target: str, lag: int = 4, max_pending: int = 16):
+        self.logger = logging.getLogger(__name__)
+        self.target = target
+        self.lag = lag
+        self.max_pending = max(max_pending, lag + 1)
+        self.direct = False
+        self.bytes_verified = 0
+        # End of the last chunk verified while no mismatch had been found
+        self.verified_end = 0
+        self.mismatches: List[int] = []
+        self.error: Optional[str] = None
+        self._pending = deque()
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._fd: Optional[int] = None
+        self._buffer: Optional[mmap.mmap] = None
+
+    def _open(self):
+        flags = os.O_RDONLY | getattr(os, 'O_BINARY', 0)
+        if hasattr(os, 'O_DIRECT'):
+            try:
+                self._fd = os.open(self.target, flags | os.O_DIRECT)
+                # Some filesystems (tmpfs) accept the flag but fail reads
+                os.preadv(self._fd, [mmap.mmap(-1, ALIGNMENT)], 0)
+                self.direct = True
+                return
+            except OSError:
+                if self._fd is not None:
+                    os.close(self._fd)
+                    self._fd = None
+        self._fd = os.open(self.target, flags)
+
+    def start(self):
+        """Start the background verification thread"""
+        self._open()
+        self._thread = threading.Thread(target=self._run, name="readback-verify", daemon=True)
+        self._thread.start()
+
+    def submit(self, offset: int, length: int, expected_sha256: str):
+        """Queue a written range with its expected SHA-256"""
+        self._submit((offset, length, expected_sha256, None))
+
+    def submit_data(self, offset: int, data):
+        """Queue a written range with the data that was written"""
+        self._submit((offset, len(data), None, bytes(data)))
+
+    def _submit(self, item):
+        with self._condition:
+            # Backpressure: never hold more than max_pending chunks
+            while len(self._pending) >= self.max_pending and self.error is None:
+                self._condition.wait()
+            if self.error is not None:
+                return
+            self._pending.append(item)
+            self._condition.notify_all()
+
+    def _next(self):
+        with self._condition:
+            while len(self._pending) <= self.lag and not self._closed:
+                self._condition.wait()
+            if not self._pending:
+                return None
+            item = self._pending.popleft()
+            self._condition.notify_all()
+            return item
+
+    def _read(self, offset: int, length: int) -> bytes:
+        if not self.direct:
+            if hasattr(os, 'posix_fadvise'):
+                # Write back dirty pages so they can be dropped and re-read
+                os.fdatasync(self._fd)
+                os.posix_fadvise(self._fd, offset, length, os.POSIX_FADV_DONTNEED)
+            os.lseek(self._fd, offset, os.SEEK_SET)
+            chunks = []
+            remaining = length
+            while remaining:
+                data = os.read(self._fd, remaining)
+                if not data:
+                    break
+                chunks.append(data)
+                remaining -= len(data)
+            return b"".join(chunks)
+
+        start = offset - offset % ALIGNMENT
+        end = -(-(offset + length) // ALIGNMENT) * ALIGNMENT
+        if self._buffer is None or len(self._buffer) < end - start:
+            self._buffer = mmap.mmap(-1, end - start)
+        view = memoryview(self._buffer)[:end - start]
+        read = os.preadv(self._fd, [view], start)
+        skip = offset - start
+        return bytes(view[skip:min(read, skip + length)])
+
+    def _run(self):
+        try:
+            while True:
+                item = self._next()
+                if item is None:
+                    break
+                offset, length, expected, data = item
+                if expected is None:
+                    expected = hashlib.sha256(data).hexdigest()
+                actual = hashlib.sha256(self._read(offset, length)).hexdigest()
+                if actual != expected:
+                    self.logger.error(f"Read-back mismatch at offset {offset} ({length} bytes)")
+                    self.mismatches.append(offset)
+                elif not self.mismatches:
+                    self.verified_end = max(self.verified_end, offset + length)
+                self.bytes_verified += length
+        except Exception as e:
+            self.error = str(e)
+            self.logger.error(f"Read-back verification failed: {e}")
+            with self._condition:
+                self._pending.clear()
+                self._condition.notify_all()
+
+    def read(self, offset: int, length: int) -> bytes:
+        """Read a range from the device past the page cache, outside of verification"""
+        if self._fd is None:
+            self._open()
+        return self._read(offset, length)
+
+    def finish(self) -> Dict:
+        """Verify the remaining chunks and return the report"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        return self.report()
+
+    def report(self) -> Dict:
+        return {
+            'ok': self.error is None and not self.mismatches,
+            'bytes_verified': self.bytes_verified,
+            'mismatches': sorted(self.mismatches),
+            'direct_io': self.direct,
+            'error': self.error
+        }
@@ -0,0 +1,177 @@
+import logging
+import queue
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional
+
+from utils.decompress import decompressed_chunks, detect_compression, file_chunks
+from utils.raw_writer import RawWriter
+
+if TYPE_CHECKING:
+    from utils.overlay import PatchSet
+
+# Sentinel that marks the end of the stream for a device
+_END = object()
+
+class DeviceJob:
+    """State of one target device in a station run"""
+
+    def __init__(self, target: str, queue_depth: int, block_size: int, verify: bool,
+                 patches: Optional['PatchSet'] = None):
+        self.target = target
+        # Laid over the shared stream for this device only
+        self.patches = patches
+        self.queue = queue.Queue(maxsize=queue_depth)
+        self.writer = RawWriter(target, block_size=block_size, readback=verify)
+        self.thread: Optional[threading.Thread] = None
+        self.bytes_written = 0
+        self.failed = threading.Event()
+        self.error: Optional[str] = None
+        self.verified: Optional[bool] = None
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed.is_set() and self.verified is not False
+
+    def result(self) -> Dict:
+        return {
+            'ok': self.ok,
+            'bytes_written': self.bytes_written,
+            'verified': self.verified,
+            'error': self.error,
+            'mismatches': (self.writer.readback_report or {}).get('mismatches', []),
+            'stats': self.writer.stats
+        }
+
+class FlashStation:
+    """Flash one source stream onto several devices at the same time
+
+    The source is read (and decompressed) once and every chunk is fanned
+    out to a bounded queue per device, each drained by its own writer
+    thread. Each device can have its own patches (its configuration)
+    laid over the shared stream. A device that fails is dropped from the fan-out without
+    affecting the others, and every device is verified independently by
+    reading its chunks back while later chunks are still being written.
+    """
+
+    def __init__(self, targets: List[str], queue_depth: int = 16,
+                 block_size: int = 4 * 1024 * 1024, verify: bool = True,
+                 progress: Optional[Callable[[str, int], None]] = None,
+                 patches: Optional[Dict[str, 'PatchSet']] = None):
+        self.logger = logging.getLogger(__name__)
+        patches = patches or {}
+        self.jobs = [DeviceJob(target, queue_depth, block_size, verify, patches.get(target))
+                     for target in targets]
+        self.block_size = block_size
+        self.verify = verify
+        self.progress = progress
+        self.image_size = 0
+
+    def _fail(self, job: DeviceJob, error: Exception):
+        self.logger.error(f"Flashing {job.target} failed: {error}")
+        job.error = str(error)
+        job.failed.set()
+
+    def _write_device(self, job: DeviceJob):
+        try:
+            job.writer.open()
+            try:
+                while True:
+                    item = job.queue.get()
+                    if item is _END:
+                        break
+                    offset, chunk = item
+                    if job.patches:
+                        chunk = job.patches.apply(offset, chunk)
+                    job.writer.write_at(offset, chunk)
+                    job.bytes_written = offset + len(chunk)
+                    if self.progress:
+                        self.progress(job.target, job.bytes_written)
+                if job.patches:
+                    for offset, data in job.patches.outside([(0, self.image_size)]):
+                        job.writer.write_at(offset, data)
+                job.writer.finish(self.image_size)
+            finally:
+                job.writer.close()
+            report = job.writer.readback_report
+            if report is not None:
+                job.verified = report['ok']
+                if not report['ok']:
+                    raise Exception(
+                        f"Read-back verification failed: {report['error'] or report['mismatches'][:10]}"
+                    )
+        except Exception as e:
+            self._fail(job, e)
+
+    def _put(self, job: DeviceJob, item) -> bool:
+        """Queue an item for a device unless it has failed meanwhile"""
+        while not job.failed.is_set():
+            try:
+                job.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def flash(self, chunks: Iterable[bytes]) -> Dict[str, Dict]:
+        """Write a chunk stream to all devices; returns a result per device"""
+        for job in self.jobs:
+            job.thread = threading.Thread(
+                target=self._write_device, args=(job,),
+                name=f"station-write-{job.target}", daemon=True
+            )
+            job.thread.start()
+
+        offset = 0
+        try:
+            for chunk in chunks:
+                live = [job for job in self.jobs if not job.failed.is_set()]
+                if not live:
+                    raise Exception("All devices failed")
+                for job in live:
+                    self._put(job, (offset, chunk))
+                offset += len(chunk)
+            self.image_size = offset
+        except Exception as e:
+            for job in self.jobs:
+                if not job.failed.is_set():
+                    self._fail(job, e)
+        finally:
+            for job in self.jobs:
+                self._put(job, _END)
+            for job in self.jobs:
+                job.thread.join()
+
+        return {job.target: job.result() for job in self.jobs}
+
+    def flash_file(self, image_path: Path) -> Dict[str, Dict]:
+        """Flash an image file (optionally .gz/.xz/.zst compressed)"""
+        with open(image_path, 'rb') as f:
+            compression = detect_compression(f.read(8))
+        return self.flash(decompressed_chunks(file_chunks(image_path, self.block_size), compression))
+
+if __name__ == "__main__":
+    # Flash a test image onto several file-backed (or given loop) devices:
+    # python -m utils.station [/dev/loop0 /dev/loop1 ...]
+    import os
+    import shutil
+    import sys
+    import tempfile
+    import time
+
+    logging.basicConfig(level=logging.INFO)
+    workdir = Path(tempfile.mkdtemp())
+    try:
+        image = workdir / "system.img"
+        image.write_bytes(os.urandom(64 * 1024 * 1024))
+        targets = sys.argv[1:] or [str(workdir / f"card{i}.img") for i in range(4)]
+        started = time.monotonic()
+        results = FlashStation(targets).flash_file(image)
+        elapsed = time.monotonic() - started
+        for target, result in results.items():
+            print(f"{target}: ok={result['ok']} verified={result['verified']} "
+                  f"written={result['stats']['bytes_written']}")
+        print(f"{len(targets)} devices in {elapsed:.2f}s "
+              f"({64 * len(targets) / elapsed:.1f} MB/s aggregate)")
+    finally:
+        shutil.rmtree(workdir)
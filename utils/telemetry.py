@@ -0,0 +1,243 @@
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from utils.logger import current_context
+
+class StageTracker:
+    """Byte progress, throughput and ETA of one installer stage"""
+
+    # Instantaneous rate is measured over this many seconds of samples
+    RATE_WINDOW = 2.0
+
+    def __init__(self, telemetry: 'Telemetry', name: str, total_bytes: Optional[int] = None):
+        self.telemetry = telemetry
+        self.name = name
+        self.total_bytes = total_bytes
+        self.bytes_done = 0
+        self.started = time.monotonic()
+        self.wall_started = time.time()
+        self.ended: Optional[float] = None
+        self.thread = threading.current_thread().name
+        # install_id and device of the thread that started the stage
+        self.context = current_context()
+        self.cpu_started = time.process_time()
+        self.cpu_time = 0.0
+        self.ok = True
+        self.details: Dict = {}
+        self._samples = deque([(self.started, 0)])
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self) -> float:
+        return (self.ended or time.monotonic()) - self.started
+
+    def set_total(self, total_bytes: Optional[int]):
+        self.total_bytes = total_bytes
+
+    def update(self, bytes_done: int):
+        """Report the total number of bytes processed so far"""
+        with self._lock:
+            now = time.monotonic()
+            self.bytes_done = bytes_done
+            self._samples.append((now, bytes_done))
+            while len(self._samples) > 2 and now - self._samples[0][0] > self.RATE_WINDOW:
+                self._samples.popleft()
+            event = self._event(now)
+        self.telemetry._notify(event)
+
+    def advance(self, count: int):
+        """Report that ``count`` more bytes were processed"""
+        self.update(self.bytes_done + count)
+
+    def _event(self, now: float) -> Dict:
+        elapsed = now - self.started
+        first_time, first_bytes = self._samples[0]
+        window = now - first_time
+        rate = (self.bytes_done - first_bytes) / window if window > 0 else 0.0
+        avg_rate = self.bytes_done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.total_bytes and rate > 0:
+            eta = max(self.total_bytes - self.bytes_done, 0) / rate
+        return {
+            'stage': self.name,
+            'bytes_done': self.bytes_done,
+            'bytes_total': self.total_bytes,
+            'rate': rate,
+            'avg_rate': avg_rate,
+            'eta': eta,
+            'elapsed': elapsed,
+            'done': self.ended is not None
+        }
+
+    def summary(self) -> Dict:
+        elapsed = self.elapsed
+        return {
+            'stage': self.name,
+            'ok': self.ok,
+            'duration': elapsed,
+            'cpu_time': self.cpu_time,
+            'bytes': self.bytes_done,
+            'avg_rate': self.bytes_done / elapsed if elapsed > 0 else 0.0,
+            **self.details
+        }
+
+    def span(self) -> Dict:
+        """The stage as a trace span: wall-clock start, duration and bytes"""
+        return {
+            'name': self.name,
+            'start': self.wall_started,
+            'duration': self.elapsed,
+            'bytes': self.bytes_done,
+            'ok': self.ok,
+            'thread': self.thread,
+            **self.context
+        }
+
+    def __enter__(self) -> 'StageTracker':
+        self.telemetry._push(self)
+        with self._lock:
+            event = self._event(self.started)
+        self.telemetry._notify(event)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.telemetry._pop(self)
+        if exc_type is not None:
+            self.ok = False
+        self.ended = time.monotonic()
+        self.cpu_time = time.process_time() - self.cpu_started
+        with self._lock:
+            event = self._event(self.ended)
+        self.telemetry._notify(event)
+        self.telemetry._record_span(self)
+
+class Telemetry:
+    """Collects per-stage progress and timings of an installer run
+
+    Stages report bytes processed through a StageTracker; every update is
+    passed to the registered listeners as a dict with ``stage``,
+    ``bytes_done``, ``bytes_total``, ``rate`` and ``avg_rate`` (bytes/s),
+    ``eta`` (seconds or None), ``elapsed`` and ``done``. A stage's first
+    event, with ``elapsed`` 0, is sent when it starts. Listeners run on
+    the thread doing the work and should return quickly.
+
+    Every finished stage is also logged as a trace span (a record with a
+    ``span`` attribute) to the ``utils.telemetry.trace`` logger, so the
+    JSON log collects the spans of every install; ``utils.trace`` turns
+    them into a Chrome trace.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.trace_logger = logging.getLogger(f"{__name__}.trace")
+        self.stages: List[StageTracker] = []
+        self._listeners: List[Callable[[Dict], None]] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def add_listener(self, listener: Callable[[Dict], None]):
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[Dict], None]):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def _notify(self, event: Dict):
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                self.logger.warning(f"Progress listener failed: {e}")
+
+    def _record_span(self, tracker: StageTracker):
+        span = tracker.span()
+        self.trace_logger.info(
+            f"{span['name']}: {span['duration']:.3f}s, {span['bytes']} bytes",
+            extra={'span': span}
+        )
+
+    def stage(self, name: str, total_bytes: Optional[int] = None) -> StageTracker:
+        """Start timing a stage; use as a context manager"""
+        tracker = StageTracker(self, name, total_bytes)
+        with self._lock:
+            self.stages.append(tracker)
+        return tracker
+
+    def _push(self, tracker: StageTracker):
+        self._local.stack = getattr(self._local, 'stack', []) + [tracker]
+
+    def _pop(self, tracker: StageTracker):
+        stack = getattr(self._local, 'stack', [])
+        if tracker in stack:
+            stack.remove(tracker)
+
+    def current(self) -> StageTracker:
+        """The innermost stage running on this thread
+
+        Outside of any stage a detached tracker is returned, so progress
+        can always be reported without checks.
+        """
+        stack = getattr(self._local, 'stack', [])
+        if stack:
+            return stack[-1]
+        return StageTracker(self, "untracked")
+
+    def reset(self):
+        """Forget the stages of the previous run"""
+        with self._lock:
+            self.stages = []
+
+    def summary(self) -> List[Dict]:
+        """Per-stage timings of the current run"""
+        with self._lock:
+            return [stage.summary() for stage in self.stages]
+
+    def spans(self) -> List[Dict]:
+        """Trace spans of the finished stages of the current run"""
+        with self._lock:
+            return [stage.span() for stage in self.stages if stage.ended is not None]
+
+    def log_summary(self):
+        """Log a per-stage timing table for the current run"""
+        summary = self.summary()
+        total = sum(stage['duration'] for stage in summary)
+        self.logger.info(f"Stage timings ({total:.1f}s total):")
+        for stage in summary:
+            rate = f", {stage['avg_rate'] / 1e6:.1f} MB/s" if stage['bytes'] else ""
+            status = "" if stage['ok'] else " (failed)"
+            self.logger.info(
+                f"  {stage['stage']:<20} {stage['duration']:8.2f}s "
+                f"{stage['bytes']:>14} bytes{rate}{status}"
+            )
+
+def timed_stage(name: str):
+    """Run a method of an object with a ``telemetry`` attribute as a stage
+
+    The stage is marked failed when the method returns a falsy result or
+    raises.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.telemetry.stage(name) as stage:
+                result = method(self, *args, **kwargs)
+                stage.ok = bool(result)
+                return result
+        return wrapper
+    return decorator
+
+def format_progress(event: Dict) -> str:
+    """Human-readable throughput and ETA of a progress event"""
+    text = f"{event['rate'] / 1e6:.1f} MB/s"
+    if event['eta'] is not None:
+        minutes, seconds = divmod(int(event['eta']), 60)
+        text += f", ETA {minutes}:{seconds:02d}"
+    return text
@@ -0,0 +1,72 @@
+import json
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+from utils.logger import LOG_FILE
+
+def read_spans(paths: Iterable[Path]) -> List[Dict]:
+    """Collect the trace spans from JSON log files (rotated ones included)"""
+    spans = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(entry, dict) and 'span' in entry:
+                    spans.append(entry['span'])
+    return sorted(spans, key=lambda span: span['start'])
+
+def chrome_trace(spans: List[Dict]) -> Dict:
+    """Convert spans to the Chrome trace event format
+
+    Each install becomes a process and each device (or, without one, each
+    thread) a track in it, so chrome://tracing or Perfetto shows the
+    stages of many installs side by side. Times are in microseconds.
+    """
+    events = []
+    processes: Dict[str, int] = {}
+    tracks: Dict[tuple, int] = {}
+    for span in spans:
+        install = span.get('install_id') or "untracked"
+        if install not in processes:
+            processes[install] = len(processes) + 1
+            events.append({'ph': 'M', 'name': 'process_name', 'pid': processes[install],
+                           'args': {'name': f"install {install}"}})
+        pid = processes[install]
+        track = span.get('device') or span.get('thread') or "main"
+        if (pid, track) not in tracks:
+            tracks[(pid, track)] = len(tracks) + 1
+            events.append({'ph': 'M', 'name': 'thread_name', 'pid': pid, 'tid': tracks[(pid, track)],
+                           'args': {'name': track}})
+        duration = span['duration']
+        events.append({
+            'ph': 'X',
+            'name': span['name'],
+            'cat': 'stage',
+            'pid': pid,
+            'tid': tracks[(pid, track)],
+            'ts': round(span['start'] * 1e6),
+            'dur': round(duration * 1e6),
+            'args': {
+                'bytes': span['bytes'],
+                'ok': span['ok'],
+                'rate_mb_s': round(span['bytes'] / duration / 1e6, 1) if duration > 0 else 0.0
+            }
+        })
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def write_chrome_trace(spans: List[Dict], path: Path):
+    with open(path, 'w') as f:
+        json.dump(chrome_trace(spans), f)
+
+if __name__ == "__main__":
+    # python -m utils.trace trace.json [logs/installer.log*]
+    output = Path(sys.argv[1])
+    logs = [Path(arg) for arg in sys.argv[2:]] or sorted(LOG_FILE.parent.glob(f"{LOG_FILE.name}*"))
+    spans = read_spans(logs)
+    write_chrome_trace(spans, output)
+    installs = len({span.get('install_id') for span in spans})
+    print(f"{output}: {len(spans)} stages of {installs} installs from {len(logs)} log files")
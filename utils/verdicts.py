@@ -0,0 +1,5 @@
+# Verdicts of a card probe (see utils.card_probe); kept free of imports so
+# the GUI can compare against them without loading the probe
+PASS, WARN, FAIL = 'pass', 'warn', 'fail'
+# Verdict of a probe stopped before it could judge the card
+CANCELLED = 'cancelled'
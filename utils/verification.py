@@ -0,0 +1,453 @@
+import hashlib
+import logging
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Tuple
+
+from utils.config_bundle import MANIFEST_PATH, drive_root
+from utils.overlay import DeviceReader, ImageReader, PatchSet
+from utils.partitions import SECTOR_SIZE, find_fat_partition, is_fat_boot_sector, read_partitions
+
+if TYPE_CHECKING:
+    from utils.fat import FatVolume
+    from utils.merkle import ChunkManifest
+
+# Each tier also runs the checks of the tiers before it
+TIERS = ('quick', 'standard', 'full')
+
+# ext2/3/4 superblock: 1 KiB into the partition, magic at byte 56
+EXT_SUPERBLOCK = 1024
+EXT_MAGIC = 0xef53
+
+# Mismatching offsets listed in a report item
+MAX_OFFSETS = 20
+
+def _item(name: str, tier: str, status: str, detail: str = "", duration: float = 0.0,
+          **extra) -> Dict:
+    return {'item': name, 'tier': tier, 'status': status, 'detail': detail,
+            'duration': round(duration, 3), **extra}
+
+def _sha256(data) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def _ext_identity(superblock: bytes) -> bytes:
+    """Block count and UUID of an ext superblock; mount times and counts change"""
+    return (superblock[EXT_SUPERBLOCK + 4:EXT_SUPERBLOCK + 8]
+            + superblock[EXT_SUPERBLOCK + 104:EXT_SUPERBLOCK + 120])
+
+class InstallationVerifier:
+    """Check a written card against the image and configuration it came from
+
+    The checks come in tiers, each including the ones before it:
+
+    - ``quick``: the partition table and the superblock of every
+      filesystem on the card
+    - ``standard``: every configuration file against its manifest and
+      every file of the image's boot partition against the card
+    - ``full``: the whole image, hashed chunk by chunk on the card and
+      compared with the image's chunk manifest (or the image itself)
+
+    Files are read from ``mount`` if the card is mounted, otherwise from
+    its FAT partition through the raw ``device``. All checks share one
+    thread pool; file checks are queued first so they run while the
+    device ranges are still being hashed. ``run()`` returns a report with
+    one entry per check, so a failed card shows what exactly differs.
+
+    ``patches`` are the configuration sectors written over the image.
+    Without them the configuration was written through the filesystem,
+    which changes the boot partition, so the full tier leaves it out.
+    ``ranges`` restricts the full tier to the image's mapped ranges when
+    a block map left the rest unwritten.
+    """
+
+    def __init__(self, device: Optional[str] = None, mount: Optional[str] = None,
+                 image_path: Optional[Path] = None, patches: Optional[PatchSet] = None,
+                 expected: Optional[Dict[str, bytes]] = None,
+                 manifest: Optional['ChunkManifest'] = None,
+                 ranges: Optional[List[Tuple[int, int]]] = None,
+                 chunk_size: int = 4 * 1024 * 1024, workers: Optional[int] = None,
+                 progress: Optional[Callable[[int], None]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.device = device
+        self.mount = mount
+        self.image_path = Path(image_path) if image_path else None
+        self.patches = patches or PatchSet()
+        self.expected = expected
+        self.manifest = manifest
+        self.ranges = ranges
+        self.chunk_size = manifest.chunk_size if manifest else chunk_size
+        self.workers = workers or min(8, (os.cpu_count() or 1) * 2)
+        self.progress = progress
+        self._done = 0
+        self._progress_lock = threading.Lock()
+        self._device: Optional[DeviceReader] = None
+        self._image: Optional[ImageReader] = None
+
+    # Readers
+
+    def _read_image(self, offset: int, length: int) -> bytes:
+        """The image as written: image data with the patches laid over it"""
+        return self.patches.apply(offset, self._image.read(offset, length))
+
+    def _open(self, items: List[Dict]):
+        if self.device and not os.path.isdir(self.device):
+            try:
+                self._device = DeviceReader(self.device)
+            except OSError as e:
+                items.append(_item('device', 'quick', 'failed', f"Cannot open {self.device}: {e}"))
+        if self.image_path:
+            self._image = ImageReader(self.image_path)
+
+    def _close(self):
+        for reader in (self._device, self._image):
+            if reader is not None:
+                reader.close()
+        self._device = self._image = None
+
+    def _advance(self, length: int):
+        with self._progress_lock:
+            self._done += length
+            done = self._done
+        if self.progress:
+            self.progress(done)
+
+    def _submit(self, pool: ThreadPoolExecutor, name: str, tier: str, check: Callable, *args):
+        """Run a check on the pool; an exception fails only that item"""
+        def run() -> Dict:
+            started = time.monotonic()
+            try:
+                return check(*args)
+            except Exception as e:
+                return _item(name, tier, 'failed', f"Check failed: {e}", time.monotonic() - started)
+        return pool.submit(run)
+
+    # Quick: partition table and superblocks
+
+    @staticmethod
+    def _layout(partitions: List[Dict]) -> List[Tuple]:
+        return [(p['scheme'], str(p['type']), p['offset'], p['size']) for p in partitions]
+
+    def _check_partition_table(self) -> Dict:
+        started = time.monotonic()
+        found = read_partitions(self._device.read)
+        if self._image is not None:
+            wanted = read_partitions(self._read_image)
+            if self._layout(found) != self._layout(wanted):
+                return _item('partition_table', 'quick', 'failed',
+                             f"Card has {self._layout(found)}, image has {self._layout(wanted)}",
+                             time.monotonic() - started)
+        elif not found and not is_fat_boot_sector(self._device.read(0, SECTOR_SIZE)):
+            return _item('partition_table', 'quick', 'failed', "No partition table on the card",
+                         time.monotonic() - started)
+        return _item('partition_table', 'quick', 'ok', f"{len(found)} partitions",
+                     time.monotonic() - started)
+
+    def _check_superblock(self, name: str, offset: int) -> Dict:
+        started = time.monotonic()
+        found = self._device.read(offset, EXT_SUPERBLOCK * 2)
+        wanted = self._read_image(offset, EXT_SUPERBLOCK * 2) if self._image is not None else None
+        reference = wanted if wanted is not None else found
+
+        if is_fat_boot_sector(reference[:SECTOR_SIZE]):
+            if not is_fat_boot_sector(found[:SECTOR_SIZE]):
+                status, detail = 'failed', "FAT boot sector is damaged"
+            # The geometry (BPB); the OS may set the dirty flag after it
+            elif wanted is not None and found[11:36] != wanted[11:36]:
+                status, detail = 'failed', "FAT geometry differs from the image"
+            else:
+                status, detail = 'ok', "FAT"
+        elif len(reference) >= EXT_SUPERBLOCK + 58 and \
+                struct.unpack_from("<H", reference, EXT_SUPERBLOCK + 56)[0] == EXT_MAGIC:
+            if len(found) < EXT_SUPERBLOCK + 58 or \
+                    struct.unpack_from("<H", found, EXT_SUPERBLOCK + 56)[0] != EXT_MAGIC:
+                status, detail = 'failed', "ext superblock is damaged"
+            elif wanted is not None and _ext_identity(found) != _ext_identity(wanted):
+                status, detail = 'failed', "ext superblock differs from the image"
+            else:
+                status, detail = 'ok', "ext"
+        else:
+            status, detail = 'skipped', "Unknown filesystem"
+        return _item(name, 'quick', status, detail, time.monotonic() - started)
+
+    def _submit_quick(self, pool: ThreadPoolExecutor) -> list:
+        futures = [self._submit(pool, 'partition_table', 'quick', self._check_partition_table)]
+        source = self._read_image if self._image is not None else self._device.read
+        partitions = read_partitions(source)
+        if not partitions:
+            # A superfloppy: one filesystem at the start of the card
+            partitions = [{'offset': 0}]
+        for index, partition in enumerate(partitions, 1):
+            name = f"filesystem:{index}"
+            futures.append(self._submit(pool, name, 'quick', self._check_superblock, name, partition['offset']))
+        return futures
+
+    # Standard: configuration and boot files
+
+    def _card_volume(self) -> Optional['FatVolume']:
+        from utils.fat import FatVolume
+        partition = find_fat_partition(self._device.read)
+        return FatVolume(self._device.read, partition['offset']) if partition else None
+
+    def _card_file(self, volume: Optional['FatVolume'], path: str) -> Optional[bytes]:
+        if self.mount:
+            try:
+                return (drive_root(self.mount) / path).read_bytes()
+            except OSError:
+                return None
+        return volume.read_file(path) if volume is not None else None
+
+    def _check_file(self, name: str, volume: Optional['FatVolume'], path: str,
+                    size: int, digest: str) -> Dict:
+        started = time.monotonic()
+        data = self._card_file(volume, path)
+        if data is None:
+            status, detail = 'failed', "Missing on the card"
+        elif len(data) != size:
+            status, detail = 'failed', f"Size {len(data)}, expected {size}"
+        elif _sha256(data) != digest:
+            status, detail = 'failed', "Content differs"
+        else:
+            status, detail = 'ok', f"{size} bytes"
+        return _item(name, 'standard', status, detail, time.monotonic() - started)
+
+    def _expected_config(self, volume: Optional['FatVolume']) -> Optional[Dict[str, Tuple[int, str]]]:
+        """(size, sha256) of every configuration file, from the bundle or the card's manifest"""
+        import json
+        if self.expected:
+            return {path: (len(data), _sha256(data)) for path, data in self.expected.items()}
+        data = self._card_file(volume, MANIFEST_PATH)
+        if data is None:
+            return None
+        files = json.loads(data)['files']
+        return {path: (entry['size'], entry['sha256']) for path, entry in files.items()}
+
+    def _walk(self, volume: 'FatVolume', directory: int, prefix: str, depth: int = 0) -> Iterator[str]:
+        if depth > 16:
+            return
+        for entry in volume.list_directory(directory):
+            path = f"{prefix}{entry.name}"
+            if entry.is_directory:
+                yield from self._walk(volume, entry.cluster, path + "/", depth + 1)
+            else:
+                yield path
+
+    def _submit_standard(self, pool: ThreadPoolExecutor, items: List[Dict]) -> list:
+        from utils.fat import FatVolume
+        futures = []
+        volume = None
+        if not self.mount:
+            volume = self._card_volume()
+            if volume is None:
+                items.append(_item('config', 'standard', 'failed', "No FAT partition on the card"))
+                return futures
+
+        try:
+            config = self._expected_config(volume)
+        except (ValueError, KeyError) as e:
+            config = None
+            items.append(_item('config', 'standard', 'failed', f"Unreadable configuration manifest: {e}"))
+        else:
+            if config is None:
+                items.append(_item('config', 'standard', 'failed', "No configuration manifest on the card"))
+        for path, (size, digest) in (config or {}).items():
+            name = f"config:{path}"
+            futures.append(self._submit(pool, name, 'standard', self._check_file, name, volume, path, size, digest))
+
+        if self._image is None:
+            items.append(_item('boot', 'standard', 'skipped', "No image to compare against"))
+            return futures
+        partition = find_fat_partition(self._read_image)
+        if partition is None:
+            items.append(_item('boot', 'standard', 'skipped', "The image has no boot partition"))
+            return futures
+        image_volume = FatVolume(self._read_image, partition['offset'])
+        checked = {path.lower() for path in config or {}}
+
+        def check_boot_file(name: str, path: str) -> Dict:
+            data = image_volume.read_file(path)
+            return self._check_file(name, volume, path, len(data), _sha256(data))
+
+        for path in self._walk(image_volume, image_volume.root_cluster, ""):
+            if path.lower() not in checked:
+                name = f"boot:{path}"
+                futures.append(self._submit(pool, name, 'standard', check_boot_file, name, path))
+        return futures
+
+    # Full: the whole image on the device
+
+    def _excluded(self) -> List[Tuple[int, int]]:
+        """Ranges the filesystem configuration legitimately changed"""
+        if self.mount and not self.patches:
+            partition = find_fat_partition(self._read_image)
+            if partition is not None:
+                return [(partition['offset'], partition['size'] or self._image_size())]
+        return []
+
+    def _image_size(self) -> int:
+        if self.manifest:
+            return self.manifest.image_size
+        return os.path.getsize(self.image_path)
+
+    def _pieces(self, offset: int, length: int, excluded: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """Parts of a chunk to compare, as (start, end) offsets"""
+        end = offset + length
+        ranges = self.ranges if self.ranges is not None else [(offset, length)]
+        pieces = [(max(start, offset), min(start + size, end)) for start, size in ranges
+                  if start < end and start + size > offset]
+        for ex_start, ex_size in excluded:
+            ex_end = ex_start + ex_size
+            remaining = []
+            for start, stop in pieces:
+                if stop <= ex_start or start >= ex_end:
+                    remaining.append((start, stop))
+                    continue
+                if start < ex_start:
+                    remaining.append((start, ex_start))
+                if stop > ex_end:
+                    remaining.append((ex_end, stop))
+            pieces = remaining
+        return pieces
+
+    @staticmethod
+    def _hash_pieces(data, offset: int, pieces: List[Tuple[int, int]]) -> str:
+        digest = hashlib.sha256()
+        for start, stop in pieces:
+            digest.update(data[start - offset:stop - offset])
+        return digest.hexdigest()
+
+    def _check_chunk(self, offset: int, length: int, excluded: List[Tuple[int, int]],
+                     expected: Optional[str] = None, image_data: Optional[bytes] = None) -> Optional[bool]:
+        """Whether a chunk matches; None if nothing of it is compared"""
+        try:
+            pieces = self._pieces(offset, length, excluded)
+            if not pieces:
+                return None
+            whole = pieces == [(offset, offset + length)]
+            if expected is None or not whole or self._patched(offset, length):
+                if image_data is None:
+                    image_data = self._read_image(offset, length)
+                expected = self._hash_pieces(image_data, offset, pieces)
+            found = self._device.read(offset, length)
+            if len(found) < length:
+                return False
+            return self._hash_pieces(found, offset, pieces) == expected
+        finally:
+            self._advance(length)
+
+    def _patched(self, offset: int, length: int) -> bool:
+        end = offset + length
+        return any(start < end and start + len(data) > offset for start, data in self.patches)
+
+    def _image_chunks(self) -> Iterator[bytes]:
+        """The patched image as a stream of chunks"""
+        from utils.decompress import decompressed_chunks, file_chunks
+        from utils.incremental import rechunk
+        chunks = decompressed_chunks(file_chunks(self.image_path, self.chunk_size), self._image.compression)
+        return rechunk(self.patches.patch_chunks(chunks), self.chunk_size)
+
+    def _run_full(self, pool: ThreadPoolExecutor, items: List[Dict]):
+        started = time.monotonic()
+        excluded = self._excluded()
+        futures = []
+        if self.manifest:
+            # Published hashes; only patched or partly compared chunks read the image
+            for index, digest in enumerate(self.manifest.chunks):
+                offset, length = self.manifest.chunk_range(index)
+                futures.append((offset, pool.submit(self._check_chunk, offset, length, excluded, digest)))
+        else:
+            # Stream the image once, keeping a bounded number of chunks in flight
+            slots = threading.BoundedSemaphore(self.workers * 2)
+
+            def check(offset: int, data: bytes) -> Optional[bool]:
+                try:
+                    return self._check_chunk(offset, len(data), excluded, image_data=data)
+                finally:
+                    slots.release()
+
+            offset = 0
+            for chunk in self._image_chunks():
+                slots.acquire()
+                futures.append((offset, pool.submit(check, offset, chunk)))
+                offset += len(chunk)
+
+        bad, compared = [], 0
+        for offset, future in futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                self.logger.warning(f"Checking the chunk at offset {offset} failed: {e}")
+                result = False
+            if result is None:
+                continue
+            compared += 1
+            if not result:
+                bad.append(offset)
+        detail = f"{compared - len(bad)} of {compared} chunks match"
+        if excluded:
+            detail += ", boot partition left out (configured through the filesystem)"
+        items.append(_item('image_data', 'full', 'failed' if bad else 'ok', detail,
+                           time.monotonic() - started, offsets=bad[:MAX_OFFSETS]))
+
+    # Report
+
+    def run(self, tier: str = 'standard') -> Dict:
+        """Run the checks of a tier; returns the report"""
+        if tier not in TIERS:
+            raise ValueError(f"Unknown verification tier '{tier}', expected one of {', '.join(TIERS)}")
+        level = TIERS.index(tier)
+        started = time.monotonic()
+        items: List[Dict] = []
+        futures = []
+        try:
+            self._open(items)
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="verify") as pool:
+                if self._device is not None:
+                    futures += self._submit_quick(pool)
+                elif not items:
+                    items.append(_item('device', 'quick', 'skipped', "No raw device to check"))
+                if level >= 1 and (self.mount or self._device is not None):
+                    futures += self._submit_standard(pool, items)
+                if level >= 2:
+                    if self._device is None:
+                        items.append(_item('image_data', 'full', 'skipped', "No raw device to check"))
+                    elif self._image is None:
+                        items.append(_item('image_data', 'full', 'skipped', "No image to compare against"))
+                    else:
+                        self._run_full(pool, items)
+                for future in futures:
+                    items.append(future.result())
+        except Exception as e:
+            items.append(_item('verification', tier, 'failed', f"Verification aborted: {e}"))
+        finally:
+            self._close()
+
+        order = {name: index for index, name in enumerate(TIERS)}
+        items.sort(key=lambda item: order.get(item['tier'], 0))
+        counts = {status: sum(item['status'] == status for item in items)
+                  for status in ('ok', 'failed', 'skipped')}
+        return {
+            'tier': tier,
+            'ok': counts['failed'] == 0,
+            'duration': round(time.monotonic() - started, 3),
+            'counts': counts,
+            'items': items
+        }
+
+def failures(report: Dict) -> List[Dict]:
+    """The failed items of a report"""
+    return [item for item in report['items'] if item['status'] == 'failed']
+
+if __name__ == "__main__":
+    # python -m utils.verification /dev/sdX [system.img] [tier]
+    import json
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    image = sys.argv[2] if len(sys.argv) > 2 else None
+    report = InstallationVerifier(sys.argv[1], image_path=image).run(sys.argv[3] if len(sys.argv) > 3 else 'standard')
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report['ok'] else 1)
@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+from utils.raw_writer import RawWriter
+
+TUNING_PATH = Path("cache") / "write_tuning.json"
+TUNING_VERSION = 1
+
+BLOCK_SIZES = (512 * 1024,) + tuple(size * 1024 * 1024 for size in (1, 2, 4, 8, 16))
+QUEUE_DEPTHS = (1, 2, 4, 8)
+DEFAULT_SETTINGS = {'block_size': 4 * 1024 * 1024, 'queue_depth': 4}
+
+# A larger block size or queue depth has to be this much faster to be picked
+MARGIN = 0.05
+
+def tuning_keys(identity: Dict) -> List[str]:
+    """Keys a device's tuning is stored under, most specific first"""
+    keys = []
+    if identity.get('serial'):
+        keys.append(f"serial:{identity['serial']}")
+    if identity.get('model'):
+        keys.append(f"model:{identity['model']}")
+    return keys
+
+class WriteTuner:
+    """Find the block size and queue depth a card writes fastest with
+
+    Each trial writes ``sample`` (at least two blocks of it) to the start
+    of the target through a writer from ``make_writer(block_size,
+    queue_depth)`` and times it up to the final fsync. Block sizes are
+    tried at the default queue depth, then queue depths at the fastest
+    block size. Smaller settings are preferred unless a larger one is
+    faster by ``MARGIN``, so noise does not buy bigger buffers.
+
+    The sample should be the data the target receives anyway (the head of
+    the image), so calibration leaves nothing behind.
+    """
+
+    def __init__(self, make_writer: Callable[[int, int], RawWriter], sample: bytes,
+                 sample_bytes: int = 8 * 1024 * 1024,
+                 block_sizes: Sequence[int] = BLOCK_SIZES,
+                 queue_depths: Sequence[int] = QUEUE_DEPTHS):
+        self.logger = logging.getLogger(__name__)
+        self.make_writer = make_writer
+        self.sample = memoryview(sample)
+        self.sample_bytes = sample_bytes
+        # Sizes with fewer than two blocks of sample say little about the card
+        self.block_sizes = [size for size in sorted(block_sizes) if 2 * size <= len(sample)]
+        self.queue_depths = sorted(queue_depths)
+        self.trials: List[Dict] = []
+
+    def trial(self, block_size: int, queue_depth: int) -> float:
+        """Write the sample with one setting; returns bytes per second"""
+        length = min(len(self.sample), max(self.sample_bytes, 2 * block_size))
+        length -= length % block_size
+        started = time.monotonic()
+        with self.make_writer(block_size, queue_depth) as writer:
+            for offset in range(0, length, block_size):
+                writer.write_at(offset, self.sample[offset:offset + block_size])
+            writer.finish(0)
+        rate = length / max(time.monotonic() - started, 1e-9)
+        self.trials.append({'block_size': block_size, 'queue_depth': queue_depth, 'rate': rate})
+        self.logger.debug(f"Write trial {block_size // 1024} KiB x {queue_depth}: {rate / 1e6:.1f} MB/s")
+        return rate
+
+    def _best(self, settings: List[Dict]) -> Dict:
+        best = None
+        for setting in settings:
+            if best is None or setting['rate'] > best['rate'] * (1 + MARGIN):
+                best = setting
+        return best
+
+    def calibrate(self) -> Optional[Dict]:
+        """The fastest setting with its rate and all trials, or None without enough sample"""
+        if not self.block_sizes:
+            return None
+        self.trials = []
+        depth = DEFAULT_SETTINGS['queue_depth']
+        if depth not in self.queue_depths:
+            depth = self.queue_depths[0]
+        for block_size in self.block_sizes:
+            self.trial(block_size, depth)
+        block_size = self._best(self.trials)['block_size']
+        for queue_depth in self.queue_depths:
+            if queue_depth != depth:
+                self.trial(block_size, queue_depth)
+        best = self._best(sorted(
+            (trial for trial in self.trials if trial['block_size'] == block_size),
+            key=lambda trial: trial['queue_depth']
+        ))
+        self.logger.info(
+            f"Fastest write setting: {best['block_size'] // 1024} KiB blocks, "
+            f"{best['queue_depth']} outstanding ({best['rate'] / 1e6:.1f} MB/s, {len(self.trials)} trials)"
+        )
+        return {**best, 'trials': list(self.trials)}
+
+class TuningStore:
+    """Calibrated write settings per device serial and model, kept in a JSON file"""
+
+    def __init__(self, path: Path = TUNING_PATH):
+        self.logger = logging.getLogger(__name__)
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == TUNING_VERSION:
+                return data['devices']
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            self.logger.warning(f"Ignoring unreadable write tuning {self.path}: {e}")
+        return {}
+
+    def get(self, identity: Dict) -> Optional[Dict]:
+        """The stored setting for a device, by serial or else by model"""
+        with self._lock:
+            devices = self._load()
+        for key in tuning_keys(identity):
+            if key in devices:
+                return devices[key]
+        return None
+
+    def put(self, identity: Dict, result: Dict):
+        keys = tuning_keys(identity)
+        if not keys:
+            self.logger.warning(f"No serial or model known for {identity.get('target')}, "
+                                f"its write settings are not stored")
+            return
+        entry = {
+            'block_size': result['block_size'],
+            'queue_depth': result['queue_depth'],
+            'rate': result['rate'],
+            'measured': datetime.now(timezone.utc).isoformat()
+        }
+        with self._lock:
+            devices = self._load()
+            for key in keys:
+                devices[key] = entry
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.path.with_name(self.path.name + ".tmp")
+                with open(tmp_path, 'w') as f:
+                    json.dump({'version': TUNING_VERSION, 'devices': devices}, f, indent=2, sort_keys=True)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                self.logger.warning(f"Could not write write tuning {self.path}: {e}")
+
+if __name__ == "__main__":
+    # Calibrate against each fake device profile
+    import shutil
+    import tempfile
+    from utils.fake_device import PROFILES, FakeDevice
+
+    logging.basicConfig(level=logging.INFO)
+    workdir = Path(tempfile.mkdtemp())
+    try:
+        sample = os.urandom(32 * 1024 * 1024)
+        for name in PROFILES:
+            device = FakeDevice.from_profile(workdir / f"{name}.img", 64 * 1024 * 1024, name).create()
+            tuner = WriteTuner(
+                lambda block_size, queue_depth: device.writer(block_size=block_size,
+                                                              queue_depth=queue_depth,
+                                                              zero_mode='write'),
+                sample
+            )
+            best = tuner.calibrate()
+            print(f"{name:<12} {best['block_size'] // 1024:>6} KiB x {best['queue_depth']}: "
+                  f"{best['rate'] / 1e6:6.1f} MB/s")
+    finally:
+        shutil.rmtree(workdir)